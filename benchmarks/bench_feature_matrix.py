@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+Collecting entity features into a matrix
+
+Compares the groupby-apply pattern (one pd.Series per entity) with
+appending the states to a FeatureMatrixBuilder, both end to end and
+for the collection step alone (states computed up front).
+
+    python benchmarks/bench_feature_matrix.py --entities 5000 --rows 20
+"""
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import hallmarkfe.supernova as hallmarkfe
+
+
+class CallProcessor(hallmarkfe.HFERuleBasedProcessor,
+                    hallmarkfe.MetricHandlerMixin):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metric_handlers = {
+            'total': lambda args, rows: self.toolz_sum('Duration', rows),
+            'dates': lambda args, rows: self.toolz_count('CallDate', rows),
+        }
+        self.rules = [{
+            'name': 'calls_{}'.format(direction.lower()),
+            'operators': [{
+                'handler': 'handler_table_apply_rule',
+                'level': 1,
+                'params': {
+                    'table': 'calls',
+                    'rule': {'match': 'IN', 'column': 'Direction', 'values': [direction]},
+                    'metrics': [
+                        {'name': 'total', 'handler': 'total'},
+                        {'name': 'dates', 'handler': 'dates'},
+                    ]
+                }
+            }]
+        } for direction in ['Incoming', 'Outgoing', 'Missed']]
+
+
+def make_manager():
+    mgr = hallmarkfe.HFEManager({'sequence': ['calls']})
+    mgr.add_processor('calls', CallProcessor(conf={
+        'name': 'calls',
+        'owner': 'marketing',
+        'manager': 'Manager'
+    }))
+    return mgr
+
+
+def make_calls(entities, rows, seed=0):
+    rng = np.random.RandomState(seed)
+    n = entities * rows
+    return pd.DataFrame({
+        'In': rng.randint(0, entities, n).astype(str),
+        'Direction': rng.choice(['Incoming', 'Outgoing', 'Missed'], n),
+        'CallDate': rng.choice(['2010-12-25', '2010-12-26', '2010-12-27'], n),
+        'Duration': rng.randint(0, 600, n),
+    })
+
+
+def with_series(mgr, df):
+    def summarize(rows):
+        state = hallmarkfe.HFEAtomicState()
+        state.set_data('calls', rows.to_dict('records'))
+        mgr.process(state)
+        return pd.Series(state.get_all_features())
+    return df.groupby('In').apply(summarize).unstack()
+
+
+def with_builder(mgr, df):
+    builder = hallmarkfe.FeatureMatrixBuilder(key_columns=['In'])
+    for key, rows in df.groupby(['In']):
+        state = hallmarkfe.HFEAtomicState()
+        state.set_data('calls', rows.to_dict('records'))
+        mgr.process(state)
+        builder.append_state(state, key[0])
+    return builder.to_frame()
+
+
+def collect_series(states):
+    keys = [key for key, _ in states]
+    series = [pd.Series(state.get_all_features()) for _, state in states]
+    return pd.concat(series, keys=keys).unstack()
+
+
+def collect_builder(states):
+    builder = hallmarkfe.FeatureMatrixBuilder(key_columns=['In'])
+    for key, state in states:
+        builder.append_state(state, key)
+    return builder.to_frame()
+
+
+def timeit(func, args, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--entities', type=int, default=5000)
+    parser.add_argument('--rows', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    mgr = make_manager()
+    df = make_calls(args.entities, args.rows)
+
+    states = []
+    for key, rows in df.groupby(['In']):
+        state = hallmarkfe.HFEAtomicState()
+        state.set_data('calls', rows.to_dict('records'))
+        mgr.process(state)
+        states.append((key[0], state))
+
+    results = []
+    for name, func, fargs in [
+            ('groupby_apply', with_series, (mgr, df)),
+            ('feature_matrix', with_builder, (mgr, df)),
+            ('collect_series', collect_series, (states,)),
+            ('collect_feature_matrix', collect_builder, (states,))]:
+        results.append({
+            'method': name,
+            'entities': args.entities,
+            'rows': args.rows,
+            'seconds': timeit(func, fargs, args.repeat)
+        })
+
+    json.dump(results, sys.stdout, indent=4)
+    print()
+
+
+if __name__ == "__main__":
+    main()
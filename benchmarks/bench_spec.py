@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Specification loading benchmark
+
+Times parse_generic, SpecBase.dump and SpecBase.validate over many
+synthetic specifications handled by a class with and without element
+hooks:
+
+    python benchmarks/bench_spec.py --count 100000
+"""
+import sys
+import json
+import time
+import argparse
+
+import hallmarkfe
+
+
+class Plain(hallmarkfe.SpecBase):
+    schema = "bench:plain:v1"
+
+    def initialize(self):
+        self.required.extend(['id', 'entity', 'tags'])
+
+
+class Hooked(hallmarkfe.SpecBase):
+    schema = "bench:hooked:v1"
+
+    def initialize(self):
+        self.required.extend(['id', 'entity', 'tags'])
+
+    def load_tags(self, value):
+        return list(value)
+
+    def dump_tags(self, value):
+        return list(value)
+
+    def validate_id(self, value):
+        if not isinstance(value, str):
+            raise hallmarkfe.SpecInvalidSpecification("id should be a string")
+
+
+def make_specs(count, schema, extra=10):
+    """
+    Specifications with the required elements and extra ones
+
+    Args:
+      count (int): Number of specifications
+      schema (str): Schema of the handler
+      extra (int): Elements without a hook
+    """
+    specs = []
+    for i in range(count):
+        spec = {
+            'schema': schema,
+            'id': 'feature.{}'.format(i),
+            'name': 'feature{}'.format(i),
+            'description': 'Synthetic feature {}'.format(i),
+            'owner': 'bench@example.com',
+            'entity': 'user',
+            'tags': ['a', 'b'],
+        }
+        for j in range(extra):
+            spec['extra{}'.format(j)] = j
+        specs.append(spec)
+    return specs
+
+
+def timeit(func, repeat):
+    """
+    Best wall time of several runs
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run_suite(args):
+    results = {}
+    for cls in [Plain, Hooked]:
+        specs = make_specs(args.count, cls.schema, args.extra)
+        objs = [hallmarkfe.parse_generic(spec) for spec in specs]
+
+        for name, func in [
+                ('load', lambda: [hallmarkfe.parse_generic(spec) for spec in specs]),
+                ('dump', lambda: [obj.dump() for obj in objs]),
+                ('validate', lambda: [obj.validate() for obj in objs])]:
+            key = '{}.{}'.format(cls.__name__.lower(), name)
+            results[key] = timeit(func, args.repeat)
+            sys.stderr.write("{:16s} count={}: {:.4f}s\n".format(key, args.count, results[key]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--extra', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    json.dump(run_suite(args), sys.stdout, indent=4)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+Memory used by feature states
+
+Compares HFEAtomicState with HFECompactState for many entities that
+hold the same set of features.
+
+    python benchmarks/bench_state_memory.py --entities 100000 --features 20
+"""
+import gc
+import sys
+import json
+import argparse
+import tracemalloc
+
+import hallmarkfe.supernova as hallmarkfe
+
+
+def measure(factory, entities, features):
+    """
+    Bytes allocated to keep the states alive
+    """
+    names = ['feature_{}'.format(i) for i in range(features)]
+    gc.collect()
+    tracemalloc.start()
+    states = []
+    for e in range(entities):
+        state = factory()
+        for i, name in enumerate(names):
+            state.set_feature(name, float(e + i))
+        states.append(state)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del states
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--entities', type=int, default=100000)
+    parser.add_argument('--features', type=int, default=20)
+    args = parser.parse_args()
+
+    index = hallmarkfe.HFEFeatureIndex()
+    results = []
+    for name, factory in [
+            ('HFEAtomicState', hallmarkfe.HFEAtomicState),
+            ('HFECompactState', lambda: hallmarkfe.HFECompactState(index))]:
+        used = measure(factory, args.entities, args.features)
+        results.append({
+            'state': name,
+            'entities': args.entities,
+            'features': args.features,
+            'bytes': used,
+            'bytes_per_entity': used / float(args.entities)
+        })
+
+    json.dump(results, sys.stdout, indent=4)
+    print()
+
+
+if __name__ == "__main__":
+    main()
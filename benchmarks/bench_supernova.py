@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+"""
+Feature engine benchmark suite
+
+Times HFEManager.process (serially and with the thread and process
+executors), table_evaluate_rule and the metric helpers over synthetic
+call logs (see synthetic.py), across combinations of
+entity counts, rows per entity, extra columns and rule depth. Results
+are written as JSON, and can be compared with the results of another
+commit:
+
+    python benchmarks/bench_supernova.py --output base.json
+    python benchmarks/bench_supernova.py --compare base.json --threshold 0.2
+
+With --compare, the exit status is 1 if any case is slower than the
+baseline by more than the threshold.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import itertools
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import hallmarkfe.supernova as hallmarkfe
+from synthetic import make_calls, make_rules
+
+
+class CallProcessor(hallmarkfe.HFERuleBasedProcessor,
+                    hallmarkfe.MetricHandlerMixin):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metric_handlers = {
+            'total': lambda args, rows: self.toolz_sum('Duration', rows),
+            'dates': lambda args, rows: self.toolz_count('CallDate', rows),
+        }
+
+
+class AggregateCallProcessor(CallProcessor):
+    """
+    CallProcessor with picklable handlers, for the process executor
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metric_handlers = {
+            'total': self.aggregate_metric('sum', 'Duration'),
+            'dates': self.aggregate_metric('count', 'CallDate'),
+        }
+
+
+def make_manager(rules):
+    mgr = hallmarkfe.HFEManager({'sequence': ['calls']})
+    proc = CallProcessor(conf={
+        'name': 'calls',
+        'owner': 'marketing',
+        'manager': 'Manager'
+    })
+    proc.rules = rules
+    mgr.add_processor('calls', proc)
+    return mgr
+
+
+def timeit(func, repeat):
+    """
+    Best wall time of several runs
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def bench_process(df, rules, repeat):
+    mgr = make_manager(rules)
+    groups = [rows.to_dict('records') for _, rows in df.groupby(['In'])]
+
+    def run():
+        for rows in groups:
+            state = hallmarkfe.HFEAtomicState()
+            state.set_data('calls', rows)
+            mgr.process(state)
+    return timeit(run, repeat)
+
+
+def bench_executors(df, rules, repeat):
+    """
+    process with two processors per level, run one after the other
+    or concurrently. The process executor sends each state to the
+    workers, so it only pays off for slow processors.
+    """
+    groups = [rows.to_dict('records') for _, rows in df.groupby(['In'])]
+
+    results = {}
+    for executor in [None, 'thread', 'process']:
+        mgr = hallmarkfe.HFEManager({
+            'sequence': ['calls1', 'calls2'],
+            'executor': executor,
+            'max_workers': 2
+        })
+        for name in mgr.sequence:
+            proc = AggregateCallProcessor(conf={
+                'name': name,
+                'owner': name,
+                'manager': 'Manager'
+            })
+            proc.rules = rules
+            mgr.add_processor(name, proc)
+
+        def run():
+            for rows in groups:
+                state = hallmarkfe.HFEAtomicState()
+                state.set_data('calls', rows)
+                mgr.process(state)
+        try:
+            results['executor_{}'.format(executor or 'serial')] = timeit(run, repeat)
+        finally:
+            mgr.close()
+    return results
+
+
+def bench_evaluate(df, rules, repeat):
+    proc = make_manager(rules).processors['calls']
+    records = df.to_dict('records')
+    specs = [rule['operators'][0]['params']['rule'] for rule in rules]
+
+    def run():
+        for spec in specs:
+            for row in records:
+                proc.table_evaluate_rule(row, spec)
+    return timeit(run, repeat)
+
+
+def bench_metrics(df, rules, repeat):
+    proc = make_manager(rules).processors['calls']
+    records = df.to_dict('records')
+
+    results = {}
+    for name, func in [
+            ('toolz_sum', lambda: proc.toolz_sum('Duration', records)),
+            ('toolz_min', lambda: proc.toolz_min('Duration', records)),
+            ('toolz_max', lambda: proc.toolz_max('Duration', records)),
+            ('toolz_avg', lambda: proc.toolz_avg('Duration', records)),
+            ('toolz_count', lambda: proc.toolz_count('CallDate', records))]:
+        results[name] = timeit(func, repeat)
+    return results
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def run_suite(args):
+    cases = []
+    for entities, rows, columns, depth in itertools.product(
+            args.entities, args.rows, args.columns, args.depth):
+        df = make_calls(entities, rows, columns, args.width, args.seed)
+        rules = make_rules(args.rules, depth, seed=args.seed)
+        setting = {
+            'entities': entities,
+            'rows': rows,
+            'columns': columns,
+            'depth': depth,
+            'rules': args.rules,
+        }
+
+        timings = {
+            'process': bench_process(df, rules, args.repeat),
+            'table_evaluate_rule': bench_evaluate(df, rules, args.repeat),
+        }
+        timings.update(bench_executors(df, rules, args.repeat))
+        timings.update(bench_metrics(df, rules, args.repeat))
+
+        for name, seconds in timings.items():
+            case = {'benchmark': name, 'seconds': seconds}
+            case.update(setting)
+            cases.append(case)
+            sys.stderr.write("{benchmark:20s} entities={entities} rows={rows} "
+                             "columns={columns} depth={depth}: {seconds:.4f}s\n".format(**case))
+
+    return {
+        'revision': get_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cases': cases
+    }
+
+
+def case_key(case):
+    return (case['benchmark'], case['entities'], case['rows'],
+            case['columns'], case['depth'], case['rules'])
+
+
+def compare(results, baseline, threshold):
+    """
+    Cases that are slower than the baseline by more than threshold
+    (a fraction)
+    """
+    base = {case_key(c): c['seconds'] for c in baseline['cases']}
+    regressions = []
+    for case in results['cases']:
+        before = base.get(case_key(case))
+        if before is None or before == 0:
+            continue
+        change = case['seconds'] / before - 1
+        if change > threshold:
+            regressions.append(dict(case, baseline=before, change=change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entities', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10, 50])
+    parser.add_argument('--columns', type=int, nargs='+', default=[0, 20])
+    parser.add_argument('--depth', type=int, nargs='+', default=[0, 3])
+    parser.add_argument('--rules', type=int, default=10)
+    parser.add_argument('--width', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='-')
+    parser.add_argument('--compare', default=None,
+                        help="Results of a previous run to compare with")
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = run_suite(args)
+
+    status = 0
+    if args.compare is not None:
+        with open(args.compare) as fd:
+            baseline = json.load(fd)
+        results['baseline'] = baseline.get('revision')
+        results['regressions'] = compare(results, baseline, args.threshold)
+        for case in results['regressions']:
+            sys.stderr.write("Regression {benchmark} entities={entities} rows={rows} "
+                             "columns={columns} depth={depth}: {baseline:.4f}s -> "
+                             "{seconds:.4f}s\n".format(**case))
+        status = 1 if len(results['regressions']) > 0 else 0
+
+    if args.output == '-':
+        json.dump(results, sys.stdout, indent=4)
+        print()
+    else:
+        with open(args.output, 'w') as fd:
+            json.dump(results, fd, indent=4)
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Synthetic call logs and rule sets
+
+Generates call records in the layout of the call_log.csv fixture used
+by hallmarkfe/supernova/tests/test_complex.py, and random rule trees of
+a given depth over them. Run it directly to write the fixture:
+
+    python benchmarks/synthetic.py --entities 100 --rows 10 \\
+        --output hallmarkfe/supernova/tests/fixtures/call_log.csv
+"""
+import sys
+import uuid
+import random
+import argparse
+import datetime
+
+import pandas as pd
+
+DIRECTIONS = ['Incoming', 'Outgoing', 'Missed']
+DAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+TAGS = ['news', 'sports', 'weather', 'finance', 'travel', 'music']
+
+
+def make_calls(entities, rows, columns=0, width=8, seed=0):
+    """
+    Call records of many entities
+
+    Args:
+      entities (int): Number of callers (In)
+      rows (int): Average number of records per caller
+      columns (int): Extra string columns (Extra0, Extra1...)
+      width (int): Length of the values of the extra columns
+      seed (int): Random seed
+
+    Returns a DataFrame. Duration is in seconds.
+    """
+    rng = random.Random(seed)
+    callers = ['{:010d}'.format(rng.randrange(10**9, 10**10)) for _ in range(entities)]
+    towers = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(max(1, entities // 10))]
+    start = datetime.datetime(2010, 12, 25)
+    alphabet = 'abcdefghijklmnopqrstuvwxyz'
+
+    records = []
+    for _ in range(entities * rows):
+        when = start + datetime.timedelta(seconds=rng.randrange(0, 7 * 86400))
+        record = {
+            'In': rng.choice(callers),
+            'Out': '{:010d}'.format(rng.randrange(10**9, 10**10)),
+            'Direction': rng.choice(DIRECTIONS),
+            'CallDate': when.strftime('%Y-%m-%d'),
+            'CallTime': when.strftime('%H:%M:%S.%f'),
+            'DOW': DAYS[when.weekday()],
+            'Duration': rng.randrange(0, 3600),
+            'TowerID': rng.choice(towers),
+            'TowerLat': round(rng.uniform(32.5, 33.0), 6),
+            'TowerLon': round(rng.uniform(-97.0, -96.5), 6),
+            'Tags': ', '.join(rng.sample(TAGS, rng.randrange(0, 3))),
+        }
+        for i in range(columns):
+            record['Extra{}'.format(i)] = ''.join(rng.choice(alphabet) for _ in range(width))
+        records.append(record)
+
+    return pd.DataFrame(records)
+
+
+def format_duration(seconds):
+    """
+    Duration in the H:MM:SS format read by the tests
+    """
+    return str(datetime.timedelta(seconds=seconds))
+
+
+def make_leaf(rng):
+    kind = rng.randrange(4)
+    if kind == 0:
+        return {'match': 'IN', 'column': 'Direction',
+                'values': rng.sample(DIRECTIONS, rng.randrange(1, 3))}
+    if kind == 1:
+        return {'match': rng.choice(['GT', 'LT']), 'column': 'Duration',
+                'values': rng.randrange(0, 3600)}
+    if kind == 2:
+        return {'match': rng.choice(['CONTAINS_ANY', 'CONTAINS_NONE']), 'column': 'Tags',
+                'values': rng.sample(TAGS, rng.randrange(1, 4))}
+    return {'match': rng.choice(['IN', 'NOTIN']), 'column': 'DOW',
+            'values': rng.sample(DAYS, rng.randrange(1, 4))}
+
+
+def make_rule(depth, fanout=2, seed=0, rng=None):
+    """
+    Random rule tree over the call records
+
+    Args:
+      depth (int): Levels of logical operators. 0 gives a single match.
+      fanout (int): Children per logical operator
+      seed (int): Random seed
+    """
+    if rng is None:
+        rng = random.Random(seed)
+    if depth == 0:
+        return make_leaf(rng)
+    return {
+        'match': rng.choice(['AND', 'OR', 'NOR']),
+        'values': [make_rule(depth - 1, fanout, rng=rng) for _ in range(fanout)]
+    }
+
+
+def make_rules(count, depth, fanout=2, seed=0):
+    """
+    Rules in the format of the complex1.json spec, each with a sum
+    and a unique count over the matched records
+
+    Args:
+      count (int): Number of rules
+      depth (int): Depth of each rule tree (see make_rule)
+      fanout (int): Children per logical operator
+      seed (int): Random seed
+    """
+    rng = random.Random(seed)
+    return [{
+        'name': 'rule{}'.format(i),
+        'operators': [{
+            'handler': 'handler_table_apply_rule',
+            'level': 1,
+            'params': {
+                'table': 'calls',
+                'rule': make_rule(depth, fanout, rng=rng),
+                'metrics': [
+                    {'name': 'total', 'handler': 'total'},
+                    {'name': 'dates', 'handler': 'dates'},
+                ]
+            }
+        }]
+    } for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entities', type=int, default=100)
+    parser.add_argument('--rows', type=int, default=10)
+    parser.add_argument('--columns', type=int, default=0)
+    parser.add_argument('--width', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='-')
+    args = parser.parse_args()
+
+    df = make_calls(args.entities, args.rows, args.columns, args.width, args.seed)
+    df = df.drop(columns=['Tags'])
+    df['Duration'] = df['Duration'].apply(format_duration)
+    df.to_csv(sys.stdout if args.output == '-' else args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
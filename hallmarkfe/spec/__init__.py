@@ -19,7 +19,7 @@ from .exceptions import *
 
 from . import exceptions, base 
 
-__all__ = ['parse_generic', 'register', 'unregister'] + \
+__all__ = ['parse_generic', 'parse_stream', 'register', 'unregister'] + \
           base.__all__ + \
           exceptions.__all__
 
@@ -43,6 +43,24 @@ def unregister(cls):
 def register(cls):
     SpecRegistry.register(cls)
 =======
+def parse_stream(arg, fmt=None, split=True):
+    """
+    Create Hallmark specification objects from a file with many
+    documents (YAML documents separated by '---', or a JSON array),
+    one document at a time
+
+    :param object arg: File location (a string) or a file object
+    :param str fmt: 'json' or 'yaml'. Taken from the file name by default.
+    :param bool split: Load the elements of a JSON array one at a
+          time. With False, the array is loaded by one handler, and
+          the result matches parse_generic.
+
+    """
+    for dct, cls in SpecRegistry.iter_handlers_generic(arg, fmt, split):
+        obj = cls()
+        obj.load(dct)
+        yield obj
+
 def register(cls):
     """
     Register specification handler
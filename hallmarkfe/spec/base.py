@@ -19,7 +19,13 @@ import yaml
 import collections 
 import abc
 import glob
+import hashlib
+import pickle
+import codecs
+import concurrent.futures
 >>>>>>> 9c2e4ba7a27d033f201f4f7493648ed2b26341f3
+import types
+import inspect
 import texttable 
 from .exceptions import *
 from .utils import *
@@ -38,19 +44,46 @@ class SpecRegistry(object):
     """
     _registry = [] 
 
+    _index = {}
+    """
+    Handlers for each set of schemas (a frozenset), in the order
+    they were registered. The first one wins, as with a scan of
+    _registry.
+    """
+
+    spec_cache = None
+    """
+    Directory where parsed specification files are cached, keyed by
+    their content hash. None disables the cache. The cache is read
+    with pickle: only use a directory you trust.
+    """
+
     @classmethod
     def register(registrycls, cls):
         """
         Add handler to the registry 
         """
         registrycls._registry.append(cls)
+        registrycls._index.setdefault(schema_key(cls.schema), []).append(cls)
 
     @classmethod
     def unregister(registrycls, cls):
         """
-        Add handler to the registry 
-        """
-        registrycls._registry = [c for c in SpecRegistry._registry if c.__name__ != cls.__name__] 
+        Remove handler from the registry 
+        """
+        removed = [c for c in registrycls._registry if c.__name__ == cls.__name__]
+        if len(removed) == 0:
+            return
+        registrycls._registry = [c for c in registrycls._registry if c.__name__ != cls.__name__]
+
+        # The next handler of the same schemas, if any, takes over
+        for c in removed:
+            key = schema_key(c.schema)
+            handlers = registrycls._index.get(key, [])
+            if c in handlers:
+                handlers.remove(c)
+            if len(handlers) == 0:
+                registrycls._index.pop(key, None)
         
     @classmethod    
     def schema_list(cls):
@@ -69,14 +102,15 @@ class SpecRegistry(object):
         """
         List known schemas and handling classes
         """
-        for c in cls._registry:
 <<<<<<< HEAD
+        for c in cls._registry:
             if c.schema == schema:
                 return c 
         raise Exception("Unknown schema: {}".format(schema))
 =======
-            if c.match(schema): 
-                return c
+        handlers = cls._index.get(schema_key(schema))
+        if handlers:
+            return handlers[0]
             
         raise SpecNoHandler("Unknown schema: {}".format(schema))
 >>>>>>> 9c2e4ba7a27d033f201f4f7493648ed2b26341f3
@@ -145,9 +179,9 @@ class SpecRegistry(object):
         else:
             raise SpecInvalidSpecification("Not a dict or list")
 
-        for h in cls._registry: 
-            if h.match(schemas):
-                return h 
+        handlers = cls._index.get(schema_key(schemas))
+        if handlers:
+            return handlers[0]
 
         raise SpecNoHandler("Unknown schema: {}".format(schemas))
 
@@ -161,19 +195,45 @@ class SpecRegistry(object):
         """
 
         if isinstance(arg, str) and os.path.isfile(arg):
-            if arg.lower().endswith('.json'):
-                spec = json.load(open(arg))
-            elif arg.lower().endswith(('.yaml','.yml')):
-                spec = yaml.load(open(arg))
-            else:
-                raise SpecInvalidSpecification("Not an accepted file format")
+            spec = read_spec_file(arg, cache=cls.spec_cache)
         else:
             spec = arg
 
         return (spec, cls.find_handler_for_schema(spec))
+
+    @classmethod 
+    def iter_handlers_generic(cls, arg, fmt=None, split=True):
+        """
+        Find the handler class of each document of a file, one
+        document at a time. YAML files can hold several documents
+        separated by '---', and JSON files an array of documents (or
+        several values one after the other).
+
+        :param object arg: File location (a string) or a file object
+        :param str fmt: 'json' or 'yaml'. Taken from the file name by default.
+        :param bool split: Dispatch the elements of a JSON array one at
+              a time. False hands the array to one handler, as
+              find_handler_generic does.
+
+        Yields (document, handler) pairs
+        """
+        for spec in iter_spec_documents(arg, fmt, split):
+            yield (spec, cls.find_handler_for_schema(spec))
 >>>>>>> 9c2e4ba7a27d033f201f4f7493648ed2b26341f3
     
     
+HOOK_PREFIXES = ('load_', 'dump_', 'validate_')
+
+def _hook(cls, attr):
+    """
+    Function (obj, value) that calls the hook attr of obj
+    """
+    static = inspect.getattr_static(cls, attr)
+    if isinstance(static, types.FunctionType):
+        return static
+    # Static and class methods, and other callables
+    return lambda obj, value: getattr(obj, attr)(value)
+
 class SpecMeta(abc.ABCMeta):
     """
     Meta class for all elements with schemas. This allows for
@@ -190,6 +250,39 @@ class SpecMeta(abc.ABCMeta):
         # Now initialize 
         super().__init__(name, bases, dct)
 
+        # Element hooks 
+        cls.compile_hooks()
+
+    def __setattr__(cls, name, value):
+        super().__setattr__(name, value)
+        if name.startswith(HOOK_PREFIXES):
+            cls.compile_hooks()
+
+    def __delattr__(cls, name):
+        super().__delattr__(name)
+        if name.startswith(HOOK_PREFIXES):
+            cls.compile_hooks()
+
+    def compile_hooks(cls):
+        """
+        Find the load_*, dump_* and validate_* methods of the class
+        and keep them in dispatch tables (_load_hooks, _dump_hooks,
+        _validate_hooks) from the element name to a function called
+        with the object and the value. Subclasses are updated too.
+
+        Hooks set on an instance are found by SpecBase.get_hooks.
+        """
+        names = dir(cls)
+        for prefix in HOOK_PREFIXES:
+            hooks = {}
+            for attr in names:
+                if attr.startswith(prefix) and len(attr) > len(prefix):
+                    hooks[attr[len(prefix):]] = _hook(cls, attr)
+            type.__setattr__(cls, '_' + prefix + 'hooks', hooks)
+
+        for subclass in cls.__subclasses__():
+            subclass.compile_hooks()
+
     def validate_handler(self, dct):
         """
         Validate the class implementing schema
@@ -261,6 +354,26 @@ class SpecBase(metaclass=SpecMeta):
     Property-like access to specification's owner element 
     """    
 
+    def get_hooks(self, prefix):
+        """
+        Hooks of one kind, from the element name to a function called
+        with the object and the value. Hooks set on the instance take
+        precedence over those of the class.
+
+        :param str prefix: One of load_, dump_ or validate_
+        """
+        hooks = getattr(self, '_' + prefix + 'hooks')
+        own = [attr for attr in self.__dict__
+               if attr.startswith(prefix) and len(attr) > len(prefix)]
+        if len(own) == 0:
+            return hooks
+
+        hooks = dict(hooks)
+        for attr in own:
+            func = self.__dict__[attr]
+            hooks[attr[len(prefix):]] = lambda obj, value, func=func: func(value)
+        return hooks
+
     def validate(self, spec=None):
         """
 <<<<<<< HEAD
@@ -292,13 +405,15 @@ class SpecBase(metaclass=SpecMeta):
     @abc.abstractmethod             
 =======
 
+        hooks = self.get_hooks('validate_')
+
         def check_required(spec):
             for r in self.required:
                 if r not in spec:
                     raise SpecInvalidSpecification("Missing: {}".format(r))
-                if hasattr(self, 'validate_' + r):
-                    func = getattr(self, 'validate_' + r)
-                    func(metadata[r])
+                func = hooks.get(r)
+                if func is not None:
+                    func(self, spec[r])
   
         if isinstance(spec,dict):
                 check_required(spec)
@@ -331,20 +446,7 @@ class SpecBase(metaclass=SpecMeta):
         This is a conservative function 
         """
 
-        if isinstance(schemas, str) and len(schemas) > 0:
-            schemas = [schemas]
-        elif isinstance(schemas, list) and len(schemas) > 0: 
-            for s in schemas:
-                if not isinstance(s, str) or len(s) == 0: 
-                    raise SpecInvalidSchema()
-        else:
-            raise SpecInvalidSchema("Should be a string or a list")
-            
-        myschemas = cls.schema
-        if isinstance(myschemas, str):
-            myschemas = [myschemas]
-            
-        return set(myschemas) == set(schemas)
+        return schema_key(cls.schema) == schema_key(schemas)
                 
     def dump(self):
         """
@@ -366,21 +468,16 @@ class SpecBase(metaclass=SpecMeta):
                 order.append(k)
 
         # => Now follow the order computed
+<<<<<<< HEAD
         for k in order:
 
             if hasattr(self, 'dump_' + k):
                 func = getattr(self, 'dump_' + k)
             else:
                 func = lambda x: x 
-<<<<<<< HEAD
             d.append((k, func(self.metadata[k])))
             
         for k,v in self.metadata.items():
-=======
-            d.append((k, func(self.spec[k])))
-            
-        for k,v in self.spec.items():
->>>>>>> 9c2e4ba7a27d033f201f4f7493648ed2b26341f3
             if k in self.order:
                 continue
             if hasattr(self, 'dump_' + k):
@@ -388,6 +485,19 @@ class SpecBase(metaclass=SpecMeta):
             else:
                 func = lambda x: x                 
             d.append((k, func(v)))
+=======
+        hooks = self.get_hooks('dump_')
+        for k in order:
+            func = hooks.get(k)
+            v = self.spec[k]
+            d.append((k, v if func is None else func(self, v)))
+            
+        for k,v in self.spec.items():
+            if k in self.order:
+                continue
+            func = hooks.get(k)
+            d.append((k, v if func is None else func(self, v)))
+>>>>>>> 9c2e4ba7a27d033f201f4f7493648ed2b26341f3
 
         return collections.OrderedDict(d)
 
@@ -414,13 +524,14 @@ class SpecBase(metaclass=SpecMeta):
                 final.append(i)
 
         elif isinstance(spec,dict):
-            final = {} 
-            for k, v in spec.items():
-                if hasattr(self, 'load_' + k):
-                    func = getattr(self, 'load_' + k)
-                else:
-                    func = lambda x: x
-                final[k] = func(v)
+            hooks = self.get_hooks('load_')
+            if len(hooks) == 0:
+                final = dict(spec)
+            else:
+                final = {} 
+                for k, v in spec.items():
+                    func = hooks.get(k)
+                    final[k] = v if func is None else func(self, v)
 >>>>>>> 9c2e4ba7a27d033f201f4f7493648ed2b26341f3
 
         # Check to make sure the spec is complete and valid 
@@ -492,35 +603,394 @@ class SpecBase(metaclass=SpecMeta):
 
 <<<<<<< HEAD
 =======
+# libyaml is much faster than the pure Python loader
+YAMLLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+def _spec_format(filename):
+    if filename.lower().endswith('.json'):
+        return 'json'
+    elif filename.lower().endswith(('.yaml','.yml')):
+        return 'yaml'
+    raise SpecInvalidSpecification("Not an accepted file format")
+
+def _cache_read(path):
+    try:
+        with open(path, 'rb') as fd:
+            return True, pickle.load(fd)
+    except Exception:
+        # Missing or unreadable entries are parsed again
+        return False, None
+
+def _cache_write(path, spec):
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, 'wb') as fd:
+            pickle.dump(spec, fd, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError:
+        # The cache is an optimization. Loading goes on without it.
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def parse_spec_data(data, filename, cache=None, digest=None):
+    """
+    Parse the content of a specification file 
+
+    :param bytes data: File content
+    :param str filename: File name, to tell the format
+    :param str cache: Directory of parsed files (see SpecRegistry.spec_cache)
+    :param str digest: SHA1 of data, if already known
+    """
+    fmt = _spec_format(filename)
+
+    if cache is not None:
+        if digest is None:
+            digest = hashlib.sha1(data).hexdigest()
+        path = os.path.join(cache, "{}.{}.pickle".format(digest, fmt))
+        found, spec = _cache_read(path)
+        if found:
+            return spec
+
+    if fmt == 'json':
+        spec = json.loads(data)
+    else:
+        spec = yaml.load(data, Loader=YAMLLoader)
+
+    if cache is not None:
+        _cache_write(path, spec)
+    return spec
+
+def _iter_json_values(fd, chunksize=65536, split=True):
+    """
+    Decode the JSON values of a file object one at a time. A file
+    can hold several values separated by whitespace. With split, the
+    elements of a top-level array are decoded and yielded one at a
+    time, so that only one of them is in memory. Otherwise the array
+    is a single value, as it is for parse_generic.
+    """
+    decoder = json.JSONDecoder()
+    # Characters may be split across chunks
+    utf8 = codecs.getincrementaldecoder('utf-8-sig')()
+    buf = ''
+    pos = 0
+    eof = False
+    size = chunksize
+
+    def more():
+        nonlocal buf, pos, eof
+        chunk = fd.read(size)
+        if len(chunk) == 0:
+            eof = True
+        if isinstance(chunk, bytes):
+            chunk = utf8.decode(chunk, final=eof)
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    def skip():
+        # Skip whitespace, reading more if needed. Returns False at EOF.
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\n\r':
+                pos += 1
+            if pos < len(buf):
+                return True
+            if eof:
+                return False
+            more()
+
+    def value():
+        # A value is complete once a character that cannot continue it
+        # follows it (e.g., 1.5 may continue as 1.5e3), or at EOF
+        nonlocal pos, size
+        while True:
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+                if eof or (end < len(buf) and buf[end] not in '0123456789.eE+-'):
+                    pos = end
+                    size = chunksize
+                    return obj
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            # Values larger than a chunk are read in larger chunks
+            if len(buf) - pos >= size:
+                size *= 2
+            more()
+
+    more()
+    if buf.startswith('\ufeff'):
+        pos = 1
+    if not skip():
+        raise SpecInvalidSpecification("Empty file")
+
+    def elements():
+        nonlocal pos
+        pos += 1
+        if skip() and buf[pos] == ']':
+            pos += 1
+            return
+        while True:
+            if not skip():
+                raise SpecInvalidSpecification("Unterminated array")
+            yield value()
+            if not skip():
+                raise SpecInvalidSpecification("Unterminated array")
+            if buf[pos] == ',':
+                pos += 1
+            elif buf[pos] == ']':
+                pos += 1
+                return
+            else:
+                raise SpecInvalidSpecification("Expected ',' or ']' in the array")
+
+    while skip():
+        if split and buf[pos] == '[':
+            yield from elements()
+        else:
+            yield value()
+
+def iter_spec_documents(arg, fmt=None, split=True):
+    """
+    Read the documents of a specification file one at a time, so 
+    that large bundles need not fit in memory
+
+    :param object arg: File location (a string) or a file object
+    :param str fmt: 'json' or 'yaml'. Taken from the file name by default.
+    :param bool split: Read the elements of a top-level JSON array as
+          documents. False keeps the array as one document, as
+          parse_generic does.
+    """
+    if isinstance(arg, str):
+        fmt = fmt or _spec_format(arg)
+        with open(arg, 'rb') as fd:
+            yield from iter_spec_documents(fd, fmt, split)
+        return
+
+    if fmt is None:
+        fmt = _spec_format(getattr(arg, 'name', ''))
+    if fmt == 'json':
+        yield from _iter_json_values(arg, split=split)
+    elif fmt == 'yaml':
+        yield from yaml.load_all(arg, Loader=YAMLLoader)
+    else:
+        raise SpecInvalidSpecification("Not an accepted file format")
+
+def read_spec_file(filename, cache=None):
+    """
+    Read a specification file (JSON or YAML)
+
+    :param str filename: File location
+    :param str cache: Directory of parsed files (see SpecRegistry.spec_cache)
+    """
+    _spec_format(filename)
+    with open(filename, 'rb') as fd:
+        data = fd.read()
+    return parse_spec_data(data, filename, cache=cache)
+
+def _read_changed(filename, digest, cache=None):
+    """
+    Read and parse a file unless its content has the given digest.
+    Runs in the worker processes of SpecManagerBase.
+
+    Returns (digest, parsed, spec, error). parsed is False if the
+    content is unchanged or could not be parsed.
+    """
+    try:
+        with open(filename, 'rb') as fd:
+            data = fd.read()
+    except Exception as e:
+        return (None, False, None, e)
+
+    newdigest = hashlib.sha1(data).hexdigest()
+    if newdigest == digest:
+        return (newdigest, False, None, None)
+
+    try:
+        spec = parse_spec_data(data, filename, cache=cache, digest=newdigest)
+        return (newdigest, True, spec, None)
+    except Exception as e:
+        return (newdigest, False, None, e)
+
 class SpecManagerBase():
     """
     Manage a specification directory 
+
+    Files are parsed in parallel by a pool of worker processes and
+    remembered by modification time and content hash, so that
+    refresh only parses the files that changed. The handlers are
+    looked up and the specifications loaded in this process.
+
+    The pool is started on the first parallel read and kept until
+    close() is called.
     """
+    patterns = ['spec_*.json', 'spec_*.yaml', 'spec_*.yml']
+    """
+    Specification files in a directory 
+    """
+
+    parallel_threshold = 4
+    """
+    Minimum number of changed files that are parsed in parallel.
+    Fewer are parsed in this process.
+    """
+
     def __init__(self, *args, **kwargs):
-        self.specs = []
         """
         Accept path and read list of spec files available in path. 
 
         required prefix: spec_
+
+        :param int workers: Number of worker processes. Defaults to 
+               the number of CPUs. 1 parses the files in this process.
+        :param str cache: Directory of parsed files. Defaults to 
+               SpecRegistry.spec_cache.
         """
-        
+        self.workers = kwargs.get('workers', None)
+        self.cache = kwargs.get('cache', SpecRegistry.spec_cache)
+        self.executor = None
+        self.clear()
+
     def load(self, path):
         """
         Load a directory 
+
+        :param str path: Directory with the specification files
+
+        Returns the errors of the files that could not be loaded, 
+        a dict from the file to a SpecLoadError
+        """
+        if path not in self.paths:
+            self.paths.append(path)
+        return self.refresh()
+
+    def refresh(self):
+        """
+        Load the files of the directories that were added, removed
+        or modified since they were last loaded
+
+        Returns the errors, as load does
         """
         import hallmarkfe 
-        files = glob.glob(os.path.join(path,'spec_*.json'))
-        files += glob.glob(os.path.join(path,'spec_*.yaml'))
+
+        files = []
+        for path in self.paths:
+            for pattern in self.patterns:
+                files.extend(glob.glob(os.path.join(path, pattern)))
+        files = sorted(set(files))
+
+        # Forget the files that are gone
+        for f in list(self.files):
+            if f not in files:
+                del self.files[f]
+
+        # Files whose size or modification time changed are read
+        # again, and parsed if their content changed
+        todo = {}
+        for f in files:
+            entry = self.files.get(f)
+            if entry is None:
+                self.files[f] = entry = {'stamp': None, 'digest': None, 'parsed': False,
+                                         'spec': None, 'obj': None, 'error': None}
+            try:
+                st = os.stat(f)
+                stamp = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                stamp = None
+            if stamp is None or entry['stamp'] != stamp:
+                entry['stamp'] = stamp
+                todo[f] = entry['digest']
+
+        for f, (digest, parsed, spec, error) in self._read(todo).items():
+            entry = self.files[f]
+            if error is None and not parsed:
+                # Same content
+                continue
+            entry.update({'digest': digest, 'parsed': parsed, 'spec': spec,
+                          'obj': None, 'error': error})
+
+        # Load the specifications. Files without a handler are tried
+        # again, in case the handler has been registered since.
         for f in files:
+            entry = self.files[f]
+            if entry['obj'] is not None or not entry['parsed']:
+                continue
             try:
-                obj = hallmarkfe.parse_generic(f)
-                self.specs.append(obj) 
-            except:
-                pass 
+                entry['obj'] = hallmarkfe.parse_generic(entry['spec'])
+                entry['error'] = None
+            except Exception as e:
+                entry['error'] = e
+
+        self.specs = []
+        self.errors = collections.OrderedDict()
+        for f in files:
+            entry = self.files[f]
+            if entry['obj'] is not None:
+                self.specs.append(entry['obj'])
+            elif entry['error'] is not None:
+                self.errors[f] = SpecLoadError(f, entry['error'])
+
+        return self.errors
+
+    def _read(self, todo):
+        """
+        Read and parse files, in parallel if there are enough of them
+        """
+        workers = self.workers or os.cpu_count() or 1
+        if workers <= 1 or len(todo) < max(2, self.parallel_threshold):
+            return {f: _read_changed(f, digest, self.cache) for f, digest in todo.items()}
+
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+        results = {}
+        futures = {f: self.executor.submit(_read_changed, f, digest, self.cache)
+                   for f, digest in todo.items()}
+        for f, future in futures.items():
+            try:
+                results[f] = future.result()
+            except Exception as e:
+                results[f] = (None, False, None, e)
+        return results
+
+    def close(self):
+        """
+        Stop the worker processes, if any
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def stream(self, path):
+        """
+        Specifications of a bundle file, or of the files of a 
+        directory, one at a time. They are not kept in specs, so 
+        memory use does not grow with the size of the bundle.
+
+        :param str path: Specification file or directory
+        """
+        import hallmarkfe 
+
+        if os.path.isdir(path):
+            files = []
+            for pattern in self.patterns:
+                files.extend(glob.glob(os.path.join(path, pattern)))
+            files = sorted(set(files))
+        else:
+            files = [path]
+
+        for f in files:
+            for spec, cls in SpecRegistry.iter_handlers_generic(f):
+                obj = cls()
+                obj.load(spec)
+                yield obj
 
     def clear(self):
         """
         Clear the state 
         """
         self.specs = [] 
+        self.errors = collections.OrderedDict()
+        self.paths = []
+        self.files = {}
 >>>>>>> 9c2e4ba7a27d033f201f4f7493648ed2b26341f3
@@ -7,7 +7,8 @@ Exceptions
 =======
 
 __all__ = ['SpecNoHandler', 'SpecInvalidSchema',
-           'SpecMissingSchema', 'SpecInvalidSpecification']
+           'SpecMissingSchema', 'SpecInvalidSpecification',
+           'SpecLoadError']
 
 >>>>>>> 9c2e4ba7a27d033f201f4f7493648ed2b26341f3
 class SpecNoHandler(Exception):
@@ -34,3 +35,13 @@ class SpecInvalidSpecification(Exception):
     """
     pass
 
+
+class SpecLoadError(Exception):
+    """
+    Specification file could not be read, parsed or loaded. 
+    The file is in path and the underlying exception in error.
+    """
+    def __init__(self, path, error):
+        super().__init__("{}: {}".format(path, error))
+        self.path = path
+        self.error = error
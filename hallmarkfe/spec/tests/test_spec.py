@@ -3,7 +3,9 @@ import sys
 <<<<<<< HEAD
 import json 
 =======
+import io
 import json
+import yaml
 >>>>>>> 9c2e4ba7a27d033f201f4f7493648ed2b26341f3
 import pytest
 
@@ -318,7 +320,255 @@ def test_SpecManager(testdata, user_json_list):
     # This should pass
     obj = hallmarkfe.SpecManagerBase()
     obj.load(testdata)
-
+    assert len(obj.specs) == 1
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_SpecManager_refresh(tmp_path, workers):
+    """
+    Test incremental directory loading and errors
+    """
+
+    class Kilo(hallmarkfe.SpecBase):
+        schema = "kilo:default:v1"
+
+    def spec(name):
+        return {
+            'schema': 'kilo:default:v1',
+            'name': name,
+            'description': "Test kilo",
+            'owner': 'hello@hello.com'
+        }
+
+    try:
+        (tmp_path / 'spec_a.json').write_text(json.dumps(spec('a')))
+        (tmp_path / 'spec_b.yaml').write_text("schema: kilo:default:v1\nname: b\n"
+                                              "description: Test\nowner: hello@hello.com\n")
+        (tmp_path / 'spec_c.yaml').write_text("schema: [unclosed\n")
+        (tmp_path / 'spec_d.json').write_text(json.dumps(dict(spec('d'), schema='unknown:v1')))
+        (tmp_path / 'other.json').write_text(json.dumps(spec('other')))
+
+        manager = hallmarkfe.SpecManagerBase(workers=workers)
+        errors = manager.load(str(tmp_path))
+        assert sorted(s.name for s in manager.specs) == ['a', 'b']
+        assert [os.path.basename(f) for f in errors] == ['spec_c.yaml', 'spec_d.json']
+        for f, error in errors.items():
+            assert isinstance(error, hallmarkfe.spec.SpecLoadError)
+            assert error.path == f
+        assert isinstance(errors[str(tmp_path / 'spec_d.json')].error,
+                          hallmarkfe.spec.SpecNoHandler)
+
+        # Unchanged files are not loaded again
+        first = {s.name: s for s in manager.specs}
+        (tmp_path / 'spec_b.yaml').unlink()
+        (tmp_path / 'spec_c.yaml').write_text(json.dumps(spec('c')))
+        (tmp_path / 'spec_e.json').write_text(json.dumps(spec('e')))
+        os.utime(tmp_path / 'spec_a.json', ns=(0, 0))
+        errors = manager.refresh()
+        assert [os.path.basename(f) for f in errors] == ['spec_d.json']
+        assert sorted(s.name for s in manager.specs) == ['a', 'c', 'e']
+        assert manager.specs[0] is first['a']
+
+        # Files without a handler are loaded once it is registered
+        class Unknown(hallmarkfe.SpecBase):
+            schema = "unknown:v1"
+        (tmp_path / 'spec_c.yaml').write_text("name: c\n")
+        errors = manager.refresh()
+        assert sorted(s.name for s in manager.specs) == ['a', 'd', 'e']
+        assert list(errors) == [str(tmp_path / 'spec_c.yaml')]
+        hallmarkfe.spec.unregister(Unknown)
+
+        # The worker processes are started once, for enough files
+        executor = manager.executor
+        assert (executor is not None) == (workers > 1)
+        for name in 'fghi':
+            (tmp_path / 'spec_{}.json'.format(name)).write_text(json.dumps(spec(name)))
+        manager.refresh()
+        assert sorted(s.name for s in manager.specs) == list('adefghi')
+        assert manager.executor is executor
+        manager.close()
+        assert manager.executor is None
+
+        manager.clear()
+        assert manager.specs == []
+    finally:
+        hallmarkfe.spec.unregister(Kilo)
+
+
+def test_spec_cache(tmp_path, user_json_list, monkeypatch):
+    """
+    Test that a warm start reads parsed files from the cache
+    """
+    cache = str(tmp_path / 'cache')
+    filename = os.path.join(thisdir, 'fixtures/user.yaml')
+    monkeypatch.setattr(hallmarkfe.SpecRegistry, 'spec_cache', cache)
+
+    cold = hallmarkfe.parse_generic(filename)
+    assert len(os.listdir(cache)) == 1
+
+    def fail(*args, **kwargs):
+        raise Exception("Parsed again")
+    monkeypatch.setattr(hallmarkfe.spec.base.yaml, 'load', fail)
+
+    warm = hallmarkfe.parse_generic(filename)
+    assert warm.dump() == cold.dump()
+
+    manager = hallmarkfe.SpecManagerBase(workers=1)
+    assert manager.cache == cache
+    (tmp_path / 'specs').mkdir()
+    with open(filename) as fd:
+        (tmp_path / 'specs' / 'spec_user.yaml').write_text(fd.read())
+    assert len(manager.load(str(tmp_path / 'specs'))) == 0
+    assert len(manager.specs) == 1
+
+    # Unknown content is parsed
+    (tmp_path / 'specs' / 'spec_other.yaml').write_text("name: other\n")
+    errors = manager.refresh()
+    assert "Parsed again" in str(list(errors.values())[0])
+
+@pytest.mark.parametrize('text,expected', [
+    ('[]', [[]]),
+    (' [ ] ', [[]]),
+    ('{"a": [1, 2]}', [{'a': [1, 2]}]),
+    ('[1, 22, 333]', [[1, 22, 333]]),
+    ('12345', [12345]),
+    ('[{"a": "x]y,z"}, [1, [2, 3]], "\\"[", 1.5e3, null, true]',
+     [[{'a': 'x]y,z'}, [1, [2, 3]], '"[', 1.5e3, None, True]]),
+    ('\ufeff[{"schema": "kilo:default:v1"}]\n', [[{'schema': 'kilo:default:v1'}]]),
+    ('{"a": 1} {}\n[1] 2', [{'a': 1}, {}, [1], 2]),
+])
+@pytest.mark.parametrize('chunksize', [1, 3, 65536])
+@pytest.mark.parametrize('split', [True, False])
+def test_iter_json_values(text, expected, chunksize, split):
+    """
+    Test incremental decoding of JSON values
+    """
+    if split:
+        # The elements of top-level arrays come one at a time
+        expected = [e for v in expected for e in (v if isinstance(v, list) else [v])]
+    fd = io.BytesIO(text.encode('utf-8'))
+    assert list(hallmarkfe.spec.base._iter_json_values(fd, chunksize, split)) == expected
+
+@pytest.mark.parametrize('text', ['', '  ', '[1, 2', '[1 2]', '[1,]', '{"a": 1} }'])
+@pytest.mark.parametrize('split', [True, False])
+def test_iter_json_values_invalid(text, split):
+    """
+    Test incremental decoding of invalid JSON
+    """
+    fd = io.BytesIO(text.encode('utf-8'))
+    with pytest.raises((hallmarkfe.SpecInvalidSpecification, ValueError)) as exc:
+        list(hallmarkfe.spec.base._iter_json_values(fd, 2, split))
+
+def test_iter_json_values_memory(tmp_path):
+    """
+    Test that the elements of a large array are decoded one at a time
+    """
+    import tracemalloc
+
+    filename = str(tmp_path / 'large.json')
+    with open(filename, 'w') as fd:
+        fd.write('[')
+        for i in range(20000):
+            if i > 0:
+                fd.write(',')
+            json.dump({'schema': 'kilo:default:v1', 'name': 'spec{}'.format(i),
+                       'description': 'x' * 200}, fd)
+        fd.write(']')
+    assert os.path.getsize(filename) > 4000000
+
+    count = 0
+    tracemalloc.start()
+    try:
+        for doc in hallmarkfe.spec.base.iter_spec_documents(filename):
+            assert doc['name'] == 'spec{}'.format(count)
+            count += 1
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert count == 20000
+    assert peak < 1000000
+
+def test_parse_stream(tmp_path):
+    """
+    Test loading a bundle one specification at a time
+    """
+
+    class Kilo(hallmarkfe.SpecBase):
+        schema = "kilo:default:v1"
+
+    def spec(name):
+        return {
+            'schema': 'kilo:default:v1',
+            'name': name,
+            'description': "Test kilo",
+            'owner': 'hello@hello.com'
+        }
+
+    try:
+        specs = [spec('spec{}'.format(i)) for i in range(5)]
+        (tmp_path / 'spec_bundle.json').write_text(json.dumps(specs))
+        with open(tmp_path / 'spec_bundle.yaml', 'w') as fd:
+            yaml.safe_dump_all(specs, fd)
+
+        for f in ['spec_bundle.json', 'spec_bundle.yaml']:
+            stream = hallmarkfe.spec.parse_stream(str(tmp_path / f))
+            assert next(stream).name == 'spec0'
+            assert [s.name for s in stream] == ['spec{}'.format(i) for i in range(1, 5)]
+
+        fd = io.StringIO(json.dumps(specs[0]))
+        assert [s.name for s in hallmarkfe.spec.parse_stream(fd, 'json')] == ['spec0']
+
+        manager = hallmarkfe.SpecManagerBase()
+        assert len(list(manager.stream(str(tmp_path)))) == 10
+        assert manager.specs == []
+
+        (tmp_path / 'spec_bundle.yaml').write_text("name: unknown\n")
+        with pytest.raises(hallmarkfe.SpecInvalidSpecification) as exc:
+            list(hallmarkfe.spec.parse_stream(str(tmp_path / 'spec_bundle.yaml')))
+    finally:
+        hallmarkfe.spec.unregister(Kilo)
+
+def test_parse_stream_array(tmp_path):
+    """
+    Test the documents of a JSON array, one at a time or as a whole
+    """
+
+    class Kilo(hallmarkfe.SpecBase):
+        schema = "kilo:default:v1"
+
+    class Lima(hallmarkfe.SpecBase):
+        schema = "lima:default:v1"
+
+    def spec(schema, name):
+        return {
+            'schema': schema,
+            'name': name,
+            'description': "Test kilo",
+            'owner': 'hello@hello.com'
+        }
+
+    try:
+        # Each document goes to the handler of its schema
+        filename = str(tmp_path / 'spec_mixed.json')
+        (tmp_path / 'spec_mixed.json').write_text(json.dumps([
+            spec('kilo:default:v1', 'a'),
+            spec('lima:default:v1', 'b'),
+        ]))
+        actual = list(hallmarkfe.spec.parse_stream(filename))
+        assert [(type(obj), obj.name) for obj in actual] == [(Kilo, 'a'), (Lima, 'b')]
+
+        # Without split, the array is loaded as parse_generic does
+        filename = str(tmp_path / 'spec_array.json')
+        (tmp_path / 'spec_array.json').write_text(json.dumps([
+            spec('kilo:default:v1', 'spec{}'.format(i)) for i in range(3)
+        ]))
+        expected = hallmarkfe.spec.parse_generic(filename)
+        actual = list(hallmarkfe.spec.parse_stream(filename, split=False))
+        assert [type(obj) for obj in actual] == [type(expected)]
+        assert [obj.spec for obj in actual] == [expected.spec]
+        assert len(list(hallmarkfe.spec.parse_stream(filename))) == 3
+    finally:
+        hallmarkfe.spec.unregister(Kilo)
+        hallmarkfe.spec.unregister(Lima)
 
 ##################################################
 # Subclasses
@@ -366,4 +616,103 @@ def test_dump():
 
     assert len(handler.dump()) > 0
     assert len(handler.prettyprint()) > 0
+
+def test_hooks():
+    """
+    Test load, dump and validate hooks
+    """
+
+    class Hooks(hallmarkfe.SpecBase):
+        schema = "hooks:default:v1"
+
+        def load_name(self, value):
+            return value.upper()
+
+        def dump_name(self, value):
+            return value.lower()
+
+        @staticmethod
+        def validate_owner(value):
+            if '@' not in value:
+                raise hallmarkfe.SpecInvalidSpecification("Invalid owner")
+
+    class Child(Hooks):
+        schema = "hooks:child:v1"
+
+    testdata = {
+        'schema': 'hooks:default:v1',
+        'name': 'kilo',
+        'description': "Test kilo",
+        'owner': 'hello@hello.com'
+    }
+
+    try:
+        assert sorted(Child._load_hooks) == ['name']
+        obj = hallmarkfe.parse_generic(testdata)
+        assert obj.name == 'KILO'
+        assert obj.dump()['name'] == 'kilo'
+
+        with pytest.raises(hallmarkfe.SpecInvalidSpecification) as exc:
+            hallmarkfe.parse_generic(dict(testdata, owner='nobody'))
+
+        # Hooks added later are found, by subclasses too
+        Hooks.load_description = lambda self, value: value + "!"
+        obj = hallmarkfe.parse_generic(dict(testdata, schema='hooks:child:v1'))
+        assert isinstance(obj, Child)
+        assert obj.description == "Test kilo!"
+
+        # Hooks set on an instance take precedence
+        obj = Child()
+        obj.load_description = lambda value: value + "?"
+        obj.load(dict(testdata, schema='hooks:child:v1'))
+        assert obj.description == "Test kilo?"
+
+        # Deleted hooks are dropped
+        del Hooks.load_description
+        assert sorted(Child._load_hooks) == ['name']
+        obj = hallmarkfe.parse_generic(dict(testdata, schema='hooks:child:v1'))
+        assert obj.description == "Test kilo"
+    finally:
+        hallmarkfe.spec.unregister(Hooks)
+        hallmarkfe.spec.unregister(Child)
+
+def test_schema_index():
+    """
+    Test handler lookup by a set of schemas
+    """
+
+    class First(hallmarkfe.SpecBase):
+        schema = ["index:a:v1", "index:b:v1"]
+
+    class Second(hallmarkfe.SpecBase):
+        schema = ["index:b:v1", "index:a:v1"]
+
+    try:
+        assert hallmarkfe.spec.schema_get(["index:b:v1", "index:a:v1", "index:a:v1"]) == First
+        assert First.match(["index:b:v1", "index:a:v1"])
+        assert not First.match("index:a:v1")
+        with pytest.raises(hallmarkfe.spec.SpecNoHandler) as exc:
+            hallmarkfe.spec.schema_get("index:a:v1")
+
+        # Removing a later handler only drops its own entry
+        class Third(hallmarkfe.SpecBase):
+            schema = ["index:a:v1", "index:b:v1"]
+
+        key = hallmarkfe.spec.utils.schema_key(First.schema)
+        assert hallmarkfe.SpecRegistry._index[key] == [First, Second, Third]
+        hallmarkfe.spec.unregister(Third)
+        assert hallmarkfe.SpecRegistry._index[key] == [First, Second]
+        assert hallmarkfe.spec.schema_get(["index:a:v1", "index:b:v1"]) == First
+
+        # The next handler of the same schemas takes over
+        hallmarkfe.spec.unregister(First)
+        assert hallmarkfe.SpecRegistry._index[key] == [Second]
+        assert hallmarkfe.spec.schema_get(["index:a:v1", "index:b:v1"]) == Second
+    finally:
+        hallmarkfe.spec.unregister(First)
+        hallmarkfe.spec.unregister(Second)
+
+    with pytest.raises(hallmarkfe.spec.SpecNoHandler) as exc:
+        hallmarkfe.spec.schema_get(["index:a:v1", "index:b:v1"])
+    assert key not in hallmarkfe.SpecRegistry._index
 >>>>>>> 9c2e4ba7a27d033f201f4f7493648ed2b26341f3
@@ -5,6 +5,7 @@ Utils
 Helper functions 
 """
 import json
+from .exceptions import SpecInvalidSchema
 
 def generate_attribute(name):
     
@@ -17,3 +18,20 @@ def generate_attribute(name):
         self.spec[name] = value 
 
     return prop 
+
+def schema_key(schemas):
+    """
+    Hashable form of a schema or a list of schemas, used to index
+    the handlers. The order and repetitions of the list do not
+    matter.
+
+    :param object schemas: Schema (a string) or list of schemas
+    """
+    if isinstance(schemas, str) and len(schemas) > 0:
+        return frozenset([schemas])
+    elif isinstance(schemas, list) and len(schemas) > 0: 
+        for s in schemas:
+            if not isinstance(s, str) or len(s) == 0: 
+                raise SpecInvalidSchema()
+        return frozenset(schemas)
+    raise SpecInvalidSchema("Should be a string or a list")
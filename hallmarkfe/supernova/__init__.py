@@ -9,13 +9,26 @@ features, and a mixin for common metrics in the retail industry.
 """
 import re 
 import copy
+import pickle
 import logging 
 import collections
+import concurrent.futures
 try:
     import cytoolz as toolz
 except:
     import toolz 
 
+from .rules import compile_rule
+from .columnar import (ColumnarTable, SegmentedTable, as_columnar,
+                       compile_rule_mask)
+from .compact import HFEFeatureIndex, HFECompactState
+from .matrix import FeatureMatrixBuilder
+from .sketches import make_partial, merge_states
+from .store import HFEStateStore
+from .lazy import LazyTable, as_table
+from .profiler import HFEProfiler
+from .ruleset import RuleSet, RuleStats
+
 class HFEAtomicState(object):
     """
     Feature State for a unit entity such as a customer. This is updated
@@ -47,7 +60,65 @@ class HFEAtomicState(object):
         return self.state['data'][name]
 
     def set_data(self, name, value):
-        self.state['data'][name] = value
+        """
+        Add a dataset. Iterators and callables returning an iterable
+        are read lazily, once (see LazyTable).
+        """
+        self.state['data'][name] = as_table(value)
+
+    def get_partials(self):
+        """
+        Partial aggregates of the features that are maintained
+        incrementally (see HFEManager.update)
+        """
+        return self.state.setdefault('partials', {})
+
+
+class HFEForkedState(HFEAtomicState):
+    """
+    Copy of a state used to run one processor in isolation. Reads
+    see the parent's features and datasets; the features written by
+    the processor are recorded so that the manager can merge them
+    back into the parent.
+    """
+    def __init__(self, parent, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.state['features'] = parent.get_all_features()
+        self.state['data'] = copy.copy(parent.state['data'])
+        self.written = collections.OrderedDict()
+
+    def set_feature(self, name, value):
+        super().set_feature(name, value)
+        self.written[name] = value
+
+
+def run_forked(proc, state, level):
+    """
+    Run a processor on a forked state and return the features it
+    wrote. Module-level so that it can be used with process pools.
+    """
+    proc.process(state, level)
+    return state.written
+
+
+# Processors of this worker process (see init_worker)
+_worker_processors = {}
+
+
+def init_worker(processors):
+    """
+    Initializer of the worker processes of a process pool. The
+    processors are sent once per worker instead of with every task.
+    """
+    _worker_processors.clear()
+    _worker_processors.update(processors)
+
+
+def run_worker(name, state, level):
+    """
+    run_forked with a processor received by init_worker
+    """
+    return run_forked(_worker_processors[name], state, level)
 
 
 class HFEProcessor(object):
@@ -56,6 +127,11 @@ class HFEProcessor(object):
 
 
     """
+    profiler = None
+    """
+    HFEProfiler set by HFEManager.set_profiler. None disables profiling.
+    """
+
     def __init__(self, conf, *args, **kwargs):
         self.conf = conf
         
@@ -76,6 +152,57 @@ class HFEProcessor(object):
         """
         pass
 
+    def process_batch(self, states, level, batch):
+        """
+        Run this processor on a batch of entities at level. By
+        default each state is processed on its own.
+
+        Args:
+          states (list): Feature states, one per entity
+          level (int): Level of the feature
+          batch (class): SegmentedTable with the grouped records
+        """
+        for state in states:
+            self.process(state, level)
+
+    def update(self, state, level, name, rows):
+        """
+        Fold new records of a dataset into the features of a state
+        that is maintained incrementally. Not supported by default.
+
+        Args:
+          state (class): Feature state for the entity
+          level (int): Level of the feature
+          name (str): Dataset that received the records
+          rows (list): New records
+        """
+        raise Exception("Processor {} does not support incremental updates".format(self.name))
+
+    def get_levels(self):
+        """
+        Levels at which this processor generates features. The
+        manager skips the other levels. By default all levels.
+        """
+        return [1,2,3,4]
+
+    def get_tables(self, level):
+        """
+        Datasets read by this processor at a given level. None means
+        unknown, i.e., the processor may read any dataset including
+        the '__computed__' features table.
+
+        Args:
+          level (int): Level of the feature
+        """
+        return None
+
+    def get_plan_key(self):
+        """
+        Hashable summary of what get_levels and get_tables depend
+        on. The manager recomputes its schedule when it changes.
+        """
+        return None
+
     def autodoc(self):
         """
         Automatic documentation 
@@ -87,6 +214,19 @@ class MetricHandlerMixin(object):
     """
     Mixin with helper functions to make life simpler
     """
+    def toolz_values(self, col, rows):
+        """
+        Values of a given column in a list of dictionaries or a
+        columnar table
+
+        Args:
+           col (str): Column to process
+           rows (list): Records
+        """
+        if isinstance(rows, ColumnarTable):
+            return rows.tolist(col)
+        return list(toolz.pluck(col, rows))
+
     def toolz_sum(self, col, rows, dtype=None):
         """
         Sum a given column in a list of dictionaries
@@ -95,7 +235,7 @@ class MetricHandlerMixin(object):
            col (str): Column to process
            rows (list): Records
         """
-        values = list(toolz.pluck(col, rows))
+        values = self.toolz_values(col, rows)
         if dtype is not None:
             values = [dtype(v) for v in values]
 
@@ -109,7 +249,7 @@ class MetricHandlerMixin(object):
            col (str): Column to process
            rows (list): Records
         """
-        return min(list(toolz.pluck(col, rows)))
+        return min(self.toolz_values(col, rows))
 
     def toolz_max(self, col, rows):
         """
@@ -119,7 +259,7 @@ class MetricHandlerMixin(object):
            col (str): Column to process
            rows (list): Records
         """
-        return max(list(toolz.pluck(col, rows)))
+        return max(self.toolz_values(col, rows))
 
     def toolz_count(self, col, rows):
         """
@@ -130,7 +270,7 @@ class MetricHandlerMixin(object):
            rows (list): Records
 
         """
-        return len(set(list(toolz.pluck(col, rows))))
+        return len(set(self.toolz_values(col, rows)))
 
     def toolz_avg(self, col, rows):
         """
@@ -143,9 +283,91 @@ class MetricHandlerMixin(object):
         """
 
         count = len(rows)
-        total = sum(list(toolz.pluck(col, rows)))
+        total = sum(self.toolz_values(col, rows))
         return total/count if count > 0 else None
 
+    def toolz_aggregate(self, requests, rows):
+        """
+        Compute several aggregates in one pass over the records. Each
+        column is extracted once no matter how many aggregates use it.
+
+        Args:
+           requests (list): (column, function) or (column, function,
+                 dtype) tuples. function is one of sum, min, max,
+                 count (unique values), size (number of records) and
+                 avg. dtype applies to sum.
+           rows (list): Records
+
+        Returns the values in the order of the requests
+        """
+        requests = [tuple(r) if len(r) == 3 else (r[0], r[1], None)
+                    for r in requests]
+
+        columns = []
+        for col, function, dtype in requests:
+            if col not in columns:
+                columns.append(col)
+
+        if isinstance(rows, ColumnarTable):
+            values = {c: rows.tolist(c) for c in columns}
+        elif len(columns) == 1:
+            values = {columns[0]: list(toolz.pluck(columns[0], rows))}
+        elif len(rows) == 0:
+            values = {c: [] for c in columns}
+        else:
+            values = dict(zip(columns, zip(*toolz.pluck(columns, rows))))
+
+        results = []
+        computed = {}
+        for request in requests:
+            if request in computed:
+                results.append(computed[request])
+                continue
+
+            col, function, dtype = request
+            data = values[col]
+            if function == 'sum':
+                if dtype is not None:
+                    data = [dtype(v) for v in data]
+                result = sum(data)
+            elif function == 'min':
+                result = min(data)
+            elif function == 'max':
+                result = max(data)
+            elif function == 'count':
+                result = len(set(data))
+            elif function == 'size':
+                result = len(data)
+            elif function == 'avg':
+                result = sum(data)/len(data) if len(data) > 0 else None
+            else:
+                raise Exception("Unknown aggregate: {}".format(function))
+
+            computed[request] = result
+            results.append(result)
+
+        return results
+
+    def aggregate_metric(self, function, col=None, dtype=None):
+        """
+        Metric handler for a built-in aggregate. The rule handler
+        computes all the built-in aggregates of a rule in a single
+        pass (see toolz_aggregate).
+
+        Args:
+           function (str): sum, min, max, count, size or avg
+           col (str): Column to process. If None, the column matched
+                 by the rule is used.
+           dtype (callable): Type conversion for sum
+
+        Example:
+           self.metric_handlers = {
+               'total': self.aggregate_metric('sum', 'Duration'),
+               'avg_match': self.aggregate_metric('avg'),
+           }
+        """
+        return AggregateMetric(self, function, col, dtype)
+
     def clean_string(self, name):
         """
         Make the name column safe for use in URLs and database
@@ -157,8 +379,155 @@ class MetricHandlerMixin(object):
         cleaned = re.sub('_+', '_', cleaned)
         return cleaned
 
+class AggregateMetric(object):
+    """
+    Metric handler returned by MetricHandlerMixin.aggregate_metric. 
+    An object rather than a closure so that the processor can be
+    pickled, e.g., for a process executor.
+    """
+    def __init__(self, owner, function, col=None, dtype=None):
+        self.owner = owner
+        self.aggregate = (col, function, dtype)
+
+    def __call__(self, args, rows):
+        col, function, dtype = self.aggregate
+        column = col if col is not None else args['match']
+        return self.owner.toolz_aggregate([(column, function, dtype)], rows)[0]
+
 class TableRuleMixin(object):
 
+    share_predicates = True
+    """
+    Evaluate the rules of the processor as a RuleSet, so that the
+    predicates they have in common are evaluated once per table
+    """
+
+    adaptive_predicates = False
+    """
+    Learn the pass rates of the predicates on a sample of the tables
+    and reorder the rules accordingly (see RuleStats). Also enabled
+    by set_rule_stats.
+    """
+
+    rule_stats = None
+
+    def __getstate__(self):
+        # The compiled rules, rule sets and plans hold closures that
+        # cannot be pickled. They are rebuilt on first use.
+        state = self.__dict__.copy()
+        for name in ['_compiled_rules', '_compiled_masks', '_rule_set', '_rule_plans']:
+            state.pop(name, None)
+        return state
+
+    def table_compile_rule(self, rule):
+        """
+        Compile a rule into a predicate, caching the result
+
+        The rule dictionaries are reused across entities, so the
+        compiled form is cached per rule object.
+
+        Args:
+          rule (dict): Rule specification
+        """
+        return self._table_cached_rule('_compiled_rules', rule, compile_rule)
+
+    def table_compile_rule_mask(self, rule):
+        """
+        Compile a rule into a vectorized predicate over a
+        ColumnarTable, caching the result
+
+        Args:
+          rule (dict): Rule specification
+        """
+        return self._table_cached_rule('_compiled_masks', rule, compile_rule_mask)
+
+    def table_evaluate_rule_columnar(self, table, rule):
+        """
+        Evaluate a rule on all records of a columnar table
+
+        Args:
+          table (object): ColumnarTable, DataFrame or dict of arrays
+          rule (dict): Rule specification
+
+        Returns a boolean mask with one entry per record
+        """
+        return self.table_compile_rule_mask(rule)(as_columnar(table))
+
+    def table_rule_set(self):
+        """
+        RuleSet with the rules of all the operators of the processor.
+        Rebuilt when the rules are replaced or extended.
+        """
+        rules = getattr(self, 'rules', [])
+        entry = self.__dict__.get('_rule_set')
+        if entry is None or entry[0] is not rules or entry[1] != len(rules):
+            stats = self.rule_stats
+            if stats is None and self.adaptive_predicates:
+                stats = self.get_rule_stats()
+            ruleset = RuleSet(stats=stats)
+            for rule in rules:
+                for operator in rule['operators']:
+                    spec = operator.get('params', {}).get('rule', None)
+                    if spec is not None:
+                        ruleset.add(spec)
+            entry = (rules, len(rules), ruleset)
+            self.__dict__['_rule_set'] = entry
+        return entry[2]
+
+    def get_rule_stats(self):
+        """
+        Statistics of the predicates collected by this processor.
+        Save them with RuleStats.save and pass them to set_rule_stats
+        in a later run to start from the learned order.
+        """
+        if self.rule_stats is None:
+            self.set_rule_stats(RuleStats())
+        return self.rule_stats
+
+    def set_rule_stats(self, stats):
+        """
+        Use (and update) previously collected statistics
+
+        Args:
+          stats (class): RuleStats
+        """
+        self.rule_stats = stats
+        self.__dict__.pop('_rule_set', None)
+
+    def table_rule_cache(self, state, table):
+        """
+        Cache of the predicate results, upper-cased columns and
+        columnar form of a table, kept in the state so that all the
+        rules and processors that read the table share it. It is
+        reset when the table is replaced or changes length, and
+        HFEManager.process drops it before and after each run.
+
+        Args:
+          state (class): Feature state for the entity
+          table (str): Dataset name
+        """
+        rows = state.get_data(table)
+        try:
+            caches = state.get_data('__cache__')
+        except Exception:
+            caches = {}
+            state.set_data('__cache__', caches)
+
+        size = len(rows)
+        entry = caches.get(table)
+        if entry is None or entry[0] is not rows or entry[1] != size:
+            entry = caches[table] = (rows, size, {})
+        return entry[2]
+
+    def _table_cached_rule(self, name, rule, compiler):
+        cache = self.__dict__.setdefault(name, {})
+        entry = cache.get(id(rule))
+        if entry is None or entry[0] is not rule:
+            # Keep a reference to the rule so that the id is not reused
+            entry = (rule, compiler(rule))
+            cache[id(rule)] = entry
+        return entry[1]
+
     def table_evaluate_rule(self, row, rule, depth=0):
         """
         Recursively evaluate a rule on a record
@@ -170,41 +539,34 @@ class TableRuleMixin(object):
         match = rule["match"].strip().upper()
         values = rule["values"]
 
-        # Non-root
+        # Non-root. The children are evaluated lazily so that the
+        # operators short-circuit.
         if match in ['AND', 'ALL']:
-            results = []
-            for subrule in values:
-                result = self.table_evaluate_rule(row, subrule, depth+1)
-                results.append(result)
-            return all(results)
+            return all(self.table_evaluate_rule(row, subrule, depth+1)
+                       for subrule in values)
         elif match in ["OR", "ANY"]:
-            results = []
-            for subrule in values:
-                result = self.table_evaluate_rule(row, subrule, depth+1)
-                results.append(result)
-            return any(results)
+            return any(self.table_evaluate_rule(row, subrule, depth+1)
+                       for subrule in values)
         elif match in ["NAND"]:
             # 0 if all
             # 1 otherwise
-            results = []
-            for subrule in values:
-                result = self.table_evaluate_rule(row, subrule, depth+1)
-                results.append(result)
-            return not all(results)
+            return not all(self.table_evaluate_rule(row, subrule, depth+1)
+                           for subrule in values)
         elif match in ["XNAND"]:
             # 1 if any of them is true but not all
             # 0 otherwise
-            results = []
+            seen_true = seen_false = False
             for subrule in values:
-                result = self.table_evaluate_rule(row, subrule, depth+1)
-                results.append(result)
-            return (not all(results)) and (any(results))
+                if self.table_evaluate_rule(row, subrule, depth+1):
+                    seen_true = True
+                else:
+                    seen_false = True
+                if seen_true and seen_false:
+                    return True
+            return False
         elif match in ["NOR"]:
-            results = []
-            for subrule in values:
-                result = self.table_evaluate_rule(row, subrule, depth+1)
-                results.append(result)
-            return not any(results)
+            return not any(self.table_evaluate_rule(row, subrule, depth+1)
+                           for subrule in values)
 
         # Leaf node
         elif match in ["CONTAINS_ALL", "CONTAINS_ANY", "CONTAINS_NONE"]:
@@ -231,7 +593,7 @@ class TableRuleMixin(object):
             col = rule['column']
             data = row[col]
             if not (isinstance(values, int) or
-                    instance(values, float)):
+                    isinstance(values, float)):
                 raise Exception("Invalid specification: GT/LT spec should have an integer or float")
             if match == "GT":
                 result = data > values
@@ -248,56 +610,337 @@ class TableRuleMixin(object):
 
     def handler_table_apply_rule(self, state, rule, details):
 
-        rule_name = rule['name']
-
-        # print("Applying rule", rule_name)
+        # print("Applying rule", rule['name'])
         
-        level  = details['level']
         params = details['params']
 
         table    = params['table']
-        match    = params.get('match',None) 
-        rule     = params.get('rule', None) 
-        metrics  = params['metrics']
+        spec     = params.get('rule', None) 
 
         rows = state.get_data(table)
 
+        cache = None
+        if self.share_predicates:
+            cache = self.table_rule_cache(state, table)
+
+        # DataFrames and dicts of arrays are evaluated column-wise
+        if cache is not None and ('columnar',) in cache:
+            columnar = cache[('columnar',)]
+        else:
+            columnar = as_columnar(rows)
+            if cache is not None:
+                cache[('columnar',)] = columnar
+        if columnar is not None:
+            rows = columnar
+
         if len(rows) == 0:
             # print("Empty table") 
             return
 
         # Get the columns that should be processed
         # using this rule.
-        row0 = rows[0]
-        if hasattr(row0, 'asDict'):
-            # Special case: Handle Pyspark Row object...
-            row0 = row0.asDict()
-        row_keys = [str(i) for i in list(row0.keys())]
-        allcols = sorted(row_keys)
-
-        cols = []
-        if match is not None:
-            search = "^" + match + "$"
-            for c in allcols:
-                if re.search(search, c): 
-                    cols.append(c)
-            # print("Matched Cols", cols)
-            # print("All cols", allcols) 
+        if columnar is not None:
+            row0 = rows
         else:
-            cols = allcols[:1] 
+            row0 = rows[0]
+        plan = self.table_rule_plan(rule, details, row0)
                     
         # Now apply the filter for the rows...
-        if rule is not None: 
-            filtered_rows = [r for r in rows \
-                             if self.table_evaluate_rule(r, rule)]
+        if spec is not None and cache is not None:
+            ruleset = self.table_rule_set()
+            if columnar is not None:
+                filtered_rows = rows.take(ruleset.mask(spec, rows, cache))
+            else:
+                filtered_rows = ruleset.filter(spec, rows, cache)
+        elif spec is not None and columnar is not None:
+            mask = self.table_compile_rule_mask(spec)(rows)
+            filtered_rows = rows.take(mask)
+        elif spec is not None: 
+            predicate = self.table_compile_rule(spec)
+            filtered_rows = [r for r in rows if predicate(r)]
         else:
             # Include every thing if no rule is specified 
             filtered_rows = rows
         # print("Filtered rows", len(filtered_rows))
 
+        profiler = getattr(self, 'profiler', None)
+        if profiler is not None:
+            profiler.record('rule', (self.name, rule['name'], details.get('level', 1)),
+                            calls=0, rows=len(rows), passed=len(filtered_rows),
+                            features=len(plan['entries']) if len(filtered_rows) > 0 else 0)
+
         if len(filtered_rows) == 0:
             return
-        
+
+        self.table_apply_metrics(state, plan, filtered_rows)
+
+    def handler_table_apply_rule_batch(self, states, batch, rule, details):
+        """
+        Apply a rule to a batch of entities at once. The rule is
+        evaluated once over the whole table and the metrics are then
+        computed for each entity's segment of the filtered records.
+
+        Args:
+          states (list): Feature states, one per segment of the batch
+          batch (class): SegmentedTable with the grouped records
+          rule (dict): Rule specification
+          details (dict): Operator specification
+        """
+        spec = details['params'].get('rule', None) 
+
+        rows = batch.table
+        if len(rows) == 0:
+            return
+
+        plan = self.table_rule_plan(rule, details, rows)
+
+        # Filter the whole table once. The filtered records of an
+        # entity stay contiguous, so the segments carry over.
+        if spec is not None:
+            mask = self.table_compile_rule_mask(spec)(rows)
+            batch = batch.take(mask)
+
+        for state, filtered_rows in zip(states, batch):
+            if len(filtered_rows) == 0:
+                continue
+            self.table_apply_metrics(state, plan, filtered_rows)
+
+    def handler_table_update_rule(self, state, rule, details, rows):
+        """
+        Incremental version of handler_table_apply_rule. The new
+        records are filtered and folded into the partial aggregates
+        kept in the state. Only built-in aggregates (see
+        aggregate_metric) can be maintained this way.
+
+        Args:
+          state (class): Feature state for the entity
+          rule (dict): Rule specification
+          details (dict): Operator specification
+          rows (list): New records
+        """
+        spec = details['params'].get('rule', None)
+
+        columnar = as_columnar(rows)
+        if columnar is not None:
+            rows = columnar
+
+        if len(rows) == 0:
+            return
+
+        if columnar is not None:
+            row0 = rows
+        else:
+            row0 = rows[0]
+        plan = self.table_rule_plan(rule, details, row0)
+
+        partials = state.get_partials()
+        for mhandler, margs, feature, index in plan['entries']:
+            if index is None:
+                raise Exception("Metric {} of rule {} cannot be updated incrementally".format(margs['name'], rule['name']))
+            if feature in partials:
+                continue
+            # A feature computed by process() has no partial aggregate,
+            # and the new records cannot be folded into it
+            try:
+                state.get_feature(feature)
+            except KeyError:
+                continue
+            raise Exception("Feature {} was not built incrementally and cannot be updated. Build the state with update from the start.".format(feature))
+
+        if spec is not None and columnar is not None:
+            mask = self.table_compile_rule_mask(spec)(rows)
+            filtered_rows = rows.take(mask)
+        elif spec is not None:
+            predicate = self.table_compile_rule(spec)
+            filtered_rows = [r for r in rows if predicate(r)]
+        else:
+            filtered_rows = rows
+
+        if len(filtered_rows) == 0:
+            return
+
+        requests = plan['requests']
+        values = {}
+        for column, function, dtype in requests:
+            if column not in values:
+                values[column] = self.toolz_values(column, filtered_rows)
+
+        for mhandler, margs, feature, index in plan['entries']:
+            column, function, dtype = requests[index]
+            partial = partials.get(feature)
+            if partial is None:
+                partial = partials[feature] = make_partial(function, dtype)
+            partial.update(values[column])
+            state.set_feature(feature, partial.value())
+
+    def table_stream_operators(self, state, level):
+        """
+        Operators at a level over the lazy tables of a state, grouped
+        by table. Tables with operators that cannot be streamed, i.e.,
+        other handlers or custom metric handlers, are materialized
+        instead.
+
+        Args:
+          state (class): Feature state for the entity
+          level (int): Level of the feature
+        """
+        data = state.state['data']
+        lazy = [name for name, table in data.items()
+                if isinstance(table, LazyTable)]
+        if len(lazy) == 0:
+            return {}
+
+        streams = collections.OrderedDict()
+        for rule in self.rules:
+            for operator in rule['operators']:
+                if operator.get('level', 1) != level:
+                    continue
+                table = operator.get('params', {}).get('table')
+                if table in lazy:
+                    streams.setdefault(table, []).append((rule, operator))
+
+        for table, operators in list(streams.items()):
+            for rule, operator in operators:
+                if not self.table_streamable(operator):
+                    state.set_data(table, data[table].materialize())
+                    del streams[table]
+                    break
+
+        return streams
+
+    def table_streamable(self, details):
+        """
+        Whether an operator can be evaluated over a stream of records
+
+        Args:
+          details (dict): Operator specification
+        """
+        if details.get('handler') != 'handler_table_apply_rule':
+            return False
+        for mparams in details['params']['metrics']:
+            mhandler = self.metric_handlers[mparams['handler']]
+            if getattr(mhandler, 'aggregate', None) is None:
+                return False
+        return True
+
+    def handler_table_stream_rules(self, state, table, operators, chunksize=1024):
+        """
+        Apply several rules to a lazy table in one pass. Records are
+        read in chunks, filtered by each rule and folded into partial
+        aggregates, so only one chunk is in memory at a time.
+
+        Args:
+          state (class): Feature state for the entity
+          table (str): Name of the lazy table
+          operators (list): (rule, operator) tuples over the table
+          chunksize (int): Records read at a time
+        """
+        rows = state.get_data(table)
+        row0 = rows.peek()
+        if row0 is None:
+            return
+
+        streams = []
+        for rule, details in operators:
+            spec = details['params'].get('rule', None)
+            plan = self.table_rule_plan(rule, details, row0)
+            predicate = self.table_compile_rule(spec) if spec is not None else None
+            partials = [make_partial(function, dtype, exact=True)
+                        for column, function, dtype in plan['requests']]
+            streams.append([plan, predicate, partials, 0])
+
+        scanned = 0
+        for chunk in rows.chunks(chunksize):
+            scanned += len(chunk)
+            for stream in streams:
+                plan, predicate, partials, count = stream
+                if predicate is not None:
+                    filtered_rows = [r for r in chunk if predicate(r)]
+                else:
+                    filtered_rows = chunk
+                if len(filtered_rows) == 0:
+                    continue
+                stream[3] = count + len(filtered_rows)
+
+                values = {}
+                for (column, function, dtype), partial in zip(plan['requests'], partials):
+                    if column not in values:
+                        values[column] = self.toolz_values(column, filtered_rows)
+                    partial.update(values[column])
+
+        profiler = getattr(self, 'profiler', None)
+        for (rule, details), (plan, predicate, partials, count) in zip(operators, streams):
+            if profiler is not None:
+                profiler.record('rule', (self.name, rule['name'], details.get('level', 1)),
+                                calls=0, rows=scanned, passed=count,
+                                features=len(plan['entries']) if count > 0 else 0)
+            if count == 0:
+                continue
+            for mhandler, margs, feature, index in plan['entries']:
+                state.set_feature(feature, partials[index].value())
+
+    def table_rule_plan(self, rule, details, row0):
+        """
+        Execution plan of an operator for a table schema
+
+        The matched columns, the metric arguments and the feature
+        names only depend on the rule and the columns of the table,
+        so they are computed once per column signature and reused
+        for every entity. Metric handlers receive the cached
+        arguments and should not modify them. The plans are rebuilt
+        when the rules or the metric handlers are replaced.
+
+        Args:
+          rule (dict): Rule specification
+          details (dict): Operator specification
+          row0 (dict): A record, or the columnar table
+        """
+        if isinstance(row0, ColumnarTable):
+            signature = tuple(row0.columns)
+        elif hasattr(row0, '__fields__'):
+            # Special case: Handle Pyspark Row object...
+            signature = tuple(row0.__fields__)
+        else:
+            signature = tuple(row0.keys())
+
+        rules = getattr(self, 'rules', None)
+        plans = self.__dict__.get('_rule_plans')
+        if plans is None or plans[0] is not rules or plans[1] is not self.metric_handlers:
+            # Keep references to the rules and handlers so that a
+            # replacement is not mistaken for them
+            plans = (rules, self.metric_handlers, {})
+            self.__dict__['_rule_plans'] = plans
+
+        cache = plans[2]
+        key = (id(details), signature)
+        entry = cache.get(key)
+        if entry is None or entry[0] is not details:
+            # Keep a reference to the operator so that the id is not reused
+            entry = (details, self.table_build_plan(rule, details, signature))
+            cache[key] = entry
+        return entry[1]
+
+    def table_build_plan(self, rule, details, columns):
+        """
+        Build the execution plan of an operator (see table_rule_plan)
+
+        Args:
+          rule (dict): Rule specification
+          details (dict): Operator specification
+          columns (list): Column names of the table
+        """
+        rule_name = rule['name']
+
+        level  = details['level']
+        params = details['params']
+
+        match    = params.get('match',None) 
+        metrics  = params['metrics']
+
+        cols = self.table_match_columns(columns, match)
+
+        entries = []
+        requests = []
         for col in cols: 
             for mparams in metrics:
 
@@ -326,17 +969,111 @@ class TableRuleMixin(object):
 
                 if 'feature' not in margs: 
                     margs['feature'] = "tag__%(owner)s__%(rule_name)s__%(level)s__%(suffix)s"
-                    
-                # Now compute value...
-                value = mhandler(margs, filtered_rows)
-                
+
                 # Generate a name for the feature...
                 feature = self.generate_feature_name(margs) 
 
-                # print("Value", col, mname, feature, value)
-                
-                # Now update the feature table...
-                state.set_feature(feature, value)
+                # Built-in aggregates are computed together
+                index = None
+                aggregate = getattr(mhandler, 'aggregate', None)
+                if aggregate is not None:
+                    column, function, dtype = aggregate
+                    if column is None:
+                        column = col
+                    requests.append((column, function, dtype))
+                    index = len(requests) - 1
+
+                entries.append((mhandler, margs, feature, index))
+
+        return {
+            'cols': cols,
+            'entries': entries,
+            'requests': requests
+        }
+
+    def table_match_columns(self, columns, match):
+        """
+        Columns of the table that a rule should be processed for
+
+        Args:
+          columns (list): Column names of the table
+          match (str): Regular expression for the column names. If
+                 None, the first column is used.
+        """
+        allcols = sorted([str(i) for i in columns])
+
+        cols = []
+        if match is not None:
+            search = re.compile("^" + match + "$")
+            for c in allcols:
+                if search.search(c): 
+                    cols.append(c)
+            # print("Matched Cols", cols)
+            # print("All cols", allcols) 
+        else:
+            cols = allcols[:1] 
+
+        return cols
+
+    def table_apply_metrics(self, state, plan, filtered_rows):
+        """
+        Compute the metrics over the filtered records and update the
+        feature table of the state
+
+        Args:
+          state (class): Feature state for the entity
+          plan (dict): Execution plan from table_rule_plan
+          filtered_rows (list): Records that passed the rule
+        """
+        profiler = getattr(self, 'profiler', None)
+        if profiler is not None:
+            return self.table_apply_metrics_profiled(state, plan, filtered_rows, profiler)
+
+        if len(plan['requests']) > 0:
+            values = self.toolz_aggregate(plan['requests'], filtered_rows)
+
+        for mhandler, margs, feature, index in plan['entries']:
+
+            # Now compute value...
+            if index is not None:
+                value = values[index]
+            else:
+                value = mhandler(margs, filtered_rows)
+
+            # print("Value", feature, value)
+            
+            # Now update the feature table...
+            state.set_feature(feature, value)
+
+    def table_apply_metrics_profiled(self, state, plan, filtered_rows, profiler):
+        """
+        table_apply_metrics with the time spent per metric recorded
+
+        Args:
+          state (class): Feature state for the entity
+          plan (dict): Execution plan from table_rule_plan
+          filtered_rows (list): Records that passed the rule
+          profiler (class): HFEProfiler
+        """
+        clock = profiler.clock
+        if len(plan['requests']) > 0:
+            start = clock()
+            values = self.toolz_aggregate(plan['requests'], filtered_rows)
+            margs = plan['entries'][0][1]
+            profiler.record('metric', (self.name, margs['rule_name'], '__aggregate__'),
+                            clock() - start, rows=len(filtered_rows),
+                            features=len(plan['requests']))
+
+        for mhandler, margs, feature, index in plan['entries']:
+            if index is not None:
+                value = values[index]
+            else:
+                start = clock()
+                value = mhandler(margs, filtered_rows)
+                profiler.record('metric', (self.name, margs['rule_name'], margs['name']),
+                                clock() - start, rows=len(filtered_rows),
+                                features=1)
+            state.set_feature(feature, value)
 
     def generate_feature_name(self, params): 
         """
@@ -393,7 +1130,7 @@ class TableRuleMixin(object):
         elif match in ["GT", "GTE", "LT", "LTE"]:
             col = rule['column']
             if not (isinstance(values, int) or
-                    instance(values, float)):
+                    isinstance(values, float)):
                 raise Exception("Invalid specification: GT/LT spec should have an integer or float")
             if match == "GT":
                 doc = "{} value is > {}".format(col, values)
@@ -422,6 +1159,9 @@ class HFERuleBasedProcessor(HFEProcessor, TableRuleMixin):
         self.operator_handlers = {
             'handler_table_apply_rule': self.handler_table_apply_rule
         }
+        self.batch_operator_handlers = {
+            'handler_table_apply_rule': self.handler_table_apply_rule_batch
+        }
 
 
     def process(self, state, level):
@@ -433,6 +1173,10 @@ class HFERuleBasedProcessor(HFEProcessor, TableRuleMixin):
           level (int): Level of the feature
         """
 
+        # Operators over lazy tables are run together in one pass
+        streams = self.table_stream_operators(state, level)
+        streamed = set()
+
         # print("Process function of FERuleBasedProcessor")
         for rule in self.rules:
             for operator in rule['operators']:
@@ -441,11 +1185,136 @@ class HFERuleBasedProcessor(HFEProcessor, TableRuleMixin):
                 if operator.get('level', 1) != level:
                     continue
 
+                table = operator.get('params', {}).get('table')
+                if table in streams:
+                    if table not in streamed:
+                        streamed.add(table)
+                        self.handler_table_stream_rules(state, table, streams[table])
+                    continue
+
                 handler_name = operator.get('handler')
                 operator_handler = self.operator_handlers[handler_name]
                 
                 # This will update the state inline
+                profiler = self.profiler
+                if profiler is None:
+                    operator_handler(state, rule, details=operator)
+                    continue
+
+                start = profiler.clock()
                 operator_handler(state, rule, details=operator)
+                profiler.record('rule', (self.name, rule['name'], level),
+                                profiler.clock() - start)
+
+    def process_batch(self, states, level, batch):
+        """
+        Run the rules on a batch of entities. Operators over the
+        batch table are applied once for all entities; the rest fall
+        back to one call per state.
+
+        Args:
+          states (list): Feature states, one per entity
+          level (int): Level of the feature
+          batch (class): SegmentedTable with the grouped records
+        """
+        for rule in self.rules:
+            for operator in rule['operators']:
+
+                # Look at operators that match a given level
+                if operator.get('level', 1) != level:
+                    continue
+
+                handler_name = operator.get('handler')
+                batch_handler = self.batch_operator_handlers.get(handler_name)
+                if (batch_handler is not None and
+                    operator['params']['table'] == batch.name):
+                    batch_handler(states, batch, rule, details=operator)
+                    continue
+
+                operator_handler = self.operator_handlers[handler_name]
+                for state in states:
+                    operator_handler(state, rule, details=operator)
+
+    def update(self, state, level, name, rows):
+        """
+        Fold new records of a dataset into the features. Operators
+        on the dataset update their partial aggregates with the new
+        records only; operators on '__computed__' are re-run.
+
+        Args:
+          state (class): Feature state for the entity
+          level (int): Level of the feature
+          name (str): Dataset that received the records
+          rows (list): New records
+        """
+        for rule in self.rules:
+            for operator in rule['operators']:
+
+                # Look at operators that match a given level
+                if operator.get('level', 1) != level:
+                    continue
+
+                handler_name = operator.get('handler')
+                table = operator.get('params', {}).get('table')
+                if table == name:
+                    if handler_name != 'handler_table_apply_rule':
+                        raise Exception("Operator {} of rule {} cannot be updated incrementally".format(handler_name, rule['name']))
+                    self.handler_table_update_rule(state, rule, operator, rows)
+                elif table == '__computed__':
+                    operator_handler = self.operator_handlers[handler_name]
+                    operator_handler(state, rule, details=operator)
+
+    def _custom_process(self):
+        # Subclasses that override process may read any table at any
+        # level, so the rules do not tell when they need to run
+        cls = type(self)
+        return any(getattr(cls, method) is not getattr(HFERuleBasedProcessor, method)
+                   for method in ['process', 'process_batch', 'update'])
+
+    def get_levels(self):
+        """
+        Levels that the operators of the rules are registered for.
+        All levels if process is overridden.
+        """
+        if self._custom_process():
+            return super().get_levels()
+        levels = set()
+        for rule in self.rules:
+            for operator in rule['operators']:
+                levels.add(operator.get('level', 1))
+        return sorted(levels)
+
+    def get_tables(self, level):
+        """
+        Datasets read by the operators at a given level. None (any
+        table) if process is overridden.
+
+        Args:
+          level (int): Level of the feature
+        """
+        if self._custom_process():
+            return None
+        tables = set()
+        for rule in self.rules:
+            for operator in rule['operators']:
+                if operator.get('level', 1) != level:
+                    continue
+                table = operator.get('params', {}).get('table')
+                if table is None:
+                    # Custom operator that we cannot analyze
+                    return None
+                tables.add(table)
+        return sorted(tables)
+
+    def get_plan_key(self):
+        """
+        Levels and tables of the operators, so that rules edited in
+        place are rescheduled
+        """
+        if self._custom_process():
+            return None
+        return tuple((operator.get('level', 1), operator.get('params', {}).get('table'))
+                     for rule in self.rules for operator in rule['operators'])
 
     def autodoc(self):
         """
@@ -469,9 +1338,80 @@ class HFEManager(object):
         self.conf = conf
         self.sequence = conf.get('sequence', []) 
         self.processors = {}
+        self.levels = [1,2,3,4]
+        self.plan = None
+
+        # Optional concurrent execution of the processors in a level
+        self.executor_type = conf.get('executor', None)
+        if self.executor_type not in [None, 'thread', 'process']:
+            raise Exception("Invalid FEManager configuration. Executor should be 'thread' or 'process'")
+        self.max_workers = conf.get('max_workers', None)
+        self.executor = None
+        self.picklable = set()
+
+        # Optional profiling (see set_profiler)
+        self.profiler = None
+
+        # Feature names shared by the compact states of this manager
+        self.feature_index = HFEFeatureIndex()
 
     def add_processor(self, name, proc):
         self.processors[name] = proc
+        if self.profiler is not None:
+            proc.profiler = self.profiler
+        self.reset_plan()
+        if self.executor_type == 'process':
+            # The workers hold copies of the processors
+            self.close()
+
+    def create_compact_state(self):
+        """
+        HFECompactState that shares the feature index of this manager
+        """
+        return HFECompactState(self.feature_index)
+
+    def set_rule_stats(self, stats):
+        """
+        Share one set of predicate statistics among the rule-based
+        processors, e.g., loaded with RuleStats.load
+
+        Args:
+          stats (class): RuleStats
+        """
+        for proc in self.processors.values():
+            if hasattr(proc, 'set_rule_stats'):
+                proc.set_rule_stats(stats)
+
+    def get_rule_stats(self):
+        """
+        Predicate statistics of all the rule-based processors, merged
+        """
+        merged = RuleStats()
+        seen = set()
+        for proc in self.processors.values():
+            if not hasattr(proc, 'get_rule_stats'):
+                continue
+            stats = proc.get_rule_stats()
+            if id(stats) not in seen:
+                seen.add(id(stats))
+                merged.merge(stats)
+        return merged
+
+    def set_profiler(self, profiler):
+        """
+        Collect execution statistics of the manager and its
+        processors. None turns profiling off. With the 'process'
+        executor, the rule and metric stats of the workers are not
+        collected.
+
+        Args:
+          profiler (class): HFEProfiler
+        """
+        self.profiler = profiler
+        for proc in self.processors.values():
+            proc.profiler = profiler
+        if self.executor_type == 'process':
+            self.close()
 
     def resolve(self, path, extra={}):
         """
@@ -493,19 +1433,343 @@ class HFEManager(object):
             raise Exception("Invalid FEManager configuration. Expecting sequence as a list") 
 
         self.sequence = sequence
-        
+        self.reset_plan()
+
+    def reset_plan(self):
+        """
+        Drop the cached schedule. The schedule is recomputed when the
+        sequence, the processors or the levels and tables of their
+        rules (see get_plan_key) change.
+        """
+        self.plan = None
+
+    def get_plan(self):
+        """
+        Schedule of the computation. Levels that no processor uses are
+        left out and the '__computed__' table is only refreshed for
+        levels where some processor may read it.
+
+        Returns a list of dicts with the level, the names of the
+        processors to run and whether '__computed__' is needed. 
+        """
+        processors = self.get_processors()
+        signature = tuple((n, id(p), p.get_plan_key())
+                          for n, p in zip(self.sequence, processors))
+        if self.plan is not None and self.plan[0] == signature:
+            return self.plan[1]
+
+        schedule = []
+        for level in self.levels:
+            names = []
+            computed = False
+            for name, proc in zip(self.sequence, processors):
+                if level not in proc.get_levels():
+                    continue
+                names.append(name)
+                tables = proc.get_tables(level)
+                if tables is None or '__computed__' in tables:
+                    computed = True
+            if len(names) > 0:
+                schedule.append({
+                    'level': level,
+                    'processors': names,
+                    'computed': computed
+                })
+
+        self.plan = (signature, schedule)
+        return schedule
+
     def process(self, festate):
-        # Collect the processor instances
-        processors = [self.processors[n] for n in self.sequence] 
-        
-        # Go through all the processors for all levels of
-        # computation...
-        for level in [1,2,3,4]:
-            computed = festate.get_all_features()
-            # Create a table that the rules can use..
-            festate.set_data('__computed__', [computed])
-            for proc in processors:
-                proc.process(festate, level)
+        # The tables may be modified in place between runs, so the
+        # rule caches are only kept for the duration of a run
+        self.clear_cache(festate)
+        try:
+            self.process_plan(festate, self.profiler)
+        finally:
+            self.clear_cache(festate)
+
+    def clear_cache(self, festate):
+        """
+        Drop the rule caches of the tables of a state (see
+        TableRuleMixin.table_rule_cache)
+
+        Args:
+          festate (class): Feature state for the entity
+        """
+        festate.state['data'].pop('__cache__', None)
+
+    def process_plan(self, festate, profiler=None):
+        """
+        Run the processors of the plan on a state
+
+        Args:
+          festate (class): Feature state for the entity
+          profiler (class): HFEProfiler that records the time spent
+               per level and processor. None skips the measurements.
+        """
+        if profiler is not None:
+            clock = profiler.clock
+            begin = clock()
+            before = len(festate.get_feature_list())
+
+        plan = self.get_plan()
+        self.materialize_shared(festate, plan)
+
+        # Go through the processors for the levels that
+        # have something to compute...
+        for step in plan:
+            level = step['level']
+            if profiler is not None:
+                start = clock()
+            if step['computed']:
+                computed = festate.get_all_features()
+                # Create a table that the rules can use..
+                festate.set_data('__computed__', [computed])
+            names = step['processors']
+            if self.executor_type is not None and len(names) > 1:
+                self.process_parallel(festate, level, names)
+            elif profiler is None:
+                for name in names:
+                    self.processors[name].process(festate, level)
+            else:
+                for name in names:
+                    count = len(festate.get_feature_list())
+                    pstart = clock()
+                    self.processors[name].process(festate, level)
+                    profiler.record('processor', (name, level), clock() - pstart,
+                                    features=len(festate.get_feature_list()) - count)
+            if profiler is not None:
+                profiler.record('level', (level,), clock() - start)
+
+        if profiler is not None:
+            profiler.record('entity', (), clock() - begin,
+                            features=len(festate.get_feature_list()) - before)
+
+    def materialize_shared(self, festate, plan):
+        """
+        Lazy tables can be read only once. Materialize those that
+        are read at more than one step of the plan, or by processors
+        that do not declare the tables they read (see get_tables).
+
+        Args:
+          festate (class): Feature state for the entity
+          plan (list): Steps from get_plan
+        """
+        data = festate.state['data']
+        lazy = [name for name, table in data.items()
+                if isinstance(table, LazyTable)]
+        if len(lazy) == 0:
+            return
+
+        readers = collections.Counter()
+        for step in plan:
+            for pname in step['processors']:
+                tables = self.processors[pname].get_tables(step['level'])
+                for name in lazy:
+                    if tables is None:
+                        readers[name] += 2
+                    elif name in tables:
+                        readers[name] += 1
+
+        for name in lazy:
+            if readers[name] > 1:
+                festate.set_data(name, data[name].materialize())
+
+    def update(self, festate, name, rows):
+        """
+        Incremental processing for streaming data.
+
+        Folds new records of a dataset into a state at a cost
+        proportional to the number of new records, using partial
+        aggregates kept in the state. The features match processing
+        the full history, except for unique counts, which are
+        estimated with a HyperLogLog sketch. The state should be
+        built with update from the start: features computed by
+        process have no partial aggregates, and updating them is an
+        error. merge_states combines the states of the same entity
+        from different shards.
+
+        Args:
+          festate (class): Feature state for the entity
+          name (str): Dataset that received the records
+          rows (list): New records
+        """
+        for step in self.get_plan():
+            level = step['level']
+            if step['computed']:
+                computed = festate.get_all_features()
+                festate.set_data('__computed__', [computed])
+            for pname in step['processors']:
+                self.processors[pname].update(festate, level, name, rows)
+
+    def process_parallel(self, festate, level, names):
+        """
+        Run the processors of a level concurrently. 
+
+        Each processor works on a forked copy of the state, so it does
+        not see the features written by the other processors of the
+        same level. The writes are merged back in sequence order, and
+        two processors writing the same feature is an error.
+
+        With a process pool, the processors are sent to the workers
+        once (see get_executor), but each task sends the forked state,
+        datasets included, and receives the written features. This
+        pays off for processors that are slow compared to the size of
+        their data (see benchmarks/bench_supernova.py). The lazy
+        tables are materialized before they are sent.
+
+        Args:
+          festate (class): Feature state for the entity
+          level (int): Level of the feature
+          names (list): Processors to run
+        """
+        executor = self.get_executor()
+        if self.executor_type == 'process':
+            # Generators cannot be sent to the workers
+            data = festate.state['data']
+            for table, rows in list(data.items()):
+                if isinstance(rows, LazyTable):
+                    festate.set_data(table, rows.materialize())
+
+        futures = []
+        for name in names:
+            child = HFEForkedState(festate)
+            if self.executor_type == 'process':
+                futures.append(executor.submit(run_worker, name, child, level))
+            else:
+                futures.append(executor.submit(run_forked, self.processors[name],
+                                               child, level))
+
+        owners = {}
+        merged = collections.OrderedDict()
+        for name, future in zip(names, futures):
+            for feature, value in future.result().items():
+                if feature in owners:
+                    raise Exception("Conflicting writes to feature {} by processors {} and {}".format(feature, owners[feature], name))
+                owners[feature] = name
+                merged[feature] = value
+
+        for feature, value in merged.items():
+            festate.set_feature(feature, value)
+
+    def check_picklable(self, name):
+        """
+        Check that a processor can be sent to a worker process. 
+        Each processor is checked once: clear picklable after
+        changing its handlers.
+
+        Args:
+          name (str): Processor name
+        """
+        if name in self.picklable:
+            return
+        try:
+            pickle.dumps(self.processors[name])
+        except Exception as e:
+            raise Exception("Processor {} cannot be sent to a worker process ({}). Metric handlers should be aggregate_metric handlers, methods or module-level functions, not lambdas or local functions".format(name, e))
+        self.picklable.add(name)
+
+    def get_executor(self):
+        """
+        Executor used for concurrent processing. Created on first use.
+
+        A process pool sends the processors to its workers when it
+        starts, so they must be picklable (e.g., no lambdas in the
+        metric handlers). The workers do not see later changes to
+        the processors: call close() after modifying them in place.
+        add_processor and set_profiler do so.
+        """
+        if self.executor is None:
+            if self.executor_type == 'process':
+                for name in self.processors:
+                    self.check_picklable(name)
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    self.max_workers, initializer=init_worker,
+                    initargs=(dict(self.processors),))
+            else:
+                self.executor = concurrent.futures.ThreadPoolExecutor(self.max_workers)
+        return self.executor
+
+    def close(self):
+        """
+        Release the executor, if any
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def process_batch(self, table, key_columns, name=None, sink=None):
+        """
+        Process all entities of a table in one go. 
+
+        This is a replacement for grouping the table by entity and
+        calling process on a new HFEAtomicState per group. The table
+        is sorted by the key columns and segmented by entity, rule
+        based processors evaluate each rule once over the whole table
+        and the metrics are computed per segment.
+
+        Args:
+          table (object): DataFrame or dict of arrays with the records
+          key_columns (list): Columns that identify an entity
+          name (str): Dataset name used by the rules. If not
+                specified, it is inferred from the rules.
+          sink (class): Optional FeatureMatrixBuilder to collect the
+                features into
+
+        Returns a DataFrame with one row per entity, indexed by the
+        key columns, and one column per feature.
+        """
+        import pandas as pd
+
+        if isinstance(key_columns, str):
+            key_columns = [key_columns]
+
+        processors = self.get_processors()
+        if name is None:
+            name = self._infer_batch_table(processors)
+
+        batch = SegmentedTable.group(as_columnar(table), key_columns, name)
+
+        states = []
+        for segment in batch:
+            state = HFEAtomicState()
+            state.set_data(name, segment)
+            states.append(state)
+
+        for step in self.get_plan():
+            level = step['level']
+            if step['computed']:
+                for state in states:
+                    computed = state.get_all_features()
+                    state.set_data('__computed__', [computed])
+            for proc_name in step['processors']:
+                self.processors[proc_name].process_batch(states, level, batch)
+
+        if sink is not None:
+            if sink.key_columns is None:
+                sink.key_columns = key_columns
+            for key, state in zip(batch.keys, states):
+                sink.append_state(state, key)
+            return sink.to_frame()
+
+        if len(key_columns) == 1:
+            index = pd.Index(batch.keys, name=key_columns[0])
+        else:
+            index = pd.MultiIndex.from_tuples(batch.keys, names=key_columns)
+        return pd.DataFrame([state.state['features'] for state in states],
+                            index=index)
+
+    def _infer_batch_table(self, processors):
+        tables = set()
+        for proc in processors:
+            for rule in getattr(proc, 'rules', []):
+                for operator in rule['operators']:
+                    table = operator.get('params', {}).get('table')
+                    if table is not None and table != '__computed__':
+                        tables.add(table)
+        if len(tables) != 1:
+            raise Exception("Cannot infer the dataset name from the rules. Specify name")
+        return list(tables)[0]
 
     def get_processors(self):
 
@@ -0,0 +1,374 @@
+# coding: utf-8
+"""Columnar tables and vectorized rule evaluation.
+
+A `ColumnarTable` holds a dataset as a dict of equal-length NumPy
+arrays. Rules compiled with `compile_rule_mask` evaluate to boolean
+masks over such a table instead of being applied one record at a
+time.
+"""
+import collections
+import numpy as np
+
+from .rules import keyword_matcher
+
+__all__ = ['ColumnarTable', 'SegmentedTable', 'as_columnar',
+           'compile_rule_mask']
+
+
+class ColumnarTable(object):
+    """
+    Dataset stored as named, equal-length NumPy arrays.
+
+    Iterating over the table yields one dict per record (with native
+    Python values), so helpers that expect a list of records keep
+    working.
+    """
+    def __init__(self, columns):
+        self.data = collections.OrderedDict()
+        length = None
+        for name, values in columns.items():
+            values = np.asarray(values)
+            if length is None:
+                length = len(values)
+            elif len(values) != length:
+                raise Exception("Column length mismatch: {}".format(name))
+            self.data[name] = values
+        self.length = 0 if length is None else length
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        Build a table from a pandas DataFrame
+
+        String columns are converted to fixed-width unicode arrays
+        so that the string rules can use NumPy's vectorized string
+        operations. Those with missing values are kept as objects,
+        so that the rules fail on them as they do on the records.
+
+        Args:
+          df (DataFrame): Source frame
+        """
+        from pandas.api.types import infer_dtype
+
+        columns = collections.OrderedDict()
+        for name in df.columns:
+            series = df[name]
+            if infer_dtype(series, skipna=False) == 'string' and not series.isna().any():
+                columns[name] = series.to_numpy(dtype=str)
+            else:
+                columns[name] = series.to_numpy()
+        return cls(columns)
+
+    @property
+    def columns(self):
+        return list(self.data.keys())
+
+    def keys(self):
+        return self.data.keys()
+
+    def __len__(self):
+        return self.length
+
+    def __contains__(self, name):
+        return name in self.data
+
+    def __getitem__(self, name):
+        return self.data[name]
+
+    def __iter__(self):
+        names = list(self.data.keys())
+        values = [_tolist(self.data[n]) for n in names]
+        for record in zip(*values):
+            yield dict(zip(names, record))
+
+    def take(self, index):
+        """
+        Select records using a boolean mask or an array of positions
+
+        Args:
+          index (array): Mask or positions
+        """
+        return ColumnarTable(collections.OrderedDict(
+            (n, v[index]) for n, v in self.data.items()))
+
+    def slice(self, start, stop):
+        """
+        Contiguous range of records. The arrays are views.
+
+        Args:
+          start (int): First record
+          stop (int): One past the last record
+        """
+        return ColumnarTable(collections.OrderedDict(
+            (n, v[start:stop]) for n, v in self.data.items()))
+
+    def tolist(self, name):
+        """
+        Values of a column as native Python objects
+
+        Args:
+          name (str): Column name
+        """
+        return _tolist(self.data[name])
+
+
+def _tolist(values):
+    """
+    Values of an array as native Python objects. Dates and durations
+    become pandas Timestamps and Timedeltas, as in the records of a
+    DataFrame, rather than integers.
+    """
+    if values.dtype.kind in 'Mm':
+        import pandas as pd
+        return pd.Series(values).tolist()
+    return values.tolist()
+
+
+class SegmentedTable(object):
+    """
+    Table whose records are grouped into contiguous segments, one
+    per entity. Segment i spans records offsets[i]:offsets[i+1].
+    """
+    def __init__(self, table, offsets, keys=None, name=None):
+        self.table = table
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.keys = keys
+        self.name = name
+
+    @classmethod
+    def group(cls, table, key_columns, name=None):
+        """
+        Sort a table by the key columns and segment it by entity
+
+        Args:
+          table (class): ColumnarTable
+          key_columns (list): Columns that identify an entity
+          name (str): Dataset name of the table
+        """
+        if len(table) == 0:
+            return cls(table, [0], [], name)
+
+        # Encode each key as integer codes so that lexsort works
+        # for object columns as well
+        codes = []
+        for col in key_columns:
+            _, inverse = np.unique(table[col], return_inverse=True)
+            codes.append(inverse.ravel())
+        order = np.lexsort(codes[::-1])
+        table = table.take(order)
+
+        change = np.zeros(len(table), dtype=bool)
+        change[0] = True
+        for c in codes:
+            c = c[order]
+            change[1:] |= c[1:] != c[:-1]
+        starts = np.flatnonzero(change)
+        offsets = np.append(starts, len(table))
+
+        keycols = [_tolist(table[col][starts]) for col in key_columns]
+        if len(key_columns) == 1:
+            keys = keycols[0]
+        else:
+            keys = list(zip(*keycols))
+        return cls(table, offsets, keys, name)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.table.slice(self.offsets[i], self.offsets[i+1])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def take(self, mask):
+        """
+        Filter the records of all segments with a boolean mask. The
+        segments shrink accordingly and may become empty.
+
+        Args:
+          mask (array): Boolean mask over the whole table
+        """
+        positions = np.flatnonzero(mask)
+        offsets = np.searchsorted(positions, self.offsets)
+        return SegmentedTable(self.table.take(positions), offsets,
+                              self.keys, self.name)
+
+
+def as_columnar(table):
+    """
+    Return the columnar form of a table or None if the table is a
+    list of records.
+
+    Args:
+      table (object): ColumnarTable, DataFrame or dict of arrays
+    """
+    if isinstance(table, ColumnarTable):
+        return table
+    if isinstance(table, dict):
+        return ColumnarTable(table)
+    if hasattr(table, 'columns') and hasattr(table, 'to_numpy'):
+        return ColumnarTable.from_frame(table)
+    return None
+
+
+##############################################
+# Rule compilation
+##############################################
+def _upper(values):
+    """
+    Upper-case a string column. Object columns go through str.upper
+    so that non-string values fail the same way as in the row path.
+    """
+    if values.dtype.kind == 'U':
+        codes = np.ascontiguousarray(values).view(np.uint32)
+        if len(codes) > 0 and codes.max() >= 128:
+            # Non-ascii characters may expand when upper-cased
+            # (e.g., 'ß' -> 'SS'), so widen before converting
+            width = values.dtype.itemsize // 4
+            values = values.astype('U{}'.format(3 * width))
+        return np.char.upper(values)
+    elif values.dtype.kind == 'S':
+        return np.char.upper(values)
+    return np.array([v.upper() for v in values], dtype=object)
+
+
+def _column_upper(col):
+    def get(table, cache):
+        data = cache.get(col)
+        if data is None:
+            data = cache[col] = _upper(table[col])
+        return data
+    return get
+
+
+def _contains(data, pattern):
+    if data.dtype.kind in 'US':
+        return np.char.find(data, pattern) >= 0
+    return np.fromiter((pattern in v for v in data), dtype=bool, count=len(data))
+
+
+# Number of keywords from which CONTAINS masks scan each value once
+# instead of running one vectorized search per keyword
+MULTI_PATTERN_MIN = 32
+
+
+def _contains_many(data, test):
+    values = data.tolist() if data.dtype.kind in 'US' else data
+    return np.fromiter((test(v) for v in values), dtype=bool, count=len(data))
+
+
+def _compile_logical(match, children):
+    def combine(table, cache):
+        n = len(table)
+        if match in ['AND', 'ALL', 'NAND', 'XNAND']:
+            every = np.ones(n, dtype=bool)
+        if match in ['OR', 'ANY', 'NOR', 'XNAND']:
+            some = np.zeros(n, dtype=bool)
+        for child in children:
+            mask = child(table, cache)
+            if match in ['AND', 'ALL', 'NAND', 'XNAND']:
+                every &= mask
+            if match in ['OR', 'ANY', 'NOR', 'XNAND']:
+                some |= mask
+
+        if match in ['AND', 'ALL']:
+            return every
+        elif match in ['OR', 'ANY']:
+            return some
+        elif match == 'NAND':
+            return ~every
+        elif match == 'XNAND':
+            return ~every & some
+        return ~some
+    return combine
+
+
+def _compile_mask(rule):
+    match = rule["match"].strip().upper()
+    values = rule["values"]
+
+    # Non-root
+    if match in ['AND', 'ALL', 'OR', 'ANY', 'NAND', 'XNAND', 'NOR']:
+        children = tuple(_compile_mask(subrule) for subrule in values)
+        return _compile_logical(match, children)
+
+    # Leaf node
+    if match in ["CONTAINS_ALL", "CONTAINS_ANY", "CONTAINS_NONE"]:
+        column = _column_upper(rule['column'])
+        patterns = tuple(v.strip().upper() for v in values)
+        test = None
+        if len(set(patterns)) >= MULTI_PATTERN_MIN:
+            match_any, match_all = keyword_matcher(patterns)
+            test = match_all if match == "CONTAINS_ALL" else match_any
+
+        def contains(table, cache):
+            data = column(table, cache)
+            if test is not None:
+                result = _contains_many(data, test)
+                return ~result if match == "CONTAINS_NONE" else result
+            if match == "CONTAINS_ALL":
+                result = np.ones(len(table), dtype=bool)
+                for p in patterns:
+                    result &= _contains(data, p)
+            else:
+                result = np.zeros(len(table), dtype=bool)
+                for p in patterns:
+                    result |= _contains(data, p)
+                if match == "CONTAINS_NONE":
+                    result = ~result
+            return result
+        return contains
+
+    elif match in ["IN", "NOTIN"]:
+        column = _column_upper(rule['column'])
+        accepted = sorted(set(v.upper() for v in values))
+
+        def member(table, cache):
+            data = column(table, cache)
+            if data.dtype.kind in 'US':
+                result = np.isin(data, np.array(accepted, dtype=str))
+            else:
+                lookup = frozenset(accepted)
+                result = np.fromiter((v in lookup for v in data),
+                                     dtype=bool, count=len(data))
+            return result if match == "IN" else ~result
+        return member
+
+    elif match in ["GT", "GTE", "LT", "LTE"]:
+        col = rule['column']
+        if not (isinstance(values, int) or
+                isinstance(values, float)):
+            raise Exception("Invalid specification: GT/LT spec should have an integer or float")
+        compare = {
+            'GT': np.greater,
+            'GTE': np.greater_equal,
+            'LT': np.less,
+            'LTE': np.less_equal
+        }[match]
+        return lambda table, cache: np.asarray(compare(table[col], values), dtype=bool)
+
+    return lambda table, cache: np.zeros(len(table), dtype=bool)
+
+
+def compile_rule_mask(rule):
+    """
+    Compile a rule specification into a vectorized predicate
+
+    The result is a function that takes a `ColumnarTable` and
+    returns a boolean mask with one entry per record. It is
+    equivalent to applying `TableRuleMixin.table_evaluate_rule` to
+    every record: IN/NOTIN use `isin`, CONTAINS_* use vectorized
+    substring search, GT/LT are array comparisons and the logical
+    operators combine masks with `&`, `|` and `~`.
+
+    Args:
+      rule (dict): Rule specification
+    """
+    evaluate = _compile_mask(rule)
+
+    def predicate(table):
+        # Upper-cased columns are shared by the leaves of the rule
+        return evaluate(table, {})
+    return predicate
@@ -0,0 +1,135 @@
+# coding: utf-8
+"""Compact feature state.
+
+`HFECompactState` has the same feature and data API as
+`HFEAtomicState`, but is meant for keeping millions of entities in
+memory. It uses __slots__, and the feature names are kept once in an
+`HFEFeatureIndex` shared by the states; each state only holds a list
+of values aligned with the index. Pass the same index, e.g.,
+`HFEManager.feature_index`, to the states that should share it.
+"""
+import collections
+
+from .lazy import as_table
+
+__all__ = ['HFEFeatureIndex', 'HFECompactState']
+
+
+class _Missing(object):
+    """
+    Marker for features that an entity does not have
+    """
+    __slots__ = ()
+
+    def __reduce__(self):
+        return '_MISSING'
+
+    def __repr__(self):
+        return '<missing>'
+
+_MISSING = _Missing()
+
+
+class HFEFeatureIndex(object):
+    """
+    Mapping from feature names to positions, shared by many states
+    """
+    __slots__ = ('names', 'positions')
+
+    def __init__(self, names=None):
+        self.names = []
+        self.positions = {}
+        for name in names or []:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        """
+        Position of a feature, registering it if needed
+
+        Args:
+          name (str): Feature name
+        """
+        pos = self.positions.get(name)
+        if pos is None:
+            pos = self.positions[name] = len(self.names)
+            self.names.append(name)
+        return pos
+
+
+class HFECompactState(object):
+    """
+    Memory-efficient feature state for a unit entity.
+
+    Features are listed in the order of the shared index rather than
+    in the order in which this entity's features were set.
+    """
+    __slots__ = ('index', 'values', 'data', 'partials')
+
+    def __init__(self, index=None, *args, **kwargs):
+        """
+        Args:
+          index (class): HFEFeatureIndex shared with other states.
+                 Without one, the state gets an index of its own.
+        """
+        self.index = index if index is not None else HFEFeatureIndex()
+        self.values = []
+        self.data = None
+        self.partials = None
+
+    @property
+    def state(self):
+        """
+        Read-only view in the layout of HFEAtomicState.state
+        """
+        return {
+            'features': self.get_all_features(),
+            'data': self.data if self.data is not None else {}
+        }
+
+    def get_feature_list(self):
+        names = self.index.names
+        return [names[i] for i, v in enumerate(self.values) if v is not _MISSING]
+
+    def get_all_features(self):
+        names = self.index.names
+        return collections.OrderedDict(
+            (names[i], v) for i, v in enumerate(self.values) if v is not _MISSING)
+
+    def set_feature(self, name, value):
+        pos = self.index.positions.get(name)
+        if pos is None:
+            pos = self.index.add(name)
+        values = self.values
+        if pos >= len(values):
+            values.extend([_MISSING] * (pos + 1 - len(values)))
+        values[pos] = value
+
+    def get_feature(self, name):
+        pos = self.index.positions.get(name)
+        if pos is None or pos >= len(self.values) or self.values[pos] is _MISSING:
+            raise KeyError(name)
+        return self.values[pos]
+
+    def get_data(self, name):
+        if self.data is None or name not in self.data:
+            raise Exception("Unknown dataset: {}".format(name))
+        return self.data[name]
+
+    def set_data(self, name, value):
+        if self.data is None:
+            self.data = {}
+        self.data[name] = as_table(value)
+
+    def get_partials(self):
+        if self.partials is None:
+            self.partials = {}
+        return self.partials
+
+    def clear_data(self):
+        """
+        Drop the datasets, e.g., once the features are computed
+        """
+        self.data = None
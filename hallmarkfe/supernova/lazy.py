@@ -0,0 +1,97 @@
+# coding: utf-8
+"""Lazy tables.
+
+`set_data` accepts iterators (e.g., a Spark group iterator) and
+callables returning an iterable, besides materialized lists. These are
+wrapped in a `LazyTable` that is consumed once. The rule processor
+evaluates all the operators over a lazy table in a single streaming
+pass, keeping only the aggregation state per operator, so that the
+memory per entity does not grow with the number of records.
+
+    state.set_data('calls', (row.asDict() for row in group))
+    mgr.process(state)
+
+A lazy table is materialized into a list when it has to be read more
+than once, e.g., by several processors or by custom metric handlers.
+"""
+import itertools
+
+__all__ = ['LazyTable', 'as_table']
+
+
+class LazyTable(object):
+    """
+    Records that are read once, on demand
+    """
+    def __init__(self, source):
+        """
+        Args:
+          source (object): Iterable of records, or a callable that
+                returns one
+        """
+        self.source = source
+        self.iterator = None
+        self.head = []
+        self.consumed = False
+
+    def get_iterator(self):
+        if self.consumed:
+            raise Exception("Lazy table has already been consumed")
+        if self.iterator is None:
+            source = self.source() if callable(self.source) else self.source
+            self.iterator = iter(source)
+            self.source = None
+        return self.iterator
+
+    def peek(self):
+        """
+        First record, or None if the table is empty. The record is
+        not consumed.
+        """
+        if len(self.head) == 0:
+            for row in itertools.islice(self.get_iterator(), 1):
+                self.head.append(row)
+        return self.head[0] if len(self.head) > 0 else None
+
+    def __iter__(self):
+        iterator = self.get_iterator()
+        head, self.head = self.head, []
+        self.consumed = True
+        return itertools.chain(head, iterator)
+
+    def chunks(self, size=1024):
+        """
+        Consume the records in lists of at most size records
+
+        Args:
+          size (int): Records per chunk
+        """
+        rows = iter(self)
+        while True:
+            chunk = list(itertools.islice(rows, size))
+            if len(chunk) == 0:
+                return
+            yield chunk
+
+    def materialize(self):
+        """
+        Consume the records into a list
+        """
+        return list(self)
+
+
+def as_table(value):
+    """
+    Wrap iterators and callables in a LazyTable. Lists, dicts,
+    DataFrames and other sized tables are returned as they are.
+
+    Args:
+      value (object): Dataset passed to set_data
+    """
+    if isinstance(value, LazyTable):
+        return value
+    if callable(value) and not hasattr(value, '__len__'):
+        return LazyTable(value)
+    if hasattr(value, '__next__'):
+        return LazyTable(value)
+    return value
@@ -0,0 +1,238 @@
+# coding: utf-8
+"""Feature matrix sink.
+
+`FeatureMatrixBuilder` collects the features of many entities
+directly into typed NumPy columns, instead of building a pandas
+Series per entity and concatenating them at the end.
+
+    builder = FeatureMatrixBuilder(features, key_columns=['In'])
+    for key, rows in groups:
+        state = HFEAtomicState()
+        state.set_data('calls', rows)
+        mgr.process(state)
+        builder.append_state(state, key)
+    df = builder.to_frame()
+"""
+import collections
+import numpy as np
+
+__all__ = ['FeatureMatrixBuilder']
+
+
+class _Column(object):
+    """
+    Growing typed array with a validity mask. The dtype is widened
+    when a value does not fit, ending with object.
+    """
+    def __init__(self, dtype, capacity):
+        self.dtype = np.dtype(dtype)
+        self.values = np.empty(capacity, dtype=self.dtype)
+        self.valid = np.zeros(capacity, dtype=bool)
+        self.types = set()
+
+    def set(self, n, value):
+        if type(value) not in self.types:
+            self.accept(value)
+        try:
+            self.values[n] = value
+        except (TypeError, ValueError, OverflowError):
+            self.promote(object)
+            self.values[n] = value
+        self.valid[n] = True
+
+    def accept(self, value):
+        """
+        Widen the dtype so that values of this type are kept as they
+        are, e.g., 7 is not stored as True in a bool column
+        """
+        dtype = np.dtype(object)
+        if self.dtype.kind != 'O' and \
+           isinstance(value, (bool, int, float, np.bool_, np.number)):
+            try:
+                dtype = np.result_type(self.dtype, value)
+            except (TypeError, OverflowError):
+                pass
+        if dtype != self.dtype:
+            self.promote(dtype)
+        self.types.add(type(value))
+
+    def promote(self, dtype):
+        self.dtype = np.dtype(dtype)
+        self.values = self.values.astype(self.dtype)
+
+    def grow(self, capacity):
+        values = np.empty(capacity, dtype=self.dtype)
+        values[:len(self.values)] = self.values
+        valid = np.zeros(capacity, dtype=bool)
+        valid[:len(self.valid)] = self.valid
+        self.values = values
+        self.valid = valid
+
+
+class FeatureMatrixBuilder(object):
+    """
+    Accumulate entity features into a columnar feature matrix.
+    """
+    def __init__(self, features=None, key_columns=None, capacity=1024,
+                 strict=False):
+        """
+        Args:
+          features (object): Feature names (float64 columns) or a dict
+                 of feature names to NumPy dtypes
+          key_columns (list): Names of the entity key columns
+          capacity (int): Initial number of rows. Doubles as needed.
+          strict (bool): Reject features that are not registered.
+                 Otherwise they are added as they show up, with the
+                 dtype inferred from the first value. Columns are
+                 widened (bool, int, float, object) as values that
+                 do not fit show up.
+        """
+        self.key_columns = key_columns
+        self.capacity = max(1, capacity)
+        self.strict = strict
+        self.length = 0
+        self.keys = []
+        self.columns = collections.OrderedDict()
+
+        if isinstance(features, dict):
+            for name, dtype in features.items():
+                self.register(name, dtype)
+        else:
+            for name in features or []:
+                self.register(name)
+
+    def __len__(self):
+        return self.length
+
+    def register(self, name, dtype='float64'):
+        """
+        Add a feature column
+
+        Args:
+          name (str): Feature name
+          dtype (object): NumPy dtype of the column
+        """
+        if name not in self.columns:
+            self.columns[name] = _Column(dtype, self.capacity)
+        return self.columns[name]
+
+    def _infer_dtype(self, value):
+        if isinstance(value, (bool, np.bool_)):
+            return 'bool'
+        if isinstance(value, (int, float, np.number)):
+            return 'float64'
+        return 'object'
+
+    def append(self, features, key=None):
+        """
+        Add the features of one entity
+
+        Args:
+          features (dict): Feature names and values
+          key (object): Entity key
+        """
+        n = self.length
+        if n == self.capacity:
+            self.capacity *= 2
+            for column in self.columns.values():
+                column.grow(self.capacity)
+
+        columns = self.columns
+        for name, value in features.items():
+            column = columns.get(name)
+            if column is None:
+                if self.strict:
+                    raise Exception("Unregistered feature: {}".format(name))
+                column = self.register(name, self._infer_dtype(value))
+            if value is None:
+                continue
+            column.set(n, value)
+
+        self.keys.append(key)
+        self.length = n + 1
+
+    def append_state(self, state, key=None):
+        """
+        Add the features of a state without copying them first
+
+        Args:
+          state (class): Feature state of the entity
+          key (object): Entity key
+        """
+        features = getattr(state, 'state', None)
+        if isinstance(features, dict) and isinstance(features.get('features'), dict):
+            features = features['features']
+        else:
+            features = state.get_all_features()
+        self.append(features, key)
+
+    def get_arrays(self):
+        """
+        Collected columns as (name, values, valid) tuples, trimmed to
+        the number of entities
+        """
+        n = self.length
+        return [(name, column.values[:n], column.valid[:n])
+                for name, column in self.columns.items()]
+
+    def get_index(self):
+        import pandas as pd
+
+        if self.key_columns is None:
+            return None
+        if len(self.key_columns) == 1:
+            return pd.Index(self.keys, name=self.key_columns[0])
+        return pd.MultiIndex.from_tuples(self.keys, names=self.key_columns)
+
+    def to_frame(self):
+        """
+        Feature matrix as a DataFrame. Missing values are NaN for
+        float columns, None for object columns and use the nullable
+        pandas types for integer and boolean columns.
+        """
+        import pandas as pd
+
+        data = collections.OrderedDict()
+        for name, values, valid in self.get_arrays():
+            if valid.all():
+                data[name] = values
+            elif values.dtype.kind == 'f':
+                data[name] = np.where(valid, values, np.nan)
+            elif values.dtype.kind == 'O':
+                data[name] = np.where(valid, values, None)
+            elif values.dtype.kind == 'b':
+                data[name] = pd.arrays.BooleanArray(values, ~valid)
+            elif values.dtype.kind in 'iu':
+                data[name] = pd.arrays.IntegerArray(values, ~valid)
+            else:
+                data[name] = pd.Series(values).where(valid).array
+
+        return pd.DataFrame(data, index=self.get_index())
+
+    def to_arrow(self):
+        """
+        Feature matrix as a pyarrow Table. The key columns come first.
+        """
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise Exception("pyarrow is required for to_arrow")
+
+        names = []
+        arrays = []
+        if self.key_columns is not None:
+            if len(self.key_columns) == 1:
+                keycols = [self.keys]
+            else:
+                keycols = list(zip(*self.keys)) if self.length > 0 else [[]] * len(self.key_columns)
+            for name, values in zip(self.key_columns, keycols):
+                names.append(name)
+                arrays.append(pa.array(list(values)))
+
+        for name, values, valid in self.get_arrays():
+            names.append(name)
+            if values.dtype.kind == 'O':
+                arrays.append(pa.array(values.tolist(), mask=~valid))
+            else:
+                arrays.append(pa.array(values, mask=~valid))
+        return pa.Table.from_arrays(arrays, names=names)
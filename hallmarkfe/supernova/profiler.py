@@ -0,0 +1,122 @@
+# coding: utf-8
+"""Profiling hooks.
+
+An `HFEProfiler` attached to a manager collects wall time, call
+counts, records scanned and passing the rule filters, and features
+emitted, per processor, rule and metric handler:
+
+    profiler = HFEProfiler()
+    mgr.set_profiler(profiler)
+    for state in states:
+        mgr.process(state)
+    print(profiler.to_frame())
+
+Profiling is off unless a profiler is set; the hooks then reduce to a
+check for None. A profiler can be shared by the threads of the thread
+executor. With the process executor, each worker updates its own copy.
+"""
+import time
+import threading
+import collections
+
+__all__ = ['HFEProfiler']
+
+FIELDS = ['calls', 'seconds', 'rows', 'passed', 'features']
+
+
+class HFEProfiler(object):
+    """
+    Accumulates execution statistics. Stats are keyed on a kind and
+    a tuple:
+
+      entity: () - one call per HFEManager.process
+      level: (level,)
+      processor: (processor, level)
+      rule: (processor, rule, level)
+      metric: (processor, rule, metric). Built-in aggregates of a
+              rule are computed together and reported as the
+              '__aggregate__' metric.
+    """
+    clock = staticmethod(time.perf_counter)
+
+    def __init__(self, callback=None):
+        """
+        Args:
+          callback (callable): Called with each recorded event, a dict
+               with the kind, the key and the increments of the stats
+        """
+        self.callback = callback
+        self.stats = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def record(self, kind, key, seconds=0.0, calls=1, rows=0, passed=0,
+               features=0):
+        """
+        Add an event to the statistics
+
+        Args:
+          kind (str): entity, level, processor, rule or metric
+          key (tuple): Identifies the processor, rule etc.
+          seconds (float): Wall time
+          calls (int): Number of calls
+          rows (int): Records scanned
+          passed (int): Records that passed the rule filter
+          features (int): Features emitted
+        """
+        with self.lock:
+            stats = self.stats.get((kind, key))
+            if stats is None:
+                stats = self.stats[(kind, key)] = dict.fromkeys(FIELDS, 0)
+            stats['calls'] += calls
+            stats['seconds'] += seconds
+            stats['rows'] += rows
+            stats['passed'] += passed
+            stats['features'] += features
+
+        if self.callback is not None:
+            self.callback({
+                'kind': kind,
+                'key': key,
+                'calls': calls,
+                'seconds': seconds,
+                'rows': rows,
+                'passed': passed,
+                'features': features
+            })
+
+    def report(self, kind=None):
+        """
+        Statistics as a list of dicts, slowest first
+
+        Args:
+          kind (str): Only include stats of this kind
+        """
+        result = []
+        with self.lock:
+            for (k, key), stats in self.stats.items():
+                if kind is not None and k != kind:
+                    continue
+                entry = {'kind': k, 'key': key}
+                entry.update(stats)
+                result.append(entry)
+        return sorted(result, key=lambda e: e['seconds'], reverse=True)
+
+    def to_frame(self, kind=None):
+        """
+        Report as a DataFrame
+        """
+        import pandas as pd
+        return pd.DataFrame(self.report(kind), columns=['kind', 'key'] + FIELDS)
+
+    def reset(self):
+        with self.lock:
+            self.stats = collections.OrderedDict()
@@ -0,0 +1,303 @@
+# coding: utf-8
+"""Rule compiler for the table rule DSL.
+
+Turns a rule specification (the nested dict with `match`, `values`
+and `column` used by `TableRuleMixin`) into a tree of closures once,
+so that evaluating the rule on a record does not re-parse the spec.
+
+CONTAINS leaves with many keywords scan each value once: ANY/NONE use
+a regular expression built from a trie of the keywords, and ALL uses
+an Aho-Corasick automaton if pyahocorasick is installed.
+"""
+import re
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+__all__ = ['compile_rule', 'keyword_matcher', 'rule_columns']
+
+# Number of keywords from which CONTAINS leaves use a single scan
+MULTI_PATTERN_MIN = 4
+
+
+def _compile_and(children):
+    def evaluate(row):
+        for child in children:
+            if not child(row):
+                return False
+        return True
+    return evaluate
+
+
+def _compile_or(children):
+    def evaluate(row):
+        for child in children:
+            if child(row):
+                return True
+        return False
+    return evaluate
+
+
+def _compile_nand(children):
+    # 0 if all
+    # 1 otherwise
+    def evaluate(row):
+        for child in children:
+            if not child(row):
+                return True
+        return False
+    return evaluate
+
+
+def _compile_xnand(children):
+    # 1 if any of them is true but not all
+    # 0 otherwise
+    def evaluate(row):
+        seen_true = seen_false = False
+        for child in children:
+            if child(row):
+                seen_true = True
+            else:
+                seen_false = True
+            if seen_true and seen_false:
+                return True
+        return False
+    return evaluate
+
+
+def _compile_nor(children):
+    def evaluate(row):
+        for child in children:
+            if child(row):
+                return False
+        return True
+    return evaluate
+
+
+def _trie_regex(patterns):
+    """
+    Regular expression that matches if any of the patterns occurs.
+    Patterns sharing a prefix share a branch, so that the regex
+    engine does not try every keyword at every position.
+    """
+    trie = {}
+    for p in patterns:
+        node = trie
+        for ch in p:
+            if None in node:
+                break
+            node = node.setdefault(ch, {})
+        else:
+            # Longer patterns with this prefix cannot change the result
+            node.clear()
+            node[None] = True
+
+    def emit(node):
+        alts = []
+        chars = []
+        for ch in sorted(node):
+            if None in node[ch]:
+                chars.append(re.escape(ch))
+            else:
+                alts.append(re.escape(ch) + emit(node[ch]))
+        if len(chars) == 1:
+            alts.append(chars[0])
+        elif len(chars) > 1:
+            alts.append('[' + ''.join(chars) + ']')
+        return alts[0] if len(alts) == 1 else '(?:' + '|'.join(alts) + ')'
+
+    return re.compile(emit(trie))
+
+
+def keyword_matcher(patterns):
+    """
+    Functions (match_any, match_all) that check whether any or all
+    of the patterns occur in a string, scanning it once. Same result
+    as testing each pattern with `in`.
+
+    Args:
+      patterns (tuple): Keywords
+    """
+    patterns = tuple(dict.fromkeys(patterns))
+    if '' in patterns:
+        # The empty string occurs in every string
+        rest = tuple(p for p in patterns if p != '')
+        match_all = keyword_matcher(rest)[1] if rest else (lambda data: True)
+        return (lambda data: True), match_all
+    if len(patterns) == 0:
+        return (lambda data: False), (lambda data: True)
+
+    search = _trie_regex(patterns).search
+    match_any = lambda data: search(data) is not None
+
+    if ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+        for i, p in enumerate(patterns):
+            automaton.add_word(p, i)
+        automaton.make_automaton()
+        total = len(patterns)
+
+        def match_all(data):
+            found = set()
+            for end, i in automaton.iter(data):
+                found.add(i)
+                if len(found) == total:
+                    return True
+            return False
+    else:
+        def match_all(data):
+            for p in patterns:
+                if p not in data:
+                    return False
+            return True
+
+    return match_any, match_all
+
+
+def _compile_contains(match, col, values, normalized):
+    patterns = tuple(v.strip().upper() for v in values)
+    if len(set(patterns)) >= MULTI_PATTERN_MIN:
+        match_any, match_all = keyword_matcher(patterns)
+        if normalized:
+            if match == "CONTAINS_ALL":
+                return lambda row: match_all(row[col])
+            elif match == "CONTAINS_ANY":
+                return lambda row: match_any(row[col])
+            return lambda row: not match_any(row[col])
+        if match == "CONTAINS_ALL":
+            return lambda row: match_all(row[col].upper())
+        elif match == "CONTAINS_ANY":
+            return lambda row: match_any(row[col].upper())
+        return lambda row: not match_any(row[col].upper())
+
+    upper = not normalized
+    if match == "CONTAINS_ALL":
+        def evaluate(row):
+            data = row[col]
+            if upper:
+                data = data.upper()
+            for p in patterns:
+                if p not in data:
+                    return False
+            return True
+    elif match == "CONTAINS_ANY":
+        def evaluate(row):
+            data = row[col]
+            if upper:
+                data = data.upper()
+            for p in patterns:
+                if p in data:
+                    return True
+            return False
+    else:
+        # contains_none
+        def evaluate(row):
+            data = row[col]
+            if upper:
+                data = data.upper()
+            for p in patterns:
+                if p in data:
+                    return False
+            return True
+    return evaluate
+
+
+def _compile_member(match, col, values, normalized):
+    accepted = frozenset(v.upper() for v in values)
+    if match == "IN":
+        if normalized:
+            return lambda row: row[col] in accepted
+        return lambda row: row[col].upper() in accepted
+    if normalized:
+        return lambda row: row[col] not in accepted
+    return lambda row: row[col].upper() not in accepted
+
+
+def _compile_compare(match, col, values):
+    if not (isinstance(values, int) or
+            isinstance(values, float)):
+        raise Exception("Invalid specification: GT/LT spec should have an integer or float")
+
+    if match == "GT":
+        return lambda row: row[col] > values
+    elif match == "GTE":
+        return lambda row: row[col] >= values
+    elif match == "LT":
+        return lambda row: row[col] < values
+    return lambda row: row[col] <= values
+
+
+_LOGICAL = {
+    'AND': _compile_and,
+    'ALL': _compile_and,
+    'OR': _compile_or,
+    'ANY': _compile_or,
+    'NAND': _compile_nand,
+    'XNAND': _compile_xnand,
+    'NOR': _compile_nor,
+}
+
+
+def compile_rule(rule, normalized=()):
+    """
+    Compile a rule specification into a predicate
+
+    The match strings are normalized, the values of IN/NOTIN are
+    turned into frozensets of upper-cased strings and the logical
+    operators short-circuit. The result is a function that takes a
+    record and returns a boolean, with the same semantics as
+    `TableRuleMixin.table_evaluate_rule`.
+
+    Args:
+      rule (dict): Rule specification
+      normalized (set): Columns whose values are already upper-cased
+           in the records passed to the predicate (see
+           `rule_columns`). The string matches on them skip
+           upper().
+    """
+    match = rule["match"].strip().upper()
+    values = rule["values"]
+
+    # Non-root
+    if match in _LOGICAL:
+        children = tuple(compile_rule(subrule, normalized) for subrule in values)
+        return _LOGICAL[match](children)
+
+    # Leaf node
+    if match in ["CONTAINS_ALL", "CONTAINS_ANY", "CONTAINS_NONE"]:
+        col = rule['column']
+        return _compile_contains(match, col, values, col in normalized)
+    elif match in ["IN", "NOTIN"]:
+        col = rule['column']
+        return _compile_member(match, col, values, col in normalized)
+    elif match in ["GT", "GTE", "LT", "LTE"]:
+        return _compile_compare(match, rule['column'], values)
+
+    return lambda row: False
+
+
+def rule_columns(rule, string=None, other=None):
+    """
+    Columns read by a rule, as two sets: the columns that the string
+    matches (IN, NOTIN, CONTAINS_*) upper-case, and the columns read
+    by the comparisons
+
+    Args:
+      rule (dict): Rule specification
+      string (set): Add the string columns to this set
+      other (set): Add the compared columns to this set
+    """
+    string = set() if string is None else string
+    other = set() if other is None else other
+
+    match = rule["match"].strip().upper()
+    if match in _LOGICAL:
+        for subrule in rule["values"]:
+            rule_columns(subrule, string, other)
+    elif match in ["CONTAINS_ALL", "CONTAINS_ANY", "CONTAINS_NONE", "IN", "NOTIN"]:
+        string.add(rule['column'])
+    elif match in ["GT", "GTE", "LT", "LTE"]:
+        other.add(rule['column'])
+    return string, other
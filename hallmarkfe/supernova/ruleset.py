@@ -0,0 +1,749 @@
+# coding: utf-8
+"""Rule set optimizer.
+
+Rule files tend to repeat the same predicates across rules (e.g.,
+`Direction IN [Incoming]`). `RuleSet` loads all the rules of a
+processor, reduces every subtree to a canonical key so that identical
+subtrees are stored once, and evaluates each distinct predicate at
+most once per record (or once per column for columnar tables). The
+results are kept in a cache per table that is shared by all the rules,
+and by all the processors, that filter the same table.
+
+The children of the logical operators are reordered using estimates
+of their cost and selectivity: AND runs the cheapest and most
+selective children first, OR the cheapest and least selective, so
+that short-circuiting kicks in early. The estimates start from static
+guesses, and the selectivities are replaced by the pass rates measured
+on a sample of the tables (see `RuleStats`), which can be saved and
+loaded by later runs. The measured costs are only reported, so that
+the order does not depend on timings; ties are broken on the rule
+name. Reordering does not change the result of a rule, but a
+child that would have been skipped may now be evaluated.
+
+The string matches upper-case the column they read. For records,
+the columns read by the rules are upper-cased once per table into a
+normalized view that all the string matches read instead.
+"""
+import json
+import time
+import itertools
+import numpy as np
+
+from .rules import compile_rule, rule_columns, _LOGICAL as _PLAIN_LOGICAL
+from .columnar import _compile_mask
+
+__all__ = ['RuleSet', 'RuleStats', 'canonical_rule', 'rule_name']
+
+_LOGICAL = {
+    'AND': 'AND',
+    'ALL': 'AND',
+    'OR': 'OR',
+    'ANY': 'OR',
+    'NAND': 'NAND',
+    'XNAND': 'XNAND',
+    'NOR': 'NOR',
+}
+
+_UNKNOWN = 2
+
+# Leaves that are cheaper to evaluate again than to look up
+_CHEAP = ['IN', 'NOTIN', 'GT', 'GTE', 'LT', 'LTE', 'FALSE']
+
+# Cache keys other than column names are tuples
+_LENGTH = ('length',)
+_OBSERVED = ('observed',)
+
+# Evaluators of a node over the records (_RAW) or over the normalized
+# view of the records (_NORMALIZED)
+_RAW = 0
+_NORMALIZED = 1
+
+# Rule sets that share the cache of a table each observe it
+_instances = itertools.count()
+
+
+def canonical_rule(rule):
+    """
+    Hashable key of a rule. Rules with the same key select the same
+    records: match strings are normalized, value lists become sets
+    and the children of logical operators are unordered.
+
+    Args:
+      rule (dict): Rule specification
+    """
+    match = rule["match"].strip().upper()
+    values = rule["values"]
+
+    if match in _LOGICAL:
+        return (_LOGICAL[match], frozenset(canonical_rule(r) for r in values))
+
+    if match in ["CONTAINS_ALL", "CONTAINS_ANY", "CONTAINS_NONE"]:
+        return (match, rule['column'], frozenset(v.strip().upper() for v in values))
+    elif match in ["IN", "NOTIN"]:
+        return (match, rule['column'], frozenset(v.upper() for v in values))
+    elif match in ["GT", "GTE", "LT", "LTE"]:
+        return (match, rule['column'], values)
+    return ('FALSE',)
+
+
+def _plain_key(key):
+    if isinstance(key, frozenset):
+        items = [_plain_key(k) for k in key]
+        return sorted(items, key=lambda k: json.dumps(k, sort_keys=True))
+    if isinstance(key, tuple):
+        return [_plain_key(k) for k in key]
+    return key
+
+
+def rule_name(rule):
+    """
+    Stable string form of the canonical key of a rule, used to keep
+    the statistics of a predicate across runs
+
+    Args:
+      rule (object): Rule specification, or its canonical key
+    """
+    key = canonical_rule(rule) if isinstance(rule, dict) else rule
+    return json.dumps(_plain_key(key), sort_keys=True)
+
+
+class RuleStats(object):
+    """
+    Pass rates and costs of predicates, keyed on rule_name. Can be
+    shared by rule sets and processors, and saved for later runs.
+    """
+    def __init__(self, stats=None):
+        """
+        Args:
+          stats (dict): Statistics from to_dict
+        """
+        self.stats = {}
+        for name, entry in (stats or {}).items():
+            self.stats[name] = list(entry)
+
+    def __len__(self):
+        return len(self.stats)
+
+    def record(self, name, rows, passed, seconds=None):
+        """
+        Add an observation of a predicate
+
+        Args:
+          name (str): rule_name of the predicate
+          rows (int): Records evaluated
+          passed (int): Records that passed
+          seconds (float): Time taken, if measured
+        """
+        entry = self.stats.get(name)
+        if entry is None:
+            entry = self.stats[name] = [0, 0, 0, 0.0]
+        entry[0] += rows
+        entry[1] += passed
+        if seconds is not None:
+            entry[2] += rows
+            entry[3] += seconds
+
+    def get(self, name):
+        """
+        (selectivity, seconds per record) of a predicate. Either is
+        None if it has not been measured.
+
+        Args:
+          name (str): rule_name of the predicate
+        """
+        entry = self.stats.get(name)
+        if entry is None or entry[0] == 0:
+            return (None, None)
+        cost = entry[3] / entry[2] if entry[2] > 0 else None
+        return (float(entry[1]) / entry[0], cost)
+
+    def merge(self, other):
+        """
+        Add the observations of another RuleStats
+
+        Args:
+          other (class): RuleStats
+        """
+        for name, entry in other.stats.items():
+            mine = self.stats.setdefault(name, [0, 0, 0, 0.0])
+            for i, value in enumerate(entry):
+                mine[i] += value
+
+    def report(self):
+        """
+        Statistics as a list of dicts, most expensive first
+        """
+        result = []
+        for name, entry in self.stats.items():
+            selectivity, cost = self.get(name)
+            result.append({
+                'rule': name,
+                'rows': entry[0],
+                'passed': entry[1],
+                'selectivity': selectivity,
+                'cost': cost
+            })
+        return sorted(result, key=lambda e: -(e['cost'] or 0))
+
+    def to_dict(self):
+        return {name: list(entry) for name, entry in self.stats.items()}
+
+    def save(self, path):
+        """
+        Write the statistics to a JSON file
+
+        Args:
+          path (str): Output file
+        """
+        with open(path, 'w') as fd:
+            json.dump({'version': 1, 'stats': self.to_dict()}, fd)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read statistics written by save
+
+        Args:
+          path (str): Input file
+        """
+        with open(path) as fd:
+            data = json.load(fd)
+        if data.get('version') != 1:
+            raise Exception("Unsupported rule statistics version: {}".format(data.get('version')))
+        return cls(data['stats'])
+
+
+class _Node(object):
+    """
+    Distinct subtree of the rule set
+    """
+    __slots__ = ('key', 'name', 'op', 'spec', 'children', 'refs', 'cost',
+                 'selectivity', 'leaf', 'plain', 'row', 'mask')
+
+    def __init__(self, key, op, spec):
+        self.key = key
+        self.name = rule_name(key)
+        self.op = op
+        self.spec = spec
+        self.children = []
+        self.refs = 0
+        self.cost = 1.0
+        self.selectivity = 0.5
+        self.leaf = None
+        self.plain = [None, None]
+        self.row = [None, None]
+        self.mask = None
+
+
+class RuleSet(object):
+    """
+    Shared, reordered evaluation of the rules of a processor
+    """
+    def __init__(self, rules=None, stats=None, warmup=4, interval=256):
+        """
+        Args:
+          rules (list): Rule specifications (the 'rule' parameter of
+               the operators)
+          stats (class): RuleStats to learn the order of the children
+               from. None keeps the static order.
+          warmup (int): Tables observed before the children are
+               reordered for the first time
+          interval (int): After the warmup, one table in interval is
+               observed and the children are reordered again
+        """
+        self.nodes = {}
+        self.roots = {}
+        self.compiled = False
+        self.stats = stats
+        self.warmup = warmup
+        self.interval = interval
+        self.tables = 0
+        self.normalized = frozenset()
+        self.columns = ()
+        self.view_key = None
+        self.observed_key = _OBSERVED + (next(_instances),)
+        for rule in rules or []:
+            self.add(rule)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def add(self, rule):
+        """
+        Add a rule specification. Returns the key of its root node.
+
+        Args:
+          rule (dict): Rule specification
+        """
+        entry = self.roots.get(id(rule))
+        if entry is not None and entry[0] is rule:
+            return entry[1]
+
+        node = self._add(rule)
+        node.refs += 1
+        # Keep a reference to the rule so that the id is not reused
+        self.roots[id(rule)] = (rule, node.key)
+        self.compiled = False
+        return node.key
+
+    def _add(self, rule):
+        key = canonical_rule(rule)
+        node = self.nodes.get(key)
+        if node is not None:
+            return node
+
+        op = key[0]
+        node = _Node(key, op, rule)
+        if op in ['AND', 'OR', 'NAND', 'XNAND', 'NOR']:
+            seen = set()
+            for subrule in rule['values']:
+                child = self._add(subrule)
+                if child.key in seen:
+                    continue
+                seen.add(child.key)
+                child.refs += 1
+                node.children.append(child)
+        self.nodes[key] = node
+        return node
+
+    def get_shared(self):
+        """
+        Nodes referenced by more than one rule or parent
+        """
+        return [node for node in self.nodes.values() if node.refs > 1]
+
+    ##############################################
+    # Cost model
+    ##############################################
+    def _estimate(self, node, done):
+        if node.key in done:
+            return
+        done.add(node.key)
+        self._estimate_static(node, done)
+
+        if self.stats is not None:
+            selectivity, _ = self.stats.get(node.name)
+            if selectivity is not None:
+                node.selectivity = selectivity
+
+    def _estimate_static(self, node, done):
+        op = node.op
+        if op in ['IN', 'NOTIN']:
+            p = min(0.9, 0.2 * len(node.key[2]))
+            node.cost = 1.0
+            node.selectivity = p if op == 'IN' else 1 - p
+        elif op in ['CONTAINS_ALL', 'CONTAINS_ANY', 'CONTAINS_NONE']:
+            k = len(node.key[2])
+            node.cost = 1.0 + k
+            node.selectivity = {
+                'CONTAINS_ALL': 0.2 ** k,
+                'CONTAINS_ANY': 1 - 0.8 ** k,
+                'CONTAINS_NONE': 0.8 ** k,
+            }[op]
+        elif op in ['GT', 'GTE', 'LT', 'LTE']:
+            node.cost = 1.0
+            node.selectivity = 0.5
+        elif op == 'FALSE':
+            node.cost = 0.0
+            node.selectivity = 0.0
+        else:
+            for child in node.children:
+                self._estimate(child, done)
+            self._order(node)
+
+            # Expected cost given the short-circuit of the operator
+            cost = 0.0
+            reach = 1.0
+            every = 1.0
+            some = 0.0
+            for child in node.children:
+                cost += reach * self._effective_cost(child)
+                if op in ['AND', 'NAND']:
+                    reach *= child.selectivity
+                elif op in ['OR', 'NOR']:
+                    reach *= 1 - child.selectivity
+                every *= child.selectivity
+                some = some + child.selectivity - some * child.selectivity
+            node.cost = cost
+            node.selectivity = {
+                'AND': every,
+                'OR': some,
+                'NAND': 1 - every,
+                'NOR': 1 - some,
+                'XNAND': max(0.0, some - every),
+            }[op]
+
+    def _effective_cost(self, node):
+        # Shared results are computed once for all the references
+        if node.refs > 1 and node.op not in _CHEAP:
+            return node.cost / node.refs
+        return node.cost
+
+    def _order(self, node):
+        if node.op in ['AND', 'NAND']:
+            rank = lambda c: self._effective_cost(c) / max(1e-6, 1 - c.selectivity)
+        elif node.op in ['OR', 'NOR']:
+            rank = lambda c: self._effective_cost(c) / max(1e-6, c.selectivity)
+        else:
+            rank = lambda c: self._effective_cost(c)
+        node.children.sort(key=lambda c: (rank(c), c.name))
+
+    ##############################################
+    # Compilation
+    ##############################################
+    def compile(self):
+        """
+        Order the children and build the evaluators of all nodes
+        """
+        if self.compiled:
+            return
+        done = set()
+        for node in self.nodes.values():
+            self._estimate(node, done)
+        self._compile_view()
+        for node in self.nodes.values():
+            node.leaf = node.mask = None
+            node.plain = [None, None]
+            node.row = [None, None]
+        for node in self.nodes.values():
+            self._compile_row(node, _RAW)
+            if len(self.normalized) > 0:
+                self._compile_row(node, _NORMALIZED)
+            self._compile_mask(node)
+        self.compiled = True
+
+    def _compile_view(self):
+        """
+        Choose the columns of the normalized view. A string column
+        is upper-cased in the view if no comparison reads it, and if
+        the rules have more string matches than such columns, i.e.,
+        some column is read by more than one match.
+        """
+        string = set()
+        other = set()
+        matches = 0
+        for node in self.nodes.values():
+            # The children of logical nodes are nodes of their own
+            if node.op in _LOGICAL:
+                continue
+            rule_columns(node.spec, string, other)
+            if node.op in ['IN', 'NOTIN', 'CONTAINS_ALL', 'CONTAINS_ANY', 'CONTAINS_NONE']:
+                matches += 1
+
+        normalized = string - other
+        if matches <= len(normalized):
+            normalized = set()
+        self.normalized = frozenset(normalized)
+        self.columns = tuple(sorted(string | other, key=str))
+        # Rule sets over the same table share the view only if they
+        # read the same columns
+        self.view_key = ('normalized', frozenset(self.columns), self.normalized)
+
+    def _compile_row(self, node, mode):
+        if node.row[mode] is not None:
+            return node.row[mode]
+
+        # Subtrees without memoized nodes are plain predicates over
+        # a record, as built by compile_rule
+        op = node.op
+        if op in ['AND', 'OR', 'NAND', 'XNAND', 'NOR']:
+            for child in node.children:
+                self._compile_row(child, mode)
+            if all(c.plain[mode] is not None for c in node.children):
+                plain = tuple(c.plain[mode] for c in node.children)
+                node.plain[mode] = _PLAIN_LOGICAL[op](plain)
+                evaluate = None
+            else:
+                evaluate = _ROW_LOGICAL[op](tuple(c.row[mode] for c in node.children))
+        elif mode == _NORMALIZED:
+            node.plain[mode] = compile_rule(node.spec, self.normalized)
+            evaluate = None
+        else:
+            node.leaf = node.plain[mode] = compile_rule(node.spec)
+            evaluate = None
+
+        if node.refs > 1 and op not in _CHEAP:
+            if evaluate is None:
+                plain = node.plain[mode]
+                evaluate = lambda cache, i, row: plain(row)
+            evaluate = _memoize_row(node.key, evaluate)
+            node.plain[mode] = None
+        elif evaluate is None:
+            plain = node.plain[mode]
+            evaluate = lambda cache, i, row: plain(row)
+        node.row[mode] = evaluate
+        return evaluate
+
+    def _compile_mask(self, node):
+        if node.mask is not None:
+            return node.mask
+
+        op = node.op
+        if op in ['AND', 'OR', 'NAND', 'XNAND', 'NOR']:
+            children = tuple(self._compile_mask(c) for c in node.children)
+            evaluate = _mask_logical(op, children)
+        else:
+            leaf = _compile_mask(node.spec)
+            evaluate = leaf
+
+        key = node.key
+        def cached(table, cache):
+            mask = cache.get(key)
+            if mask is None:
+                mask = cache[key] = evaluate(table, cache)
+            return mask
+        node.mask = cached
+        return cached
+
+    ##############################################
+    # Evaluation
+    ##############################################
+    def _root(self, rule):
+        key = self.add(rule)
+        self.compile()
+        return self.nodes[key]
+
+    def filter(self, rule, rows, cache):
+        """
+        Records that pass a rule
+
+        Args:
+          rule (dict): Rule specification
+          rows (list): Records
+          cache (dict): Results shared by the rules over the same
+               records. Start with an empty dict for a new table.
+        """
+        if self.stats is not None and self.observed_key not in cache:
+            self._observe_table(rows, None, cache)
+
+        root = self._root(rule)
+        view = self.normalized_view(rows, cache)
+        if view is None:
+            if root.plain[_RAW] is not None:
+                predicate = root.plain[_RAW]
+                return [r for r in rows if predicate(r)]
+            evaluate = root.row[_RAW]
+            cache.setdefault(_LENGTH, len(rows))
+            return [r for i, r in enumerate(rows) if evaluate(cache, i, r)]
+
+        if root.plain[_NORMALIZED] is not None:
+            predicate = root.plain[_NORMALIZED]
+            return [r for r, v in zip(rows, view) if predicate(v)]
+        evaluate = root.row[_NORMALIZED]
+        cache.setdefault(_LENGTH, len(rows))
+        return [r for i, (r, v) in enumerate(zip(rows, view)) if evaluate(cache, i, v)]
+
+    def normalized_view(self, rows, cache):
+        """
+        The records reduced to the columns read by the rules, with
+        the string columns upper-cased. Built once per table and kept
+        in the cache. None if no column is read by several string
+        matches, or if a value cannot be upper-cased, in which case
+        the rules read the records and fail (or not) as they would
+        without the view.
+
+        Args:
+          rows (list): Records
+          cache (dict): Cache of the table (see filter)
+        """
+        self.compile()
+        if len(self.normalized) == 0:
+            return None
+        key = self.view_key
+        if key in cache:
+            return cache[key]
+
+        normalized = self.normalized
+        columns = self.columns
+        try:
+            view = [{c: (r[c].upper() if c in normalized else r[c]) for c in columns}
+                    for r in rows]
+        except Exception:
+            view = None
+        cache[key] = view
+        return view
+
+    def mask(self, rule, table, cache):
+        """
+        Boolean mask of the records of a ColumnarTable that pass a
+        rule
+
+        Args:
+          rule (dict): Rule specification
+          table (class): ColumnarTable
+          cache (dict): Results shared by the rules over the same
+               table. Start with an empty dict for a new table.
+        """
+        if self.stats is not None and self.observed_key not in cache:
+            self._observe_table(None, table, cache)
+        return self._root(rule).mask(table, cache)
+
+    ##############################################
+    # Statistics
+    ##############################################
+    def _observe_table(self, rows, table, cache):
+        cache[self.observed_key] = True
+        self.tables += 1
+        if self.tables > self.warmup and self.tables % self.interval != 0:
+            return
+        self.observe(rows=rows, table=table, cache=cache)
+        if self.tables >= self.warmup:
+            # Reorder with what has been learned so far
+            self.compiled = False
+
+    def observe(self, rows=None, table=None, cache=None):
+        """
+        Measure the pass rate of every node, and the cost of every
+        leaf (for RuleStats.report), on the records of a table. Every
+        predicate is evaluated on every record.
+
+        Args:
+          rows (list): Records
+          table (class): ColumnarTable, instead of records
+          cache (dict): Cache of the table (see mask)
+        """
+        self.compile()
+        if cache is None:
+            cache = {}
+        clock = time.perf_counter
+
+        vectors = {}
+        for node in self.nodes.values():
+            if len(node.children) == 0:
+                start = clock()
+                try:
+                    if table is not None:
+                        vector = node.mask(table, cache)
+                    else:
+                        leaf = node.leaf
+                        vector = np.fromiter((bool(leaf(r)) for r in rows),
+                                             dtype=bool, count=len(rows))
+                except Exception:
+                    continue
+                seconds = clock() - start
+            else:
+                children = [vectors.get(c.key) for c in node.children]
+                if any(v is None for v in children):
+                    continue
+                vector = _combine(node.op, children, len(rows) if table is None else len(table))
+                seconds = None
+            vectors[node.key] = vector
+            self.stats.record(node.name, len(vector), int(vector.sum()), seconds)
+
+
+def _memoize_row(key, evaluate):
+    """
+    Remember the result of a shared node per record (by position)
+    """
+    memo_key = ('row', key)
+
+    def memoized(cache, i, row):
+        memo = cache.get(memo_key)
+        if memo is None:
+            memo = cache[memo_key] = bytearray([_UNKNOWN]) * cache[_LENGTH]
+        value = memo[i]
+        if value == _UNKNOWN:
+            value = memo[i] = 1 if evaluate(cache, i, row) else 0
+        return value == 1
+    return memoized
+
+
+def _row_and(children):
+    def evaluate(cache, i, row):
+        for child in children:
+            if not child(cache, i, row):
+                return False
+        return True
+    return evaluate
+
+
+def _row_or(children):
+    def evaluate(cache, i, row):
+        for child in children:
+            if child(cache, i, row):
+                return True
+        return False
+    return evaluate
+
+
+def _row_nand(children):
+    def evaluate(cache, i, row):
+        for child in children:
+            if not child(cache, i, row):
+                return True
+        return False
+    return evaluate
+
+
+def _row_xnand(children):
+    def evaluate(cache, i, row):
+        seen_true = seen_false = False
+        for child in children:
+            if child(cache, i, row):
+                seen_true = True
+            else:
+                seen_false = True
+            if seen_true and seen_false:
+                return True
+        return False
+    return evaluate
+
+
+def _row_nor(children):
+    def evaluate(cache, i, row):
+        for child in children:
+            if child(cache, i, row):
+                return False
+        return True
+    return evaluate
+
+
+_ROW_LOGICAL = {
+    'AND': _row_and,
+    'OR': _row_or,
+    'NAND': _row_nand,
+    'XNAND': _row_xnand,
+    'NOR': _row_nor,
+}
+
+
+def _mask_logical(op, children):
+    def combine(table, cache):
+        n = len(table)
+        every = np.ones(n, dtype=bool)
+        some = np.zeros(n, dtype=bool)
+        for child in children:
+            mask = child(table, cache)
+            every &= mask
+            some |= mask
+            # Stop once the remaining children cannot change the result
+            if op in ['AND', 'NAND'] and not every.any():
+                break
+            if op in ['OR', 'NOR'] and some.all():
+                break
+
+        if op == 'AND':
+            return every
+        elif op == 'OR':
+            return some
+        elif op == 'NAND':
+            return ~every
+        elif op == 'XNAND':
+            return ~every & some
+        return ~some
+    return combine
+
+
+def _combine(op, masks, n):
+    every = np.ones(n, dtype=bool)
+    some = np.zeros(n, dtype=bool)
+    for mask in masks:
+        every &= mask
+        some |= mask
+    return {
+        'AND': every,
+        'OR': some,
+        'NAND': ~every,
+        'XNAND': ~every & some,
+        'NOR': ~some,
+    }[op]
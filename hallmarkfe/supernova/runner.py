@@ -0,0 +1,198 @@
+# coding: utf-8
+"""Local multi-process runner.
+
+Runs an `HFEManager` over many entities using a pool of worker
+processes, for machines where Spark is overkill. Each worker builds
+the manager (and its processors) once, using a factory function and
+arguments that are shipped to the worker when it starts, and then
+processes chunks of entities.
+
+    def build(rules):
+        mgr = HFEManager({'sequence': ['complex1']})
+        proc = MyProcessor(conf={...})
+        proc.rules = rules
+        mgr.add_processor('complex1', proc)
+        return mgr
+
+    rules = json.load(open('complex1.json'))['rules']
+    with HFELocalRunner(build, args=(rules,), processes=8) as runner:
+        df = runner.run_frame(calls, ['In'], name='calls')
+
+The factory has to be importable by the workers (i.e., defined at the
+module level) and the arguments have to be picklable.
+"""
+import math
+import multiprocessing
+
+__all__ = ['HFELocalRunner', 'process_group']
+
+# Manager of the worker process, built once by the pool initializer
+_worker_manager = None
+
+
+def process_group(manager, key, rows, name):
+    """
+    Process the records of one entity
+
+    Args:
+      manager (class): HFEManager
+      key (object): Entity key
+      rows (list): Records, an iterator over them (read lazily) or
+            a DataFrame with the records
+      name (str): Dataset name used by the processors
+
+    Returns a tuple of the key and the features
+    """
+    from . import HFEAtomicState
+
+    if hasattr(rows, 'to_dict'):
+        rows = rows.to_dict('records')
+
+    state = HFEAtomicState()
+    state.set_data(name, rows)
+    manager.process(state)
+    return (key, state.get_all_features())
+
+
+def _initialize(factory, args):
+    global _worker_manager
+    _worker_manager = factory(*args)
+
+
+def _process_task(task):
+    key, rows, name = task
+    return process_group(_worker_manager, key, rows, name)
+
+
+class HFELocalRunner(object):
+    """
+    Entity-sharded runner on top of multiprocessing.
+    """
+    def __init__(self, factory, args=(), processes=None, chunksize=None):
+        """
+        Args:
+          factory (callable): Builds the HFEManager. Called once per worker.
+          args (tuple): Arguments of the factory, e.g., the rules
+          processes (int): Number of workers. Defaults to the number of
+                CPUs. With 1, everything runs in the current process.
+          chunksize (int): Entities sent to a worker at a time. By
+                default derived from the number of entities, if known.
+        """
+        self.factory = factory
+        self.args = tuple(args)
+        self.processes = processes or multiprocessing.cpu_count()
+        self.chunksize = chunksize
+        self.pool = None
+        self.manager = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_chunksize(self, total=None):
+        """
+        Entities per task. Aims for about four chunks per worker so
+        that the load stays balanced without paying the IPC cost per
+        entity.
+
+        Args:
+          total (int): Number of entities, if known
+        """
+        if self.chunksize is not None:
+            return self.chunksize
+        if total is None:
+            return 16
+        return max(1, int(math.ceil(total / (self.processes * 4.0))))
+
+    def get_pool(self):
+        """
+        Worker pool. Created on first use and reused across runs.
+        """
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.processes,
+                                             initializer=_initialize,
+                                             initargs=(self.factory, self.args))
+        return self.pool
+
+    def run(self, groups, name, total=None):
+        """
+        Process entities. The results are streamed back in the order
+        of the input and match running the manager on each group in a
+        loop.
+
+        Args:
+          groups (iterable): (key, rows) tuples, one per entity
+          name (str): Dataset name used by the processors
+          total (int): Number of entities, if groups has no len()
+
+        Yields (key, features) tuples
+        """
+        if total is None and hasattr(groups, '__len__'):
+            total = len(groups)
+
+        tasks = ((key, rows, name) for key, rows in groups)
+
+        if self.processes == 1:
+            if self.manager is None:
+                self.manager = self.factory(*self.args)
+            for key, rows, name in tasks:
+                yield process_group(self.manager, key, rows, name)
+            return
+
+        pool = self.get_pool()
+        chunksize = self.get_chunksize(total)
+        for result in pool.imap(_process_task, tasks, chunksize):
+            yield result
+
+    def run_frame(self, df, key_columns, name, sink=None):
+        """
+        Process all entities of a DataFrame
+
+        Args:
+          df (DataFrame): Records of all entities
+          key_columns (list): Columns that identify an entity
+          name (str): Dataset name used by the processors
+          sink (class): Optional FeatureMatrixBuilder to collect the
+                features into
+
+        Returns a DataFrame with one row per entity, indexed by the
+        key columns, and one column per feature.
+        """
+        import pandas as pd
+
+        if isinstance(key_columns, str):
+            key_columns = [key_columns]
+
+        grouped = df.groupby(key_columns)
+        groups = ((key[0] if len(key_columns) == 1 else key, rows)
+                  for key, rows in grouped)
+
+        if sink is not None:
+            if sink.key_columns is None:
+                sink.key_columns = key_columns
+            for key, values in self.run(groups, name, total=grouped.ngroups):
+                sink.append(values, key)
+            return sink.to_frame()
+
+        keys = []
+        features = []
+        for key, values in self.run(groups, name, total=grouped.ngroups):
+            keys.append(key)
+            features.append(values)
+
+        if len(key_columns) == 1:
+            index = pd.Index(keys, name=key_columns[0])
+        else:
+            index = pd.MultiIndex.from_tuples(keys, names=key_columns)
+        return pd.DataFrame(features, index=index)
+
+    def close(self):
+        """
+        Stop the workers
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
@@ -0,0 +1,281 @@
+# coding: utf-8
+"""Mergeable partial aggregates.
+
+Partial aggregates keep just enough information to update a built-in
+metric (see `MetricHandlerMixin.toolz_aggregate`) with new records,
+and to combine the partial results of different shards. Unique
+counts use a HyperLogLog sketch so that memory stays bounded.
+"""
+import abc
+import copy
+import math
+import numbers
+import hashlib
+
+__all__ = ['PartialAggregate', 'SumAggregate', 'MinAggregate',
+           'MaxAggregate', 'AvgAggregate', 'SizeAggregate',
+           'UniqueAggregate', 'HyperLogLog', 'make_partial', 'merge_states']
+
+
+class PartialAggregate(abc.ABC):
+    """
+    Base class for the partial aggregates
+    """
+    @abc.abstractmethod
+    def update(self, values):
+        """
+        Fold in new values
+
+        Args:
+          values (list): Column values of the new records
+        """
+
+    @abc.abstractmethod
+    def merge(self, other):
+        """
+        Fold in the partial aggregate of another shard
+
+        Args:
+          other (class): Partial aggregate of the same type
+        """
+
+    @abc.abstractmethod
+    def value(self):
+        """
+        Current value of the aggregate
+        """
+
+
+class SumAggregate(PartialAggregate):
+
+    def __init__(self, dtype=None):
+        self.dtype = dtype
+        self.total = 0
+
+    def update(self, values):
+        if self.dtype is not None:
+            values = [self.dtype(v) for v in values]
+        self.total = sum(values, self.total)
+
+    def merge(self, other):
+        self.total += other.total
+
+    def value(self):
+        return self.total
+
+
+class MinAggregate(PartialAggregate):
+
+    def __init__(self):
+        self.current = None
+
+    def update(self, values):
+        if len(values) == 0:
+            return
+        low = min(values)
+        if self.current is None or low < self.current:
+            self.current = low
+
+    def merge(self, other):
+        if other.current is not None:
+            self.update([other.current])
+
+    def value(self):
+        return self.current
+
+
+class MaxAggregate(PartialAggregate):
+
+    def __init__(self):
+        self.current = None
+
+    def update(self, values):
+        if len(values) == 0:
+            return
+        high = max(values)
+        if self.current is None or high > self.current:
+            self.current = high
+
+    def merge(self, other):
+        if other.current is not None:
+            self.update([other.current])
+
+    def value(self):
+        return self.current
+
+
+class AvgAggregate(PartialAggregate):
+
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+
+    def update(self, values):
+        self.total = sum(values, self.total)
+        self.count += len(values)
+
+    def merge(self, other):
+        self.total += other.total
+        self.count += other.count
+
+    def value(self):
+        return self.total/self.count if self.count > 0 else None
+
+
+class SizeAggregate(PartialAggregate):
+
+    def __init__(self):
+        self.count = 0
+
+    def update(self, values):
+        self.count += len(values)
+
+    def merge(self, other):
+        self.count += other.count
+
+    def value(self):
+        return self.count
+
+
+class UniqueAggregate(PartialAggregate):
+    """
+    Exact count of unique values. Memory grows with the number of
+    unique values.
+    """
+    def __init__(self):
+        self.values = set()
+
+    def update(self, values):
+        self.values.update(values)
+
+    def merge(self, other):
+        self.values |= other.values
+
+    def value(self):
+        return len(self.values)
+
+
+class HyperLogLog(PartialAggregate):
+    """
+    Approximate count of unique values.
+
+    The standard error is about 1.04/sqrt(2**precision), i.e., 1.6%
+    with the default precision of 12 (4KB of registers). Values are
+    hashed with a stable hash, so sketches built in different
+    processes can be merged.
+    """
+    def __init__(self, precision=12):
+        if not 4 <= precision <= 16:
+            raise Exception("Invalid precision. Should be between 4 and 16")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    @staticmethod
+    def normalize(value):
+        """
+        Canonical form of a value, so that values that compare equal
+        (1, 1.0, True, numpy.int64(1)) hash the same, as they count
+        once in an exact unique count
+        """
+        if hasattr(value, 'item') and hasattr(value, 'dtype'):
+            # numpy scalars
+            value = value.item()
+        if isinstance(value, numbers.Integral):
+            return int(value)
+        if isinstance(value, numbers.Real):
+            value = float(value)
+            if value.is_integer():
+                return int(value)
+        return value
+
+    @classmethod
+    def hash(cls, value):
+        value = cls.normalize(value)
+        if isinstance(value, str):
+            data = value.encode('utf-8')
+        else:
+            data = repr(value).encode('utf-8')
+        digest = hashlib.blake2b(data, digest_size=8).digest()
+        return int.from_bytes(digest, 'big')
+
+    def update(self, values):
+        p = self.precision
+        width = 64 - p
+        registers = self.registers
+        for v in values:
+            h = self.hash(v)
+            index = h >> width
+            rest = h & ((1 << width) - 1)
+            rank = width - rest.bit_length() + 1
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise Exception("Cannot merge sketches with different precision")
+        self.registers = bytearray(max(a, b) for a, b in
+                                   zip(self.registers, other.registers))
+
+    def value(self):
+        m = len(self.registers)
+        if m == 16:
+            alpha = 0.673
+        elif m == 32:
+            alpha = 0.697
+        elif m == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213/(1 + 1.079/m)
+
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros > 0:
+            # Small range correction (linear counting)
+            estimate = m * math.log(float(m)/zeros)
+        return int(round(estimate))
+
+
+def make_partial(function, dtype=None, exact=False):
+    """
+    Partial aggregate for a built-in metric
+
+    Args:
+      function (str): sum, min, max, avg, size or count (unique values)
+      dtype (callable): Type conversion for sum
+      exact (bool): Count unique values exactly instead of using a
+            HyperLogLog sketch
+    """
+    if function == 'sum':
+        return SumAggregate(dtype)
+    elif function == 'min':
+        return MinAggregate()
+    elif function == 'max':
+        return MaxAggregate()
+    elif function == 'avg':
+        return AvgAggregate()
+    elif function == 'size':
+        return SizeAggregate()
+    elif function == 'count' and exact:
+        return UniqueAggregate()
+    elif function == 'count':
+        return HyperLogLog()
+    raise Exception("Unknown aggregate: {}".format(function))
+
+
+def merge_states(state, other):
+    """
+    Merge the partial aggregates of another state (e.g., the same
+    entity processed on another shard) into a state, and refresh the
+    features that they back.
+
+    Args:
+      state (class): Feature state that is updated
+      other (class): Feature state with the partials to fold in
+    """
+    partials = state.get_partials()
+    for feature, partial in other.get_partials().items():
+        if feature in partials:
+            partials[feature].merge(partial)
+        else:
+            partials[feature] = copy.deepcopy(partial)
+        state.set_feature(feature, partials[feature].value())
@@ -0,0 +1,184 @@
+# coding: utf-8
+"""PySpark integration.
+
+Runs an `HFEManager` over a Spark DataFrame. The manager is built at
+most once per executor Python process from a module-level factory and
+broadcast arguments (e.g., the rule specifications), instead of a
+module-global manager shipped with the task code.
+
+    def build(rules):
+        mgr = HFEManager({'sequence': ['complex1']})
+        proc = MyProcessor(conf={...})
+        proc.rules = rules
+        mgr.add_processor('complex1', proc)
+        return mgr
+
+    runner = HFESparkRunner(spark, build, args=(rules,))
+    schema = features_schema(['In'], ['marketing__1__calls__xx__total'])
+    features = runner.run(df, ['In'], 'calls', schema)
+
+Two execution paths are available. `run` sorts the records of each
+partition by entity and processes the groups inside mapPartitions,
+so no list of rows is built per group by a shuffle. `run_pandas`
+uses grouped pandas UDFs (applyInPandas), which move the data
+through Arrow and process each group with `HFEManager.process_batch`.
+Both return a DataFrame with the given schema.
+
+The module can be imported without pyspark; using it then raises an
+exception.
+"""
+import itertools
+
+try:
+    from pyspark.sql import types as T
+except ImportError:
+    T = None
+
+__all__ = ['HFESparkRunner', 'features_schema', 'get_manager']
+
+# Managers of this (executor) process, keyed by the broadcast
+_managers = {}
+
+
+def get_manager(factory, broadcast):
+    """
+    Manager for this process, built on first use
+
+    Args:
+      factory (callable): Builds the HFEManager from the broadcast arguments
+      broadcast (object): Broadcast variable with the factory arguments
+    """
+    entry = _managers.get(id(broadcast))
+    if entry is None or entry[0] is not broadcast:
+        # Keep a reference to the broadcast so that the id is not reused
+        entry = (broadcast, factory(*broadcast.value))
+        _managers[id(broadcast)] = entry
+    return entry[1]
+
+
+def _require_pyspark():
+    if T is None:
+        raise Exception("pyspark is required for the Spark integration")
+
+
+def features_schema(key_columns, features, key_type=None, feature_type=None):
+    """
+    Schema of the feature DataFrame
+
+    Args:
+      key_columns (list): Columns that identify an entity
+      features (list): Feature names
+      key_type (DataType): Type of the key columns (default: string)
+      feature_type (DataType): Type of the features (default: double)
+    """
+    _require_pyspark()
+    key_type = key_type or T.StringType()
+    feature_type = feature_type or T.DoubleType()
+    fields = [T.StructField(k, key_type, False) for k in key_columns]
+    fields += [T.StructField(f, feature_type, True) for f in features]
+    return T.StructType(fields)
+
+
+def _converter(datatype):
+    """
+    Cast a feature value to the Python type Spark expects for a field
+    """
+    if isinstance(datatype, (T.DoubleType, T.FloatType)):
+        cast = float
+    elif isinstance(datatype, (T.LongType, T.IntegerType, T.ShortType, T.ByteType)):
+        cast = int
+    elif isinstance(datatype, T.StringType):
+        cast = str
+    elif isinstance(datatype, T.BooleanType):
+        cast = bool
+    else:
+        return lambda value: value
+    return lambda value: None if value is None else cast(value)
+
+
+class HFESparkRunner(object):
+    """
+    Compute features for all entities of a Spark DataFrame
+    """
+    def __init__(self, spark, factory, args=()):
+        """
+        Args:
+          spark (SparkSession): Session
+          factory (callable): Builds the HFEManager. Has to be importable
+                 on the executors.
+          args (tuple): Arguments of the factory. Broadcast once.
+        """
+        _require_pyspark()
+        self.spark = spark
+        self.factory = factory
+        self.broadcast = spark.sparkContext.broadcast(tuple(args))
+
+    def run(self, df, key_columns, name, schema):
+        """
+        Process entity groups inside mapPartitions
+
+        Args:
+          df (DataFrame): Records of all entities
+          key_columns (list): Columns that identify an entity
+          name (str): Dataset name used by the processors
+          schema (StructType): Key columns followed by the features
+
+        Returns a DataFrame with one row per entity
+        """
+        if isinstance(key_columns, str):
+            key_columns = [key_columns]
+
+        # Only plain values go into the closure
+        factory = self.factory
+        broadcast = self.broadcast
+        keys = list(key_columns)
+        fields = schema.fields[len(keys):]
+        features = [f.name for f in fields]
+        converters = [_converter(f.dataType) for f in fields]
+
+        def process_partition(rows):
+            from hallmarkfe.supernova import HFEAtomicState
+
+            manager = get_manager(factory, broadcast)
+            entity = lambda row: tuple(row[k] for k in keys)
+            for key, group in itertools.groupby(rows, key=entity):
+                state = HFEAtomicState()
+                state.set_data(name, (row.asDict() for row in group))
+                manager.process(state)
+
+                values = state.state['features']
+                yield key + tuple(convert(values.get(f))
+                                  for f, convert in zip(features, converters))
+
+        # All records of an entity end up next to each other in a
+        # single partition
+        rdd = df.repartition(*keys).sortWithinPartitions(*keys).rdd
+        return self.spark.createDataFrame(rdd.mapPartitions(process_partition),
+                                          schema)
+
+    def run_pandas(self, df, key_columns, name, schema):
+        """
+        Process entity groups with a grouped pandas UDF (Arrow)
+
+        Args:
+          df (DataFrame): Records of all entities
+          key_columns (list): Columns that identify an entity
+          name (str): Dataset name used by the processors
+          schema (StructType): Key columns followed by the features
+
+        Returns a DataFrame with one row per entity
+        """
+        if isinstance(key_columns, str):
+            key_columns = [key_columns]
+
+        factory = self.factory
+        broadcast = self.broadcast
+        keys = list(key_columns)
+        columns = [f.name for f in schema.fields]
+
+        def process_group(pdf):
+            manager = get_manager(factory, broadcast)
+            features = manager.process_batch(pdf, keys, name).reset_index()
+            return features.reindex(columns=columns)
+
+        return df.groupBy(*keys).applyInPandas(process_group, schema)
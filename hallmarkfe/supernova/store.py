@@ -0,0 +1,373 @@
+# coding: utf-8
+"""Persistent state store.
+
+`HFEStateStore` snapshots the states of many entities into a single
+binary columnar file on local disk, and reopens it memory-mapped so
+that the features of one entity can be loaded without reading the
+rest of the file.
+
+    HFEStateStore.write('calls.hfe', states)   # (key, state) tuples
+
+    with HFEStateStore('calls.hfe') as store:
+        state = store.load_state('9876543210')
+        mgr.update(state, 'calls', new_rows)
+
+Layout: an 8-byte magic, the length of the JSON header, the header
+(entity keys and column descriptions) and the column blocks, each
+aligned to 8 bytes. Numeric and boolean features are stored as typed
+arrays with a validity mask; other features, and the partial
+aggregates of incrementally maintained states, as pickled values with
+an offsets array. Feature columns that a typed array cannot hold
+exactly (None values, integers beyond int64, integers mixed with
+floats) are pickled, with a validity mask that tells a feature set
+to None from a missing one.
+"""
+import os
+import json
+import mmap
+import struct
+import pickle
+import collections
+import numpy as np
+
+__all__ = ['HFEStateStore']
+
+MAGIC = b'HFESTORE'
+VERSION = 1
+ALIGN = 8
+
+
+def _encode_key(key):
+    if isinstance(key, tuple):
+        return [_encode_key(k) for k in key]
+    if isinstance(key, np.generic):
+        return key.item()
+    return key
+
+
+def _decode_key(key):
+    if isinstance(key, list):
+        return tuple(_decode_key(k) for k in key)
+    return key
+
+
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+
+def _infer_dtype(values):
+    """
+    Storage type of a feature column: bool, int64, float64 or
+    object (pickled) if the values do not all fit one of the
+    others unchanged
+
+    Args:
+      values (list): Values of the entities that have the feature
+    """
+    kinds = set()
+    for v in values:
+        if isinstance(v, (bool, np.bool_)):
+            kinds.add('bool')
+        elif isinstance(v, (int, np.integer)):
+            if not _INT64_MIN <= int(v) <= _INT64_MAX:
+                return 'object'
+            kinds.add('int64')
+        elif isinstance(v, (float, np.floating)):
+            kinds.add('float64')
+        else:
+            return 'object'
+
+    if len(kinds) == 0:
+        return 'float64'
+    if len(kinds) == 1:
+        return kinds.pop()
+    return 'object'
+
+
+class HFEStateStore(object):
+    """
+    Memory-mapped snapshot of entity states.
+    """
+    def __init__(self, path):
+        """
+        Args:
+          path (str): Snapshot written by HFEStateStore.write
+        """
+        self.path = path
+        self.handle = None
+        self.buffer = None
+        self.header = None
+        self.base = None
+        self.index = None
+        self.columns = None
+        self.partials = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @staticmethod
+    def _object_block(values):
+        offsets = np.zeros(len(values) + 1, dtype='int64')
+        blobs = []
+        for i, v in enumerate(values):
+            blob = pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL)
+            blobs.append(blob)
+            offsets[i+1] = offsets[i] + len(blob)
+        return offsets, b''.join(blobs)
+
+    @classmethod
+    def write(cls, path, states, partials=True):
+        """
+        Snapshot entity states. The file is replaced atomically.
+
+        Args:
+          path (str): Output file
+          states (iterable): (key, state) tuples. Keys are strings,
+               numbers or tuples of these.
+          partials (bool): Also store the partial aggregates of the
+               states (see HFEManager.update)
+
+        Returns the number of entities written
+        """
+        keys = []
+        features = []
+        extras = []
+        names = collections.OrderedDict()
+        for key, state in states:
+            values = state.get_all_features()
+            for name in values:
+                names[name] = True
+            keys.append(_encode_key(key))
+            features.append(values)
+            if partials and hasattr(state, 'get_partials'):
+                extras.append(state.get_partials() or None)
+            else:
+                extras.append(None)
+
+        n = len(keys)
+        blocks = []
+        position = [0]
+
+        def add(data):
+            offset = position[0]
+            blocks.append(data)
+            position[0] += len(data)
+            padding = -len(data) % ALIGN
+            if padding:
+                blocks.append(b'\0' * padding)
+                position[0] += padding
+            return offset
+
+        columns = []
+        for name in names:
+            valid = np.array([name in f for f in features], dtype=bool)
+            values = [f.get(name) for f in features]
+            dtype = _infer_dtype([v for v, present in zip(values, valid) if present])
+            column = {'name': name, 'dtype': dtype}
+            if dtype == 'object':
+                offsets, blob = cls._object_block(values)
+                column['offsets'] = add(offsets.tobytes())
+                column['data'] = add(blob)
+            else:
+                array = np.zeros(n, dtype=dtype)
+                for i, v in enumerate(values):
+                    if valid[i]:
+                        array[i] = v
+                column['data'] = add(array.tobytes())
+            column['valid'] = add(valid.tobytes())
+            columns.append(column)
+
+        header = {
+            'version': VERSION,
+            'length': n,
+            'keys': keys,
+            'columns': columns,
+            'partials': None
+        }
+        if any(e is not None for e in extras):
+            offsets, blob = cls._object_block(extras)
+            header['partials'] = {
+                'offsets': add(offsets.tobytes()),
+                'data': add(blob)
+            }
+
+        header = json.dumps(header).encode('utf-8')
+        header += b' ' * (-(len(MAGIC) + 8 + len(header)) % ALIGN)
+
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as fd:
+            fd.write(MAGIC)
+            fd.write(struct.pack('<Q', len(header)))
+            fd.write(header)
+            for data in blocks:
+                fd.write(data)
+        os.replace(tmp, path)
+
+        return n
+
+    def open(self):
+        """
+        Map the snapshot and read its header
+        """
+        if self.buffer is not None:
+            return
+
+        handle = open(self.path, 'rb')
+        try:
+            magic = handle.read(len(MAGIC))
+            if magic != MAGIC:
+                raise Exception("Not a state store: {}".format(self.path))
+            size = struct.unpack('<Q', handle.read(8))[0]
+            header = json.loads(handle.read(size).decode('utf-8'))
+            if header['version'] != VERSION:
+                raise Exception("Unsupported state store version: {}".format(header['version']))
+            buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            handle.close()
+            raise
+
+        self.handle = handle
+        self.buffer = buffer
+        self.header = header
+        self.base = len(MAGIC) + 8 + size
+        self.index = {_decode_key(k): i for i, k in enumerate(header['keys'])}
+        self.columns = header['columns']
+        self.partials = header['partials']
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.close()
+            self.handle.close()
+            self.buffer = None
+            self.handle = None
+
+    def __len__(self):
+        self.open()
+        return self.header['length']
+
+    def __contains__(self, key):
+        self.open()
+        return key in self.index
+
+    def keys(self):
+        self.open()
+        return list(self.index)
+
+    def get_feature_list(self):
+        """
+        Names of the features in the snapshot
+        """
+        self.open()
+        return [column['name'] for column in self.columns]
+
+    def _array(self, offset, dtype, count):
+        return np.frombuffer(self.buffer, dtype=dtype, count=count,
+                             offset=self.base + offset)
+
+    def _object(self, block, row):
+        offsets = self._array(block['offsets'], 'int64', self.header['length'] + 1)
+        start = self.base + block['data'] + int(offsets[row])
+        stop = self.base + block['data'] + int(offsets[row+1])
+        return pickle.loads(self.buffer[start:stop])
+
+    def _row(self, key):
+        self.open()
+        if key not in self.index:
+            raise KeyError(key)
+        return self.index[key]
+
+    def get_features(self, key):
+        """
+        Features of one entity, read from the mapped file
+
+        Args:
+          key (object): Entity key
+        """
+        row = self._row(key)
+        n = self.header['length']
+        features = collections.OrderedDict()
+        for column in self.columns:
+            dtype = column['dtype']
+            if dtype == 'object':
+                if 'valid' in column:
+                    if not self._array(column['valid'], 'bool', n)[row]:
+                        continue
+                    value = self._object(column, row)
+                else:
+                    # Written without the mask: None is missing
+                    value = self._object(column, row)
+                    if value is None:
+                        continue
+            else:
+                if not self._array(column['valid'], 'bool', n)[row]:
+                    continue
+                value = self._array(column['data'], dtype, n)[row].item()
+            features[column['name']] = value
+        return features
+
+    def get_partials(self, key):
+        """
+        Partial aggregates of one entity, if they were stored
+
+        Args:
+          key (object): Entity key
+        """
+        row = self._row(key)
+        if self.partials is None:
+            return {}
+        return self._object(self.partials, row) or {}
+
+    def load_state(self, key, state=None):
+        """
+        State of one entity with its features and partial aggregates
+
+        Args:
+          key (object): Entity key
+          state (class): State to load into. Defaults to a new
+               HFEAtomicState.
+        """
+        if state is None:
+            from . import HFEAtomicState
+            state = HFEAtomicState()
+        for name, value in self.get_features(key).items():
+            state.set_feature(name, value)
+        partials = self.get_partials(key)
+        if len(partials) > 0:
+            state.get_partials().update(partials)
+        return state
+
+    def to_frame(self):
+        """
+        All features as a DataFrame indexed by the entity keys
+        """
+        import pandas as pd
+
+        self.open()
+        n = self.header['length']
+        data = collections.OrderedDict()
+        for column in self.columns:
+            dtype = column['dtype']
+            if dtype == 'object':
+                data[column['name']] = [self._object(column, i) for i in range(n)]
+                continue
+            values = self._array(column['data'], dtype, n)
+            valid = self._array(column['valid'], 'bool', n)
+            if valid.all():
+                data[column['name']] = values.copy()
+            elif dtype == 'float64':
+                data[column['name']] = np.where(valid, values, np.nan)
+            elif dtype == 'bool':
+                data[column['name']] = pd.arrays.BooleanArray(values.copy(), ~valid)
+            else:
+                data[column['name']] = pd.arrays.IntegerArray(values.copy(), ~valid)
+
+        keys = list(self.index)
+        if len(keys) > 0 and isinstance(keys[0], tuple):
+            index = pd.MultiIndex.from_tuples(keys)
+        else:
+            index = pd.Index(keys)
+        return pd.DataFrame(data, index=index)
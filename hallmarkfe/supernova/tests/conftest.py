@@ -0,0 +1,84 @@
+import pytest
+import pandas as pd
+import  hallmarkfe.supernova  as hallmarkfe
+
+from .test_rules import rules, logical
+
+def make_calls():
+    return pd.DataFrame({
+        'In': ['a', 'a', 'b', 'b', 'b', 'c'],
+        'Direction': ['Incoming', 'Outgoing', 'incoming', 'Missed', 'Incoming', 'Straße'],
+        'DOW': ['Sat', 'Sun', 'Mon', 'Sat', 'Sun', 'Mon'],
+        'Duration': [161, 45, 60, 0, 75, 12],
+        'Tags': ['news, Sports', 'sports', '', 'NEWS weather', 'weather', 'x'],
+    })
+
+class RuleProcessor(hallmarkfe.HFERuleBasedProcessor,
+                    hallmarkfe.MetricHandlerMixin):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metric_handlers = {
+            'total': lambda args, rows: self.toolz_sum(args['match'], rows),
+            'avg': lambda args, rows: self.toolz_avg(args['match'], rows),
+            'dates': lambda args, rows: self.toolz_count('DOW', rows),
+        }
+        self.rules = [
+            {
+                'name': 'rule{}'.format(i),
+                'operators': [{
+                    'handler': 'handler_table_apply_rule',
+                    'level': 1,
+                    'params': {
+                        'table': 'calls',
+                        'match': 'Duration',
+                        'rule': rule,
+                        'metrics': [
+                            {'name': 'total', 'handler': 'total'},
+                            {'name': 'avg', 'handler': 'avg'},
+                            {'name': 'dates', 'handler': 'dates'},
+                        ]
+                    }
+                }]
+            }
+            for i, rule in enumerate(rules + logical)
+        ]
+
+class FusedProcessor(RuleProcessor):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metric_handlers = {
+            'total': self.aggregate_metric('sum'),
+            'avg': self.aggregate_metric('avg'),
+            'dates': self.aggregate_metric('count', 'DOW'),
+        }
+
+def make_processor(cls=RuleProcessor, name='rules'):
+    return cls(conf={
+        'name': name,
+        'owner': 'Scribble',
+        'manager': 'Manager'
+    })
+
+def make_manager(cls=RuleProcessor):
+    mgr = hallmarkfe.HFEManager({
+        'sequence': ['rules']
+    })
+    mgr.add_processor('rules', make_processor(cls))
+    return mgr
+
+def make_fused():
+    return make_manager(FusedProcessor)
+
+@pytest.fixture
+def calls():
+    return make_calls()
+
+@pytest.fixture
+def manager():
+    return make_manager()
+
+@pytest.fixture
+def fused():
+    return make_fused()
@@ -72,3 +72,23 @@ def reducefunc(g):
     features = state.get_all_features()
 
     return features 
+
+
+def build_mgr1(rules):
+    """
+    Factory for the spark runner. The rules are broadcast once
+    instead of being read on every executor.
+    """
+    mgr = hallmarkfe.HFEManager({
+        'sequence': ['complex1']
+    })
+
+    myproc1 = SimpleRuleProcessor1(conf={
+        'name': 'complex1',
+        'owner': 'marketing',
+        'manager': 'Manager'
+    })
+    myproc1.rules = rules
+
+    mgr.add_processor('complex1', myproc1)
+    return mgr
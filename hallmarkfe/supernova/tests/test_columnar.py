@@ -0,0 +1,138 @@
+import sys
+import pytest
+import numpy as np
+import pandas as pd
+import  hallmarkfe.supernova  as hallmarkfe
+from hallmarkfe.supernova.rules import compile_rule
+from hallmarkfe.supernova.columnar import ColumnarTable, as_columnar, compile_rule_mask
+
+from .test_rules import rules, logical, keywords
+from .conftest import make_processor
+
+keyword_rules = [
+    {'match': m, 'column': 'Tags', 'values': keywords}
+    for m in ['CONTAINS_ALL', 'CONTAINS_ANY', 'CONTAINS_NONE']
+]
+
+@pytest.mark.parametrize('rule', rules + logical + keyword_rules)
+def test_rule_mask(rule, calls):
+    """
+    Vectorized evaluation matches the row evaluation
+    """
+    proc = make_processor()
+    mask = proc.table_evaluate_rule_columnar(calls, rule)
+    expected = [proc.table_evaluate_rule(r, rule) for r in calls.to_dict('records')]
+    assert mask.tolist() == expected
+
+@pytest.mark.parametrize('columnar', [
+    lambda df: df,
+    lambda df: {c: df[c].to_numpy() for c in df.columns},
+])
+def test_columnar_features(columnar, manager, calls):
+    """
+    DataFrame and dict-of-arrays tables produce the same features as
+    the record path
+    """
+    mgr, df = manager, calls
+    for key, group in df.groupby('In'):
+        rowstate = hallmarkfe.HFEAtomicState()
+        rowstate.set_data('calls', group.to_dict('records'))
+        mgr.process(rowstate)
+
+        colstate = hallmarkfe.HFEAtomicState()
+        colstate.set_data('calls', columnar(group))
+        mgr.process(colstate)
+
+        expected = rowstate.get_all_features()
+        actual = colstate.get_all_features()
+        assert list(actual.items()) == list(expected.items())
+        assert [type(v) for v in actual.values()] == [type(v) for v in expected.values()]
+
+def test_columnar_table():
+    """
+    Columnar table access
+    """
+    table = as_columnar({'a': np.arange(4), 'b': np.array(['w', 'x', 'y', 'z'])})
+    assert len(table) == 4
+    assert list(table)[1] == {'a': 1, 'b': 'x'}
+    assert len(table.take(table['a'] > 1)) == 2
+    assert table.slice(1, 3).tolist('b') == ['x', 'y']
+
+    with pytest.raises(Exception):
+        ColumnarTable({'a': np.arange(4), 'b': np.arange(3)})
+
+def test_columnar_dates():
+    """
+    Dates and durations come back as in the records of the frame
+    """
+    df = pd.DataFrame({
+        'When': pd.to_datetime(['2020-01-01', None, '2020-03-01']),
+        'Wait': pd.to_timedelta(['1h', '2s', None]),
+        'Duration': [1, 2, 3],
+    })
+    table = ColumnarTable.from_frame(df)
+    assert list(table) == df.to_dict('records')
+    assert table.tolist('When')[0] == pd.Timestamp('2020-01-01')
+    assert table.tolist('Wait')[0] == pd.Timedelta('1h')
+
+    batch = hallmarkfe.SegmentedTable.group(table, ['When'])
+    assert pd.Timestamp('2020-01-01') in batch.keys
+
+def test_columnar_missing_strings():
+    """
+    Missing values in string columns fail as in the record path
+    """
+    df = pd.DataFrame({'Direction': ['Incoming', None, 'Missed']})
+    table = ColumnarTable.from_frame(df)
+    assert table.tolist('Direction')[0] == 'Incoming'
+    assert pd.isnull(table.tolist('Direction')[1])
+
+    for match in ['NOTIN', 'CONTAINS_NONE']:
+        rule = {'match': match, 'column': 'Direction', 'values': ['Incoming']}
+        predicate = compile_rule(rule)
+        with pytest.raises(AttributeError):
+            [predicate(r) for r in df.to_dict('records')]
+        with pytest.raises(AttributeError):
+            compile_rule_mask(rule)(table)
+
+class CountProcessor(hallmarkfe.HFEProcessor):
+
+    def process(self, state, level):
+        if level != 2:
+            return
+        calls = state.get_data('calls')
+        state.set_feature('{}_calls'.format(self.name), len(calls))
+
+@pytest.mark.parametrize('keys', [['In'], ['In', 'DOW']])
+def test_process_batch(keys, manager, calls):
+    """
+    Batched processing matches the groupby-apply pattern
+    """
+    mgr, df = manager, calls
+    mgr.add_processor('count', make_processor(CountProcessor, 'count'))
+    mgr.set_sequence(['rules', 'count'])
+
+    expected = {}
+    for key, rows in df.groupby(keys):
+        state = hallmarkfe.HFEAtomicState()
+        state.set_data('calls', rows.to_dict('records'))
+        mgr.process(state)
+        expected[key[0] if len(keys) == 1 else key] = state.get_all_features()
+
+    actual = mgr.process_batch(df, keys)
+
+    assert list(actual.index) == list(expected.keys())
+    for key, features in expected.items():
+        row = actual.loc[key].dropna()
+        assert row.to_dict() == dict(features)
+
+def test_process_batch_name(manager, calls):
+    """
+    Dataset name has to be inferrable
+    """
+    mgr, df = manager, calls
+    assert mgr.process_batch(df, 'In', name='calls').shape[0] == 3
+
+    mgr.get_processors()[0].rules[0]['operators'][0]['params']['table'] = 'other'
+    with pytest.raises(Exception):
+        mgr.process_batch(df, 'In')
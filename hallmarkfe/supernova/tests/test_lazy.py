@@ -0,0 +1,82 @@
+import sys
+import pytest
+import hallmarkfe.supernova  as hallmarkfe
+from hallmarkfe.supernova.lazy import LazyTable, as_table
+from hallmarkfe.supernova.compact import HFECompactState
+
+from .conftest import make_calls, make_manager, make_processor, make_fused
+
+def expected_features(mgr, rows):
+    state = hallmarkfe.HFEAtomicState()
+    state.set_data('calls', rows)
+    mgr.process(state)
+    return dict(state.get_all_features())
+
+@pytest.mark.parametrize('statecls', [hallmarkfe.HFEAtomicState, HFECompactState])
+def test_lazy_stream(statecls):
+    """
+    Built-in aggregates over a generator are computed in one pass
+    """
+    mgr = make_fused()
+    rows = make_calls().to_dict('records')
+
+    state = statecls()
+    state.set_data('calls', (r for r in rows))
+    assert isinstance(state.get_data('calls'), LazyTable)
+    mgr.process(state)
+
+    assert dict(state.get_all_features()) == expected_features(mgr, rows)
+    assert state.get_data('calls').consumed
+
+def test_lazy_chunks():
+    """
+    Chunking does not change the features
+    """
+    proc = make_fused().processors['rules']
+    rows = make_calls().to_dict('records')
+
+    expected = hallmarkfe.HFEAtomicState()
+    expected.set_data('calls', rows)
+    proc.process(expected, 1)
+
+    state = hallmarkfe.HFEAtomicState()
+    state.set_data('calls', iter(rows))
+    operators = proc.table_stream_operators(state, 1)['calls']
+    proc.handler_table_stream_rules(state, 'calls', operators, chunksize=2)
+
+    assert list(state.get_all_features().items()) == list(expected.get_all_features().items())
+
+def test_lazy_materialize():
+    """
+    Custom metric handlers and several readers get a list
+    """
+    rows = make_calls().to_dict('records')
+
+    mgr = make_manager()
+    state = hallmarkfe.HFEAtomicState()
+    state.set_data('calls', lambda: iter(rows))
+    mgr.process(state)
+    assert state.get_data('calls') == rows
+    assert dict(state.get_all_features()) == expected_features(mgr, rows)
+
+    mgr = make_fused()
+    proc = make_processor(name='other')
+    mgr.add_processor('other', proc)
+    mgr.set_sequence(['rules', 'other'])
+    state = hallmarkfe.HFEAtomicState()
+    state.set_data('calls', (r for r in rows))
+    mgr.process(state)
+    assert dict(state.get_all_features()) == expected_features(mgr, rows)
+
+def test_lazy_table():
+    rows = [{'a': 1}, {'a': 2}, {'a': 3}]
+    table = LazyTable(lambda: iter(rows))
+    assert table.peek() == {'a': 1}
+    assert table.peek() == {'a': 1}
+    assert list(table.chunks(2)) == [rows[:2], rows[2:]]
+    with pytest.raises(Exception):
+        list(table)
+
+    assert LazyTable(iter([])).peek() is None
+    assert as_table(rows) is rows
+    assert isinstance(as_table(iter(rows)), LazyTable)
@@ -0,0 +1,79 @@
+import sys
+import pytest
+import numpy as np
+import pandas as pd
+import  hallmarkfe.supernova  as hallmarkfe
+
+from .conftest import make_calls, make_manager
+
+def test_builder():
+    """
+    Test feature matrix accumulation
+    """
+    builder = hallmarkfe.FeatureMatrixBuilder({
+        'total': 'float64',
+        'count': 'int64',
+        'flag': 'bool',
+    }, key_columns=['In'], capacity=1)
+
+    builder.append({'total': 1.5, 'count': 2, 'flag': True}, key='a')
+    builder.append({'count': 3, 'name': 'x'}, key='b')
+    builder.append({'total': 2.0, 'name': 'y', 'flag': False}, key='c')
+    assert len(builder) == 3
+
+    df = builder.to_frame()
+    assert list(df.index) == ['a', 'b', 'c']
+    assert list(df.columns) == ['total', 'count', 'flag', 'name']
+    assert df['total'].isnull().tolist() == [False, True, False]
+    assert df['count'].tolist()[:2] == [2, 3]
+    assert pd.isnull(df['count'].iloc[2])
+    assert df['name'].isnull().tolist() == [True, False, False]
+
+    strict = hallmarkfe.FeatureMatrixBuilder(['total'], strict=True)
+    with pytest.raises(Exception):
+        strict.append({'other': 1})
+
+def test_builder_arrow():
+    """
+    Test arrow output
+    """
+    pytest.importorskip('pyarrow')
+    builder = hallmarkfe.FeatureMatrixBuilder(['total'], key_columns=['In'])
+    builder.append({'total': 1.0}, key='a')
+    builder.append({}, key='b')
+    table = builder.to_arrow()
+    assert table.column_names == ['In', 'total']
+    assert table.column('total').null_count == 1
+
+def test_builder_batch():
+    """
+    Test the builder as a sink of the batch processing
+    """
+    mgr = make_manager()
+    df = make_calls()
+    expected = mgr.process_batch(df, ['In'])
+    actual = mgr.process_batch(df, ['In'], sink=hallmarkfe.FeatureMatrixBuilder())
+
+    assert list(actual.index) == list(expected.index)
+    assert list(actual.columns) == list(expected.columns)
+    assert np.allclose(actual.to_numpy(dtype=float), expected.to_numpy(dtype=float),
+                       equal_nan=True)
+
+def test_builder_promote():
+    """
+    Test widening of columns to fit later values
+    """
+    builder = hallmarkfe.FeatureMatrixBuilder(capacity=1)
+    builder.append({'flag': True, 'score': 1.5, 'count': 1})
+    builder.append({'flag': 7, 'score': 'high'})
+    builder.append({'flag': False, 'score': 2.0, 'count': 2 ** 70})
+
+    df = builder.to_frame()
+    assert df['flag'].tolist() == [1, 7, 0]
+    assert df['score'].tolist() == [1.5, 'high', 2.0]
+    assert df['count'].tolist()[0] == 1
+    assert df['count'].tolist()[2] == 2 ** 70
+
+    builder = hallmarkfe.FeatureMatrixBuilder({'count': 'int64'})
+    builder.append({'count': 2.5})
+    assert builder.to_frame()['count'].tolist() == [2.5]
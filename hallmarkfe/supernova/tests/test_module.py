@@ -1,4 +1,5 @@
 import sys 
+import copy
 import pytest 
 import  hallmarkfe.supernova  as hallmarkfe
 
@@ -46,3 +47,310 @@ def test_data():
         
     d = state.get_data('hello') 
     assert isinstance(d, list) 
+
+def test_plan():
+    """
+    Test level-aware schedule of the manager
+    """
+    mgr = hallmarkfe.HFEManager({
+        'sequence': ['rules', 'custom']
+    })
+    conf = {
+        'name': 'rules',
+        'owner': 'Brian',
+        'manager': 'TestManager'
+    }
+    rules = hallmarkfe.HFERuleBasedProcessor(conf=conf)
+    rules.rules = [{
+        'name': 'calls',
+        'operators': [
+            {'handler': 'handler_table_apply_rule', 'level': 1,
+             'params': {'table': 'calls', 'metrics': []}},
+            {'handler': 'handler_table_apply_rule', 'level': 3,
+             'params': {'table': '__computed__', 'metrics': []}},
+        ]
+    }]
+    mgr.add_processor('rules', rules)
+    mgr.add_processor('custom', hallmarkfe.HFEProcessor(conf=conf))
+
+    plan = mgr.get_plan()
+    assert [step['level'] for step in plan] == [1, 2, 3, 4]
+    assert plan[0]['processors'] == ['rules', 'custom']
+    assert plan[1]['processors'] == ['custom']
+
+    # Only the rule processor remains
+    mgr.set_sequence(['rules'])
+    plan = mgr.get_plan()
+    assert plan == [
+        {'level': 1, 'processors': ['rules'], 'computed': False},
+        {'level': 3, 'processors': ['rules'], 'computed': True},
+    ]
+
+    state = hallmarkfe.HFEAtomicState()
+    state.set_data('calls', [])
+    mgr.process(state)
+    assert state.get_data('__computed__') == [{}]
+
+class CustomRuleProcessor(hallmarkfe.HFERuleBasedProcessor):
+
+    def process(self, state, level):
+        super().process(state, level)
+        if level == 2:
+            state.set_feature('sms', len(state.get_data('sms')))
+
+def test_plan_custom():
+    """
+    Test the schedule of overridden processors and of edited rules
+    """
+    mgr = hallmarkfe.HFEManager({
+        'sequence': ['rules']
+    })
+    proc = CustomRuleProcessor(conf={
+        'name': 'rules',
+        'owner': 'Brian',
+        'manager': 'TestManager'
+    })
+    operator = {'handler': 'handler_table_apply_rule', 'level': 1,
+                'params': {'table': 'calls', 'metrics': []}}
+    proc.rules = [{'name': 'calls', 'operators': [operator]}]
+    mgr.add_processor('rules', proc)
+
+    # The overridden process runs at every level
+    assert [step['level'] for step in mgr.get_plan()] == [1, 2, 3, 4]
+    state = hallmarkfe.HFEAtomicState()
+    state.set_data('calls', [])
+    state.set_data('sms', [1, 2])
+    mgr.process(state)
+    assert state.get_feature('sms') == 2
+
+    # Rules edited in place are rescheduled
+    mgr.processors['rules'] = proc = hallmarkfe.HFERuleBasedProcessor(conf=proc.conf)
+    proc.rules = [{'name': 'calls', 'operators': [operator]}]
+    assert [step['level'] for step in mgr.get_plan()] == [1]
+    operator['level'] = 3
+    assert [step['level'] for step in mgr.get_plan()] == [3]
+
+class LengthProcessor(hallmarkfe.HFEProcessor):
+
+    def process(self, state, level):
+        calls = state.get_data('calls')
+        state.set_feature('{}_{}'.format(self.name, level), len(calls))
+        state.set_feature(self.conf.get('shared', self.name), level)
+
+def make_parallel_manager(executor, shared=None):
+    mgr = hallmarkfe.HFEManager({
+        'sequence': ['p1', 'p2', 'p3'],
+        'executor': executor,
+        'max_workers': 2
+    })
+    for name in mgr.sequence:
+        conf = {
+            'name': name,
+            'owner': 'Brian',
+            'manager': 'TestManager'
+        }
+        if shared is not None:
+            conf['shared'] = shared
+        mgr.add_processor(name, LengthProcessor(conf=conf))
+    return mgr
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_parallel(executor):
+    """
+    Test concurrent processors within a level
+    """
+    serial = make_parallel_manager(None)
+    parallel = make_parallel_manager(executor)
+
+    expected = hallmarkfe.HFEAtomicState()
+    expected.set_data('calls', [1, 2, 3])
+    serial.process(expected)
+
+    state = hallmarkfe.HFEAtomicState()
+    state.set_data('calls', [1, 2, 3])
+    parallel.process(state)
+    parallel.close()
+
+    assert list(state.get_all_features().items()) == list(expected.get_all_features().items())
+
+class AggregateProcessor(hallmarkfe.HFERuleBasedProcessor,
+                         hallmarkfe.MetricHandlerMixin):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metric_handlers = {
+            'total': self.aggregate_metric('sum', 'Duration'),
+            'calls': self.aggregate_metric('size'),
+        }
+        self.rules = [{
+            'name': '{}_{}'.format(self.name, direction),
+            'operators': [{
+                'handler': 'handler_table_apply_rule',
+                'level': 1,
+                'params': {
+                    'table': self.conf.get('table', 'calls'),
+                    'match': 'Duration',
+                    'rule': {'match': 'IN', 'column': 'Direction', 'values': [direction]},
+                    'metrics': [
+                        {'name': 'total', 'handler': 'total'},
+                        {'name': 'calls', 'handler': 'calls'},
+                    ]
+                }
+            }]
+        } for direction in ['Incoming', 'Outgoing']]
+
+def test_parallel_rule_processors():
+    """
+    Test rule processors in worker processes
+    """
+    calls = [
+        {'Direction': 'Incoming', 'Duration': 10},
+        {'Direction': 'Outgoing', 'Duration': 20},
+        {'Direction': 'incoming', 'Duration': 5},
+    ]
+    mgr = hallmarkfe.HFEManager({
+        'sequence': ['p1', 'p2'],
+        'executor': 'process',
+        'max_workers': 2
+    })
+    for name in mgr.sequence:
+        mgr.add_processor(name, AggregateProcessor(conf={
+            'name': name,
+            'owner': 'Brian',
+            'manager': 'TestManager'
+        }))
+
+    # Serial runs fill the caches of the compiled rules
+    expected = hallmarkfe.HFEAtomicState()
+    expected.set_data('calls', calls)
+    for name in mgr.sequence:
+        mgr.processors[name].process(expected, 1)
+
+    state = hallmarkfe.HFEAtomicState()
+    state.set_data('calls', calls)
+    mgr.process(state)
+    assert dict(state.get_all_features()) == dict(expected.get_all_features())
+
+    # The pool is restarted to send new processors to the workers
+    assert mgr.executor is not None
+    mgr.add_processor('p2', mgr.processors['p2'])
+    assert mgr.executor is None
+
+    # Lambdas cannot be sent to the workers
+    mgr.close()
+    proc = mgr.processors['p2']
+    mgr.processors['p2'] = copy.copy(proc)
+    mgr.processors['p2'].metric_handlers = dict(proc.metric_handlers, total=lambda args, rows: 0)
+    mgr.picklable.clear()
+    state = hallmarkfe.HFEAtomicState()
+    state.set_data('calls', calls)
+    with pytest.raises(Exception) as exc:
+        mgr.process(state)
+    mgr.close()
+    assert 'cannot be sent to a worker process' in str(exc.value)
+
+def test_parallel_lazy():
+    """
+    Test lazy tables read by a single processor in worker processes
+    """
+    calls = [
+        {'Direction': 'Incoming', 'Duration': 10},
+        {'Direction': 'Outgoing', 'Duration': 20},
+    ]
+    mgr = hallmarkfe.HFEManager({
+        'sequence': ['p1', 'p2'],
+        'executor': 'process',
+        'max_workers': 2
+    })
+    for name, table in [('p1', 'calls'), ('p2', 'sms')]:
+        mgr.add_processor(name, AggregateProcessor(conf={
+            'name': name,
+            'owner': 'Brian',
+            'manager': 'TestManager',
+            'table': table
+        }))
+
+    expected = hallmarkfe.HFEAtomicState()
+    expected.set_data('calls', calls)
+    expected.set_data('sms', calls)
+    for name in mgr.sequence:
+        mgr.processors[name].process(expected, 1)
+
+    state = hallmarkfe.HFEAtomicState()
+    state.set_data('calls', (r for r in calls))
+    state.set_data('sms', (r for r in calls))
+    mgr.process(state)
+    mgr.close()
+    assert dict(state.get_all_features()) == dict(expected.get_all_features())
+
+def test_parallel_conflict():
+    """
+    Test conflicting feature writes
+    """
+    mgr = make_parallel_manager('thread', shared='same')
+    state = hallmarkfe.HFEAtomicState()
+    state.set_data('calls', [])
+    with pytest.raises(Exception) as exc:
+        mgr.process(state)
+    mgr.close()
+    assert 'Conflicting' in str(exc.value)
+
+    with pytest.raises(Exception):
+        hallmarkfe.HFEManager({'executor': 'gpu'})
+
+def test_compact_state():
+    """
+    Test compact state access
+    """
+    index = hallmarkfe.HFEFeatureIndex()
+    state1 = hallmarkfe.HFECompactState(index)
+    state2 = hallmarkfe.HFECompactState(index)
+
+    state1.set_feature('hello', 'value')
+    state2.set_feature('world', 1)
+    state2.set_feature('hello', 2)
+
+    assert state1.get_feature('hello') == 'value'
+    assert state1.get_feature_list() == ['hello']
+    assert list(state2.get_all_features().items()) == [('hello', 2), ('world', 1)]
+    assert len(index) == 2
+    with pytest.raises(KeyError):
+        state1.get_feature('world')
+    assert not hasattr(state1, '__dict__')
+
+    with pytest.raises(Exception):
+        state1.get_data('hello')
+    state1.set_data('hello', [])
+    assert state1.get_data('hello') == []
+
+def test_compact_state_process():
+    """
+    Test the manager with compact states
+    """
+    mgr = make_parallel_manager(None)
+    expected = hallmarkfe.HFEAtomicState()
+    expected.set_data('calls', [1, 2])
+    mgr.process(expected)
+
+    state = mgr.create_compact_state()
+    state.set_data('calls', [1, 2])
+    mgr.process(state)
+    assert state.get_all_features() == expected.get_all_features()
+    assert state.index is mgr.feature_index
+    assert mgr.create_compact_state().index is mgr.feature_index
+
+    # States of different managers do not share their names
+    other = make_parallel_manager(None)
+    assert other.create_compact_state().index is not mgr.feature_index
+    assert hallmarkfe.HFECompactState().index is not hallmarkfe.HFECompactState().index
+
+def test_spark_optional():
+    """
+    Test importing the Spark integration without pyspark
+    """
+    from hallmarkfe.supernova import spark
+    if spark.T is not None:
+        pytest.skip("pyspark is installed")
+    with pytest.raises(Exception) as exc:
+        spark.features_schema(['In'], ['total'])
+    assert 'pyspark is required' in str(exc.value)
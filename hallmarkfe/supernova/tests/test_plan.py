@@ -0,0 +1,31 @@
+import sys
+import pytest
+
+from .conftest import make_processor
+
+def test_rule_plan(calls):
+    """
+    Plans are cached per operator and column signature
+    """
+    proc = make_processor()
+    rule = proc.rules[0]
+    operator = rule['operators'][0]
+    rows = calls.to_dict('records')
+
+    plan = proc.table_rule_plan(rule, operator, rows[0])
+    assert proc.table_rule_plan(rule, operator, dict(rows[1])) is plan
+    assert plan['cols'] == ['Duration']
+    assert [e[2] for e in plan['entries']] == [
+        'tag__Scribble__rule0__1__total',
+        'tag__Scribble__rule0__1__avg',
+        'tag__Scribble__rule0__1__dates',
+    ]
+
+    narrow = {'Duration': 1, 'DOW': 'Sat'}
+    assert proc.table_rule_plan(rule, operator, narrow) is not plan
+
+    # Replaced handlers are picked up
+    for value in range(4):
+        proc.metric_handlers = dict(proc.metric_handlers, total=lambda args, rows, value=value: value)
+        plan = proc.table_rule_plan(rule, operator, rows[0])
+        assert plan['entries'][0][0](None, rows) == value
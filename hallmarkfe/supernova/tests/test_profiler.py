@@ -0,0 +1,101 @@
+import sys
+import pickle
+import threading
+import hallmarkfe.supernova  as hallmarkfe
+
+from .test_rules import rules, logical
+from .conftest import make_calls, make_manager, make_fused
+
+def test_profiler():
+    """
+    Stats per processor, rule and metric
+    """
+    events = []
+    profiler = hallmarkfe.HFEProfiler(callback=events.append)
+    mgr = make_manager()
+    mgr.set_profiler(profiler)
+
+    rows = make_calls().to_dict('records')
+    for i in range(2):
+        state = hallmarkfe.HFEAtomicState()
+        state.set_data('calls', rows)
+        mgr.process(state)
+
+    nfeatures = len(state.get_feature_list())
+    report = profiler.report()
+    assert len(events) > 0
+    assert report == sorted(report, key=lambda e: -e['seconds'])
+
+    entity = profiler.report('entity')
+    assert len(entity) == 1
+    assert entity[0]['calls'] == 2
+    assert entity[0]['features'] == 2 * nfeatures
+
+    processors = profiler.report('processor')
+    assert [e['key'] for e in processors] == [('rules', 1)]
+
+    ruleset = profiler.report('rule')
+    assert len(ruleset) == len(rules + logical)
+    for entry in ruleset:
+        assert entry['calls'] == 2
+        assert entry['rows'] == 2 * len(rows)
+        assert entry['passed'] <= entry['rows']
+    assert sum(e['features'] for e in ruleset) == 2 * nfeatures
+
+    metrics = profiler.report('metric')
+    assert set(e['key'][2] for e in metrics) <= set(['total', 'avg', 'dates'])
+
+    df = profiler.to_frame('rule')
+    assert len(df) == len(ruleset)
+
+    # Turning it off
+    profiler.reset()
+    mgr.set_profiler(None)
+    state = hallmarkfe.HFEAtomicState()
+    state.set_data('calls', rows)
+    mgr.process(state)
+    assert profiler.report() == []
+
+def test_profiler_stream():
+    """
+    Fused aggregates and lazy tables are accounted for
+    """
+    profiler = hallmarkfe.HFEProfiler()
+    mgr = make_fused()
+    mgr.set_profiler(profiler)
+    rows = make_calls().to_dict('records')
+
+    state = hallmarkfe.HFEAtomicState()
+    state.set_data('calls', rows)
+    mgr.process(state)
+    assert set(e['key'][2] for e in profiler.report('metric')) == set(['__aggregate__'])
+
+    profiler.reset()
+    state = hallmarkfe.HFEAtomicState()
+    state.set_data('calls', iter(rows))
+    mgr.process(state)
+    for entry in profiler.report('rule'):
+        assert entry['rows'] == len(rows)
+
+def test_profiler_threads():
+    """
+    Concurrent updates are not lost, and the profiler can be pickled
+    """
+    profiler = hallmarkfe.HFEProfiler()
+
+    def work():
+        for i in range(10000):
+            profiler.record('rule', ('p', 'r', 1), rows=2)
+
+    threads = [threading.Thread(target=work) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    entry = profiler.report('rule')[0]
+    assert entry['calls'] == 80000
+    assert entry['rows'] == 160000
+
+    copy = pickle.loads(pickle.dumps(profiler))
+    copy.record('rule', ('p', 'r', 1))
+    assert copy.report('rule')[0]['calls'] == 80001
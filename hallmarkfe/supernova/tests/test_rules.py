@@ -0,0 +1,160 @@
+import sys
+import random
+import pytest
+import  hallmarkfe.supernova  as hallmarkfe
+from hallmarkfe.supernova import rules as rulesmod
+from hallmarkfe.supernova.rules import compile_rule, keyword_matcher, rule_columns
+
+rows = [
+    {'Direction': 'Incoming', 'DOW': 'Sat', 'Duration': 161, 'Tags': 'news, Sports'},
+    {'Direction': 'Outgoing', 'DOW': 'Sun', 'Duration': 45, 'Tags': 'sports'},
+    {'Direction': 'incoming', 'DOW': 'Mon', 'Duration': 60, 'Tags': ''},
+    {'Direction': 'Missed', 'DOW': 'Sat', 'Duration': 0, 'Tags': 'NEWS weather'},
+]
+
+rules = [
+    {'match': 'IN', 'column': 'Direction', 'values': ['Incoming']},
+    {'match': ' notin ', 'column': 'Direction', 'values': ['Incoming', 'missed']},
+    {'match': 'GT', 'column': 'Duration', 'values': 60},
+    {'match': 'LTE', 'column': 'Duration', 'values': 60.0},
+    {'match': 'CONTAINS_ALL', 'column': 'Tags', 'values': ['news', ' sports ']},
+    {'match': 'CONTAINS_ANY', 'column': 'Tags', 'values': ['weather', 'sports']},
+    {'match': 'CONTAINS_NONE', 'column': 'Tags', 'values': ['news']},
+    {'match': 'UNKNOWN', 'values': []},
+]
+
+logical = [
+    {'match': m, 'values': [rules[0], rules[2], rules[5]]}
+    for m in ['AND', 'ALL', 'OR', 'ANY', 'NAND', 'XNAND', 'NOR']
+] + [
+    {'match': m, 'values': []}
+    for m in ['AND', 'OR', 'NAND', 'XNAND', 'NOR']
+]
+
+@pytest.mark.parametrize('rule', rules + logical)
+def test_compile_rule(rule):
+    """
+    Compiled rule matches the interpreted evaluation
+    """
+    proc = hallmarkfe.HFERuleBasedProcessor(conf={
+        'name': 'rules',
+        'owner': 'Scribble',
+        'manager': 'Manager'
+    })
+    predicate = compile_rule(rule)
+    for row in rows:
+        assert predicate(row) == proc.table_evaluate_rule(row, rule)
+
+def test_compile_rule_invalid():
+    """
+    GT/LT rules need a number
+    """
+    with pytest.raises(Exception):
+        compile_rule({'match': 'GT', 'column': 'Duration', 'values': '60'})
+
+def test_rule_columns():
+    """
+    Test the columns read by a rule
+    """
+    rule = {'match': 'AND', 'values': [
+        {'match': 'IN', 'column': 'Direction', 'values': ['Incoming']},
+        {'match': 'OR', 'values': [
+            {'match': 'CONTAINS_ANY', 'column': 'Tags', 'values': ['news']},
+            {'match': 'GT', 'column': 'Duration', 'values': 60},
+        ]},
+    ]}
+    assert rule_columns(rule) == ({'Direction', 'Tags'}, {'Duration'})
+
+def test_compile_rule_cache():
+    """
+    Compiled rules are cached per rule object
+    """
+    proc = hallmarkfe.HFERuleBasedProcessor(conf={
+        'name': 'rules',
+        'owner': 'Scribble',
+        'manager': 'Manager'
+    })
+    rule = rules[0]
+    assert proc.table_compile_rule(rule) is proc.table_compile_rule(rule)
+    assert proc.table_compile_rule(rule) is not proc.table_compile_rule(dict(rule))
+
+keywords = ['news', 'sport', 'sports', 'weather', 'NEWS WEATHER', '.*',
+            'a+b', 'x', 'straße', 'ss', ' '] + ['kw{}'.format(i) for i in range(40)]
+
+def test_keyword_matcher():
+    """
+    Single-scan matching gives the same result as testing each
+    keyword with `in`
+    """
+    rng = random.Random(0)
+    alphabet = 'ab.*+[]'
+    for _ in range(2000):
+        patterns = tuple(''.join(rng.choice(alphabet) for _ in range(rng.randrange(0, 4)))
+                         for _ in range(rng.randrange(0, 8)))
+        data = ''.join(rng.choice(alphabet + 'x') for _ in range(rng.randrange(0, 10)))
+        match_any, match_all = keyword_matcher(patterns)
+        assert match_any(data) == any(p in data for p in patterns)
+        assert match_all(data) == all(p in data for p in patterns)
+
+@pytest.mark.parametrize('match', ['CONTAINS_ALL', 'CONTAINS_ANY', 'CONTAINS_NONE'])
+@pytest.mark.parametrize('count', [2, 5, len(keywords)])
+def test_compile_rule_keywords(match, count):
+    """
+    CONTAINS leaves with many keywords match the interpreted rules
+    """
+    proc = hallmarkfe.HFERuleBasedProcessor(conf={
+        'name': 'rules',
+        'owner': 'Scribble',
+        'manager': 'Manager'
+    })
+    values = keywords[:count]
+    cells = rows + [{'Tags': t} for t in ['STRASSE news', 'kw7', 'A+B x', '', ' .* ']]
+    for rule in [{'match': match, 'column': 'Tags', 'values': values},
+                 {'match': match, 'column': 'Tags', 'values': ['news', 'sports']}]:
+        predicate = compile_rule(rule)
+        for row in cells:
+            assert predicate(row) == proc.table_evaluate_rule(row, rule)
+
+def test_keyword_matcher_fallback(monkeypatch):
+    """
+    Without pyahocorasick, CONTAINS_ALL tests each keyword
+    """
+    monkeypatch.setattr(rulesmod, 'ahocorasick', None)
+    match_any, match_all = keyword_matcher(('AB', 'BC', 'X'))
+    assert match_all('XABC') and not match_all('ABX')
+    assert match_any('BC') and not match_any('A')
+
+@pytest.mark.parametrize('columnar', [False, True])
+def test_fused_metrics(columnar, manager, fused, calls):
+    """
+    Built-in aggregates give the same features as the helpers
+    """
+    data = calls if columnar else calls.to_dict('records')
+    expected = hallmarkfe.HFEAtomicState()
+    expected.set_data('calls', data)
+    manager.process(expected)
+
+    state = hallmarkfe.HFEAtomicState()
+    state.set_data('calls', data)
+    fused.process(state)
+
+    assert list(state.get_all_features().items()) == list(expected.get_all_features().items())
+
+def test_toolz_aggregate(fused, calls):
+    """
+    Several aggregates over the same records
+    """
+    proc = fused.processors['rules']
+    rows = calls.to_dict('records')
+    assert proc.toolz_aggregate([
+        ('Duration', 'sum'),
+        ('Duration', 'min'),
+        ('Duration', 'max'),
+        ('DOW', 'count'),
+        ('Duration', 'avg'),
+        ('Duration', 'sum', float),
+    ], rows) == [353, 0, 161, 3, 353/6, 353.0]
+    assert proc.toolz_aggregate([('Duration', 'avg'), ('DOW', 'count')], []) == [None, 0]
+
+    with pytest.raises(Exception):
+        proc.toolz_aggregate([('Duration', 'median')], rows)
@@ -0,0 +1,289 @@
+import sys
+import pytest
+import pandas as pd
+import hallmarkfe.supernova  as hallmarkfe
+from hallmarkfe.supernova.rules import compile_rule
+from hallmarkfe.supernova.ruleset import RuleSet, canonical_rule, rule_name
+from hallmarkfe.supernova.columnar import ColumnarTable
+
+from .test_rules import rows, rules, logical
+from .conftest import make_calls, make_manager, make_processor
+
+nested = [
+    {'match': 'AND', 'values': [logical[2], rules[6]]},
+    {'match': 'OR', 'values': [rules[6], logical[2], {'match': 'NOR', 'values': [rules[1], rules[3]]}]},
+    {'match': 'XNAND', 'values': [logical[0], logical[4], rules[4]]},
+]
+
+def test_canonical_rule():
+    """
+    Equivalent rules get the same key
+    """
+    a = {'match': 'AND', 'values': [rules[0], rules[2]]}
+    b = {'match': ' all', 'values': [rules[2], {'match': 'in', 'column': 'Direction', 'values': ['INCOMING']}]}
+    assert canonical_rule(a) == canonical_rule(b)
+    assert canonical_rule(a) != canonical_rule(logical[2])
+    assert canonical_rule(rules[7]) == canonical_rule({'match': 'OTHER', 'values': None})
+
+def test_ruleset():
+    """
+    Shared evaluation gives the same records as the compiled rules
+    """
+    specs = rules + logical + nested
+    ruleset = RuleSet(specs)
+    assert len(ruleset.get_shared()) > 0
+
+    table = ColumnarTable.from_frame(make_calls())
+    records = list(table)
+
+    cache = {}
+    masks = {}
+    for spec in specs:
+        expected = [r for r in records if compile_rule(spec)(r)]
+        assert ruleset.filter(spec, records, cache) == expected
+
+        mask = ruleset.mask(spec, table, masks)
+        assert mask.tolist() == [compile_rule(spec)(r) for r in records]
+
+    # Shared nodes are computed once per table
+    assert canonical_rule(logical[2]) in masks
+    assert any(k[0] == 'row' for k in cache if isinstance(k, tuple))
+
+def test_ruleset_order():
+    """
+    Cheap and selective children of AND go first
+    """
+    spec = {'match': 'AND', 'values': [rules[4], rules[2], rules[7]]}
+    ruleset = RuleSet([spec])
+    ruleset.compile()
+    node = ruleset.nodes[canonical_rule(spec)]
+    assert [c.op for c in node.children] == ['FALSE', 'GT', 'CONTAINS_ALL']
+    assert ruleset.filter(spec, rows, {}) == []
+
+@pytest.mark.parametrize('columnar', [False, True])
+def test_share_predicates(columnar):
+    """
+    Features do not depend on the shared evaluation
+    """
+    df = make_calls()
+    data = df if columnar else df.to_dict('records')
+
+    results = []
+    for share in [False, True]:
+        proc = make_processor()
+        proc.share_predicates = share
+        proc.rules = proc.rules + [{
+            'name': 'nested{}'.format(i),
+            'operators': [{
+                'handler': 'handler_table_apply_rule',
+                'level': 1,
+                'params': {
+                    'table': 'calls',
+                    'match': 'Duration',
+                    'rule': spec,
+                    'metrics': [{'name': 'total', 'handler': 'total'}]
+                }
+            }]
+        } for i, spec in enumerate(nested)]
+
+        state = hallmarkfe.HFEAtomicState()
+        state.set_data('calls', data)
+        proc.process(state, 1)
+        results.append(list(state.get_all_features().items()))
+
+    assert results[0] == results[1]
+
+def test_shared_table_columns():
+    """
+    Processors whose rules read different columns of a table share
+    its cache
+    """
+    records = make_calls().to_dict('records')
+    direction = [{'match': 'IN', 'column': 'Direction', 'values': ['Incoming']},
+                 {'match': 'NOTIN', 'column': 'Direction', 'values': ['Missed']}]
+    dow = [{'match': 'IN', 'column': 'DOW', 'values': ['Sat']},
+           {'match': 'AND', 'values': [
+               {'match': 'NOTIN', 'column': 'DOW', 'values': ['Sun']},
+               {'match': 'IN', 'column': 'Direction', 'values': ['Outgoing']}]}]
+
+    def make_proc(name, specs, share):
+        proc = make_processor(name=name)
+        proc.share_predicates = share
+        proc.rules = [{
+            'name': '{}{}'.format(name, i),
+            'operators': [{
+                'handler': 'handler_table_apply_rule',
+                'level': 1,
+                'params': {
+                    'table': 'calls',
+                    'match': 'Duration',
+                    'rule': spec,
+                    'metrics': [{'name': 'total', 'handler': 'total'}]
+                }
+            }]
+        } for i, spec in enumerate(specs)]
+        return proc
+
+    for order in [('direction', 'dow'), ('dow', 'direction')]:
+        results = []
+        for share in [False, True]:
+            specs = {'direction': direction, 'dow': dow}
+            state = hallmarkfe.HFEAtomicState()
+            state.set_data('calls', records)
+            for name in order:
+                make_proc(name, specs[name], share).process(state, 1)
+            results.append(dict(state.get_all_features()))
+        assert results[0] == results[1]
+
+@pytest.mark.parametrize('columnar', [False, True])
+def test_modified_table(columnar):
+    """
+    Tables modified in place between runs are evaluated again
+    """
+    mgr = make_manager()
+    df = make_calls()
+    data = df.copy() if columnar else df.to_dict('records')
+
+    state = hallmarkfe.HFEAtomicState()
+    state.set_data('calls', data)
+    mgr.process(state)
+    assert '__cache__' not in state.state['data']
+
+    if columnar:
+        data.loc[0, 'Duration'] = 1000
+        df.loc[0, 'Duration'] = 1000
+    else:
+        data.append(dict(data[0]))
+        df = pd.concat([df, df.iloc[:1]], ignore_index=True)
+    mgr.process(state)
+
+    expected = hallmarkfe.HFEAtomicState()
+    expected.set_data('calls', df if columnar else df.to_dict('records'))
+    make_manager().process(expected)
+    assert dict(state.get_all_features()) == dict(expected.get_all_features())
+
+def test_rule_stats(tmp_path):
+    stats = hallmarkfe.RuleStats()
+    stats.record('a', 10, 2, 0.001)
+    stats.record('a', 10, 4)
+    assert stats.get('a') == (0.3, 0.0001)
+    assert stats.get('b') == (None, None)
+
+    path = str(tmp_path / 'stats.json')
+    stats.save(path)
+    loaded = hallmarkfe.RuleStats.load(path)
+    assert loaded.to_dict() == stats.to_dict()
+
+    loaded.merge(stats)
+    assert loaded.get('a')[0] == 0.3
+    assert loaded.report()[0]['rows'] == 40
+
+def test_adaptive_order():
+    """
+    Learned pass rates override the static estimates
+    """
+    records = make_calls().to_dict('records')
+    # Statically, IN with one value looks more selective than GT
+    spec = {'match': 'AND', 'values': [
+        {'match': 'GT', 'column': 'Duration', 'values': 1000},
+        {'match': 'IN', 'column': 'DOW', 'values': ['Sat']},
+    ]}
+    stats = hallmarkfe.RuleStats()
+    ruleset = RuleSet([spec], stats=stats, warmup=2)
+    ruleset.compile()
+    node = ruleset.nodes[canonical_rule(spec)]
+    assert [c.op for c in node.children] == ['IN', 'GT']
+
+    for i in range(2):
+        assert ruleset.filter(spec, records, {}) == []
+    ruleset.compile()
+    assert [c.op for c in node.children] == ['GT', 'IN']
+    assert stats.get(node.name)[0] == 0.0
+
+    # Later rule sets start from the learned order
+    ruleset = RuleSet([spec], stats=hallmarkfe.RuleStats(stats.to_dict()))
+    ruleset.compile()
+    node = ruleset.nodes[canonical_rule(spec)]
+    assert [c.op for c in node.children] == ['GT', 'IN']
+
+    # Measured costs do not change the order
+    for name, entry in stats.stats.items():
+        entry[2:] = [1, 1000.0] if 'GT' in name else [1, 0.0]
+    ruleset = RuleSet([spec], stats=hallmarkfe.RuleStats(stats.to_dict()))
+    ruleset.compile()
+    node = ruleset.nodes[canonical_rule(spec)]
+    assert [c.op for c in node.children] == ['GT', 'IN']
+
+def test_observe_shared_cache():
+    """
+    Rule sets that share the cache of a table each observe it
+    """
+    records = make_calls().to_dict('records')
+    spec = {'match': 'GT', 'column': 'Duration', 'values': 1000}
+    stats1 = hallmarkfe.RuleStats()
+    stats2 = hallmarkfe.RuleStats()
+    cache = {}
+    RuleSet([spec], stats=stats1).filter(spec, records, cache)
+    RuleSet([spec], stats=stats2).filter(spec, records, cache)
+    assert len(stats2) == 1
+    assert stats2.get(rule_name(spec))[0] == stats1.get(rule_name(spec))[0]
+
+def test_manager_rule_stats():
+    mgr = hallmarkfe.HFEManager({
+        'sequence': ['rules']
+    })
+    proc = make_processor()
+    mgr.add_processor('rules', proc)
+    # The order is only learned when asked for
+    assert proc.table_rule_set().stats is None
+
+    stats = hallmarkfe.RuleStats()
+    mgr.set_rule_stats(stats)
+    assert proc.get_rule_stats() is stats
+
+    state = hallmarkfe.HFEAtomicState()
+    state.set_data('calls', make_calls().to_dict('records'))
+    mgr.process(state)
+    assert len(stats) > 0
+    assert mgr.get_rule_stats().to_dict() == stats.to_dict()
+
+def test_evaluate_rule_short_circuit():
+    """
+    table_evaluate_rule stops at the first child that decides
+    """
+    proc = make_processor()
+    row = {'Direction': 'Incoming', 'Duration': None}
+    never = {'match': 'IN', 'column': 'Direction', 'values': ['Missed']}
+    broken = {'match': 'GT', 'column': 'Duration', 'values': 10}
+    assert proc.table_evaluate_rule(row, {'match': 'AND', 'values': [never, broken]}) is False
+    assert proc.table_evaluate_rule(row, {'match': 'NOR', 'values': [rules[0], broken]}) is False
+    for spec in logical + nested:
+        for r in rows:
+            assert proc.table_evaluate_rule(r, spec) == compile_rule(spec)(r)
+
+def test_normalized_view():
+    """
+    String columns are upper-cased once per table, and the records
+    are read directly if they cannot be
+    """
+    specs = rules + logical + nested
+    ruleset = RuleSet(specs)
+    ruleset.compile()
+    assert ruleset.normalized == frozenset(['Direction', 'Tags'])
+
+    cache = {}
+    view = ruleset.normalized_view(rows, cache)
+    assert view[0] == {'Direction': 'INCOMING', 'Duration': 161, 'Tags': 'NEWS, SPORTS'}
+    assert ruleset.normalized_view(rows, cache) is view
+    for spec in specs:
+        assert ruleset.filter(spec, rows, cache) == [r for r in rows if compile_rule(spec)(r)]
+
+    # A single string match per column is not worth a view
+    assert RuleSet([rules[0], rules[2]]).normalized_view(rows, {}) is None
+
+    broken = rows + [{'Direction': None, 'DOW': 'Sun', 'Duration': 10, 'Tags': 'news'}]
+    cache = {}
+    assert ruleset.filter(rules[2], broken, cache) == [rows[0]]
+    assert ruleset.normalized_view(broken, cache) is None
+    with pytest.raises(AttributeError):
+        ruleset.filter(rules[0], broken, cache)
@@ -0,0 +1,48 @@
+import sys
+import pytest
+import  hallmarkfe.supernova  as hallmarkfe
+from hallmarkfe.supernova.runner import HFELocalRunner, process_group
+
+from .conftest import make_calls, make_processor
+
+def build_manager(rules):
+    mgr = hallmarkfe.HFEManager({
+        'sequence': ['rules']
+    })
+    proc = make_processor()
+    proc.rules = rules
+    mgr.add_processor('rules', proc)
+    return mgr
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_runner(processes):
+    """
+    Test the local runner against the serial loop
+    """
+    df = make_calls()
+    rules = make_processor().rules
+
+    mgr = build_manager(rules)
+    expected = []
+    for key, rows in df.groupby(['In']):
+        expected.append(process_group(mgr, key[0], rows, 'calls'))
+
+    groups = [(key[0], rows) for key, rows in df.groupby(['In'])]
+    with HFELocalRunner(build_manager, args=(rules,),
+                        processes=processes, chunksize=1) as runner:
+        actual = list(runner.run(groups, 'calls'))
+        frame = runner.run_frame(df, 'In', 'calls')
+
+    assert actual == expected
+    assert list(frame.index) == [key for key, _ in expected]
+    for key, features in expected:
+        assert frame.loc[key].dropna().to_dict() == dict(features)
+
+def test_chunksize():
+    """
+    Test chunk sizing
+    """
+    runner = HFELocalRunner(build_manager, args=([],), processes=4)
+    assert runner.get_chunksize(1) == 1
+    assert runner.get_chunksize(1000) == 63
+    assert runner.get_chunksize() > 1
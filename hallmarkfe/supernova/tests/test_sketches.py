@@ -0,0 +1,132 @@
+import sys
+import copy
+import pytest
+import hallmarkfe.supernova  as hallmarkfe
+from hallmarkfe.supernova.sketches import (HyperLogLog, make_partial,
+                                           merge_states)
+from hallmarkfe.supernova.compact import HFECompactState
+
+from .conftest import make_calls, make_manager, make_fused
+
+def chunks(rows, size):
+    return [rows[i:i+size] for i in range(0, len(rows), size)]
+
+@pytest.mark.parametrize('size', [1, 2, 4])
+@pytest.mark.parametrize('statecls', [hallmarkfe.HFEAtomicState, HFECompactState])
+def test_update(size, statecls):
+    """
+    Updating with chunks of records matches processing them at once.
+    Features are listed in the order in which they first showed up.
+    """
+    mgr = make_fused()
+    rows = make_calls().to_dict('records')
+
+    expected = hallmarkfe.HFEAtomicState()
+    expected.set_data('calls', rows)
+    mgr.process(expected)
+
+    state = statecls()
+    for chunk in chunks(rows, size):
+        mgr.update(state, 'calls', chunk)
+
+    assert dict(state.get_all_features()) == dict(expected.get_all_features())
+
+def test_update_unsupported():
+    """
+    Custom metric handlers cannot be updated incrementally
+    """
+    mgr = make_manager()
+    state = hallmarkfe.HFEAtomicState()
+    with pytest.raises(Exception):
+        mgr.update(state, 'calls', make_calls().to_dict('records'))
+
+def test_update_processed():
+    """
+    Features computed by process cannot be updated
+    """
+    mgr = make_fused()
+    rows = make_calls().to_dict('records')
+
+    state = hallmarkfe.HFEAtomicState()
+    state.set_data('calls', rows[:-1])
+    mgr.process(state)
+    before = dict(state.get_all_features())
+
+    with pytest.raises(Exception) as exc:
+        mgr.update(state, 'calls', rows[-1:])
+    assert 'cannot be updated' in str(exc.value)
+    assert dict(state.get_all_features()) == before
+
+def test_merge_states():
+    """
+    States of different shards merge into the state of all records
+    """
+    mgr = make_fused()
+    rows = make_calls().to_dict('records')
+
+    expected = hallmarkfe.HFEAtomicState()
+    mgr.update(expected, 'calls', rows)
+
+    shards = []
+    for chunk in chunks(rows, 2):
+        shard = hallmarkfe.HFEAtomicState()
+        mgr.update(shard, 'calls', chunk)
+        shards.append(shard)
+
+    state = hallmarkfe.HFEAtomicState()
+    for shard in shards:
+        merge_states(state, shard)
+
+    assert dict(state.get_all_features()) == dict(expected.get_all_features())
+
+def test_partials():
+    """
+    Partial aggregates update and merge like the full aggregate
+    """
+    values = [5, 3, 8, 1, 9, 2]
+    for function, expected in [('sum', 28), ('min', 1), ('max', 9),
+                               ('avg', 28/6.0), ('size', 6)]:
+        first = make_partial(function)
+        first.update(values[:2])
+        second = make_partial(function)
+        second.update(values[2:])
+        first.merge(second)
+        assert first.value() == expected
+
+    with pytest.raises(Exception):
+        make_partial('median')
+
+    with pytest.raises(TypeError):
+        hallmarkfe.sketches.PartialAggregate()
+
+def test_hyperloglog():
+    """
+    Estimated unique counts are within a few standard errors
+    """
+    sketch = HyperLogLog()
+    other = HyperLogLog()
+    for i in range(20000):
+        sketch.update(['id{}'.format(i)])
+        other.update(['id{}'.format(i + 10000)])
+
+    assert abs(sketch.value() - 20000) < 0.05 * 20000
+
+    merged = copy.deepcopy(sketch)
+    merged.merge(other)
+    assert abs(merged.value() - 30000) < 0.05 * 30000
+
+    with pytest.raises(Exception):
+        sketch.merge(HyperLogLog(precision=10))
+
+def test_hyperloglog_numbers():
+    """
+    Equal numbers of different types count once, as in an exact count
+    """
+    import numpy as np
+
+    values = [1, 1.0, True, np.int64(1), np.float32(1), 2.5, np.float64(2.5), 'x']
+    sketch = HyperLogLog()
+    sketch.update(values)
+    exact = make_partial('count', exact=True)
+    exact.update(values)
+    assert sketch.value() == exact.value() == 3
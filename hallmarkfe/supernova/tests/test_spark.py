@@ -101,3 +101,43 @@ def test_basic_spark(sparkctx_local):
     collected = collected.collect()
     
     assert len(collected) == df.select('In').distinct().count() 
+
+def test_spark_runner(sparkctx_local):
+    """
+    Test the spark runner
+    """
+    from pyspark.sql import SparkSession
+    from hallmarkfe.supernova.spark import HFESparkRunner, features_schema
+
+    sc = sparkctx_local
+    spark = SparkSession(sc)
+
+    egg = find_egg()
+    sc.addPyFile(egg)
+    sc.addPyFile(os.path.join(thisdir, 'helper.py'))
+
+    fixture = os.path.join(thisdir, "fixtures", "call_log.csv")
+    df = spark.read.format("csv").option("header", "true").load(fixture)
+    def toseconds(s):
+        # s = 0:03:11
+        s = s.split(":")
+        return (int(s[0]) * 3600) + (int(s[1]) * 60) + (int(s[2].split(".")[0]))
+
+    toseconds_udf = udf(toseconds, IntegerType())
+    df = df.withColumn('DurationSeconds', toseconds_udf('Duration'))
+
+    from helper import build_mgr1, SimpleRuleProcessor1
+    proc = SimpleRuleProcessor1(conf={
+        'name': 'complex1',
+        'owner': 'marketing',
+        'manager': 'Manager'
+    })
+    with open(proc.datasets['complex_data']['metadata']) as json_file:
+        rules = json.load(json_file)['rules']
+
+    runner = HFESparkRunner(spark, build_mgr1, args=(rules,))
+    schema = features_schema(['In'], ['marketing__1__calls__xx__total'])
+    features = runner.run(df, ['In'], 'calls', schema)
+
+    assert features.count() == df.select('In').distinct().count()
+    assert features.schema == schema
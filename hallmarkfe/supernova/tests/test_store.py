@@ -0,0 +1,112 @@
+import sys
+import pytest
+import hallmarkfe.supernova  as hallmarkfe
+from hallmarkfe.supernova.compact import HFECompactState
+
+from .conftest import make_calls, make_fused
+
+def make_states():
+    states = []
+    for i, (name, value, flag, label) in enumerate([
+            ('a', 10, True, 'x'),
+            ('b', 2.5, False, None),
+            ('c', None, None, ['y', 1])]):
+        state = hallmarkfe.HFEAtomicState()
+        state.set_feature('index', i)
+        if value is not None:
+            state.set_feature('value', value)
+        if flag is not None:
+            state.set_feature('flag', flag)
+        if label is not None:
+            state.set_feature('label', label)
+        states.append((name, state))
+    return states
+
+def test_store(tmp_path):
+    """
+    Features read back from a snapshot match the states
+    """
+    path = str(tmp_path / 'states.hfe')
+    states = make_states()
+    assert hallmarkfe.HFEStateStore.write(path, states) == 3
+
+    with hallmarkfe.HFEStateStore(path) as store:
+        assert len(store) == 3
+        assert 'b' in store and 'z' not in store
+        assert store.get_feature_list() == ['index', 'value', 'flag', 'label']
+        for key, state in states:
+            assert dict(store.get_features(key)) == dict(state.get_all_features())
+        assert isinstance(store.get_features('a')['index'], int)
+        with pytest.raises(KeyError):
+            store.get_features('z')
+
+        df = store.to_frame()
+        assert list(df.index) == ['a', 'b', 'c']
+        assert df.loc['a', 'value'] == 10.0
+        assert df['value'].isnull().tolist() == [False, False, True]
+
+    with pytest.raises(Exception):
+        bad = tmp_path / 'bad.hfe'
+        bad.write_bytes(b'not a store')
+        hallmarkfe.HFEStateStore(str(bad)).open()
+
+def test_store_incremental(tmp_path):
+    """
+    States reloaded with their partials continue to update
+    """
+    path = str(tmp_path / 'states.hfe')
+    mgr = make_fused()
+    df = make_calls()
+    first, second = df.iloc[:3], df.iloc[3:]
+
+    states = []
+    for key, rows in first.groupby(['In']):
+        state = HFECompactState()
+        mgr.update(state, 'calls', rows.to_dict('records'))
+        states.append((key[0], state))
+    hallmarkfe.HFEStateStore.write(path, states)
+
+    with hallmarkfe.HFEStateStore(path) as store:
+        for key, rows in df.groupby(['In']):
+            expected = hallmarkfe.HFEAtomicState()
+            mgr.update(expected, 'calls', rows.to_dict('records'))
+
+            if key[0] in store:
+                state = store.load_state(key[0])
+            else:
+                state = hallmarkfe.HFEAtomicState()
+            mgr.update(state, 'calls', second[second['In'] == key[0]].to_dict('records'))
+
+            assert dict(state.get_all_features()) == dict(expected.get_all_features())
+
+def test_store_tuple_keys(tmp_path):
+    path = str(tmp_path / 'states.hfe')
+    state = hallmarkfe.HFEAtomicState()
+    state.set_feature('x', 1)
+    hallmarkfe.HFEStateStore.write(path, [(('a', 1), state)], partials=False)
+    with hallmarkfe.HFEStateStore(path) as store:
+        assert store.keys() == [('a', 1)]
+        assert store.load_state(('a', 1)).get_feature('x') == 1
+
+def test_store_exact_values(tmp_path):
+    """
+    Values a typed column cannot hold exactly are stored as they are
+    """
+    path = str(tmp_path / 'states.hfe')
+    states = []
+    for i, (big, mixed) in enumerate([(2 ** 70, 1), (-1, 2.5)]):
+        state = hallmarkfe.HFEAtomicState()
+        state.set_feature('big', big)
+        state.set_feature('mixed', mixed)
+        state.set_feature('none', None if i == 0 else 'x')
+        states.append((i, state))
+    hallmarkfe.HFEStateStore.write(path, states)
+
+    with hallmarkfe.HFEStateStore(path) as store:
+        first, second = store.get_features(0), store.get_features(1)
+        assert first['big'] == 2 ** 70 and second['big'] == -1
+        assert isinstance(first['mixed'], int) and first['mixed'] == 1
+        assert second['mixed'] == 2.5
+        assert 'none' in first and first['none'] is None
+        assert second['none'] == 'x'
+        assert store.load_state(0).get_all_features() == states[0][1].get_all_features()